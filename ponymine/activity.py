@@ -0,0 +1,125 @@
+"""
+Writes the append-only `Activity` rows that the activity feeds are read
+from, and reads them back.
+
+Every feed is ordered by `created` and paged by cursor, and the table is
+indexed by `(project, created)` and `(user, created)` (see
+`sql/activity.sql`), so a page of any feed is one range scan.
+"""
+from django.db import connection, transaction
+from ponymine.history import attach_changes
+from ponymine.models import Activity, Log, Project, Ticket
+from ponymine.utils import bulk_insert
+
+# how many tickets or logs to process at once when rebuilding
+CHUNK_SIZE = 1000
+
+TITLE_LENGTH = Activity._meta.get_field('title').max_length
+SUMMARY_LENGTH = Activity._meta.get_field('summary').max_length
+
+def _clip(text, length):
+    text = u' '.join(text.split())
+    if len(text) > length:
+        text = text[:length - 3] + u'...'
+    return text
+
+def summarize_log(log):
+    """
+    Describes a log by the attributes it changed, or by its notes if it
+    changed none.
+    """
+    labels = [unicode(change.label) for change in getattr(log, 'change_list', [])]
+    if labels:
+        return _clip(u', '.join(labels), SUMMARY_LENGTH)
+    return _clip(log.notes, SUMMARY_LENGTH)
+
+def ticket_activity(ticket):
+    return Activity(project_id=ticket.project_id, user_id=ticket.reported_by_id,
+                    ticket_id=ticket.id, kind='ticket_created',
+                    title=_clip(ticket.subject, TITLE_LENGTH),
+                    created=ticket.date_created)
+
+def log_activity(log):
+    ticket = log.ticket
+    return Activity(project_id=ticket.project_id, user_id=log.created_by_id,
+                    ticket_id=ticket.id, log_id=log.id, kind='ticket_changed',
+                    title=_clip(ticket.subject, TITLE_LENGTH),
+                    summary=summarize_log(log),
+                    created=log.date_created)
+
+def visible_activity(user=None):
+    """
+    Returns a QuerySet of the activity in all projects that `user` may see.
+    """
+    projects = Project.objects.for_user(user)
+    return Activity.objects.filter(project__in=projects.values('pk'))
+
+def project_activity(project):
+    return Activity.objects.filter(project=project)
+
+def user_activity(user, viewer=None):
+    """
+    Returns a QuerySet of what `user` did in the projects that `viewer` may
+    see.
+    """
+    return visible_activity(viewer).filter(user=user)
+
+@transaction.commit_on_success
+def rebuild_activity(tickets=None):
+    """
+    Writes the activity of the tickets in the `tickets` QuerySet, or of every
+    ticket, again from the tickets and their logs, for databases that predate
+    the activity table or tickets that were bulk imported.  Membership and
+    project activity is left alone.  Returns the number of rows written.
+    """
+    kinds = ['ticket_created', 'ticket_changed']
+    logs = Log.objects.all()
+    if tickets is None:
+        tickets = Ticket.objects.all()
+        # deleting through the ORM would load every row first
+        connection.cursor().execute(
+                'DELETE FROM %s WHERE kind IN (%%s, %%s)' %
+                connection.ops.quote_name(Activity._meta.db_table), kinds)
+    else:
+        Activity.objects.filter(ticket__in=tickets.values('pk'), kind__in=kinds).delete()
+        logs = logs.filter(ticket__in=tickets.values('pk'))
+
+    count, last_id = 0, 0
+    while True:
+        chunk = list(tickets.filter(pk__gt=last_id).order_by('id')[:CHUNK_SIZE])
+        if not chunk:
+            break
+        bulk_insert([ticket_activity(t) for t in chunk])
+        count += len(chunk)
+        last_id = chunk[-1].id
+
+    last_id = 0
+    while True:
+        chunk = logs.filter(pk__gt=last_id).select_related('ticket').order_by('id')
+        chunk = list(chunk[:CHUNK_SIZE])
+        if not chunk:
+            break
+        attach_changes(chunk)
+        bulk_insert([log_activity(log) for log in chunk])
+        count += len(chunk)
+        last_id = chunk[-1].id
+
+    return count
+
+def ticket_saved(sender, instance, created=False, **kwargs):
+    if created:
+        ticket_activity(instance).save()
+
+def logs_created(sender, logs, **kwargs):
+    bulk_insert([log_activity(log) for log in logs if log.id])
+
+def membership_saved(sender, instance, created=False, **kwargs):
+    if created:
+        Activity.objects.create(project_id=instance.project_id,
+                                user_id=instance.user_id, kind='member_added',
+                                title=_clip(instance.user.username, TITLE_LENGTH))
+
+def project_saved(sender, instance, created=False, **kwargs):
+    Activity.objects.create(project=instance,
+                            kind=created and 'project_created' or 'project_changed',
+                            title=_clip(instance.name, TITLE_LENGTH))
@@ -15,7 +15,7 @@ class ProjectAdmin(admin.ModelAdmin):
     prepopulated_fields = slug_from_name
 
     def ticket_count(self, project):
-        return project.tickets.count()
+        return project.ticket_count
 
 class MembershipAdmin(admin.ModelAdmin):
     list_display = (the_project, 'user', 'role')
@@ -0,0 +1,49 @@
+"""
+Helpers shared by the various caches in Ponymine.  Everything is stored
+through Django's cache framework, so a shared backend such as memcached must
+be configured for invalidation to reach every process.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.hashcompat import md5_constructor
+import time
+
+KEY_PREFIX = getattr(settings, 'PONYMINE_CACHE_PREFIX', 'ponymine')
+
+# versions should outlive the entries that depend on them
+VERSION_TIMEOUT = 60 * 60 * 24 * 30
+
+def make_key(*bits):
+    """
+    Builds a cache key out of `bits`.  Keys that would be too long or contain
+    characters memcached does not allow are hashed.
+    """
+    key = u':'.join([KEY_PREFIX] + [unicode(b) for b in bits]).encode('utf-8')
+    if len(key) > 200 or [c for c in key if c <= ' ' or c > '~']:
+        key = '%s:%s' % (KEY_PREFIX, md5_constructor(key).hexdigest())
+    return key
+
+def get_version(*bits):
+    """
+    Returns the current version number of the namespace described by `bits`.
+    Cache entries that include the version in their key are invalidated
+    wholesale by `bump_version`.
+    """
+    key = make_key('version', *bits)
+    version = cache.get(key)
+    if version is None:
+        # start from the clock so an evicted version is never reused
+        version = int(time.time() * 1000)
+        cache.add(key, version, VERSION_TIMEOUT)
+    return version
+
+def bump_version(*bits):
+    """
+    Invalidates every cache entry built with the namespace described by
+    `bits`.
+    """
+    key = make_key('version', *bits)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, int(time.time() * 1000), VERSION_TIMEOUT)
@@ -0,0 +1,137 @@
+"""
+Maintains the denormalized ticket counters stored on each `Project` and in
+`ProjectStatusCount`.  The counters are adjusted incrementally as tickets are
+saved and deleted; `rebuild_ticket_counts` recomputes all of them from
+scratch in case they ever drift.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from ponymine.models import Project, ProjectStatusCount, Status, Ticket
+
+def _counter_field(status_id):
+    if status_id in Ticket.objects.closed_statuses:
+        return 'closed_ticket_count'
+    return 'open_ticket_count'
+
+def _adjust_project(project_id, field, delta):
+    Project._base_manager.filter(pk=project_id).update(**{field: F(field) + delta})
+
+def _adjust_bucket(project_id, status_id, delta):
+    buckets = ProjectStatusCount.objects.filter(project=project_id,
+                                                status=status_id)
+    if not buckets.update(count=F('count') + delta):
+        sid = transaction.savepoint()
+        try:
+            ProjectStatusCount.objects.create(project_id=project_id,
+                                              status_id=status_id,
+                                              count=delta)
+            transaction.savepoint_commit(sid)
+        except IntegrityError:
+            # somebody else created the bucket in the meantime
+            transaction.savepoint_rollback(sid)
+            buckets.update(count=F('count') + delta)
+
+def adjust_counts(old, new):
+    """
+    Moves one ticket from the `(project_id, status_id)` bucket `old` to the
+    bucket `new`.  Either one may be `None` for tickets that are being
+    created or deleted.
+    """
+    if old == new:
+        return
+
+    old_field = old and _counter_field(old[1])
+    new_field = new and _counter_field(new[1])
+
+    if old:
+        _adjust_bucket(old[0], old[1], -1)
+        if (old[0], old_field) != (new and new[0], new_field):
+            _adjust_project(old[0], old_field, -1)
+
+    if new:
+        _adjust_bucket(new[0], new[1], 1)
+        if (new[0], new_field) != (old and old[0], old_field):
+            _adjust_project(new[0], new_field, 1)
+
+def ticket_saved(sender, instance, created=False, **kwargs):
+    old = not created and instance._original_state or None
+    new = (instance.project_id, instance.status_id)
+    adjust_counts(old, new)
+
+def ticket_deleted(sender, instance, **kwargs):
+    adjust_counts(instance._original_state, None)
+
+def tickets_updated(sender, tickets, **kwargs):
+    """
+    Recounts the projects that tickets were moved between, or in which they
+    changed status.
+    """
+    project_ids = set()
+    for ticket in tickets:
+        old = ticket._original_state
+        if old != (ticket.project_id, ticket.status_id):
+            project_ids.update([old[0], ticket.project_id])
+    if project_ids:
+        rebuild_ticket_counts(project_ids)
+
+def status_saving(sender, instance, **kwargs):
+    """
+    Remembers whether a status was closed before it is saved.
+    """
+    instance._was_closed = False
+    if instance.id:
+        closed = Status.objects.filter(pk=instance.id, is_closed=True)
+        instance._was_closed = bool(closed.count())
+
+def status_saved(sender, instance, created=False, **kwargs):
+    """
+    Moves the tickets that have a particular status between the open and
+    closed counters when the status is opened or closed.
+    """
+    if created or bool(instance._was_closed) == bool(instance.is_closed):
+        return
+
+    if instance.is_closed:
+        src, dest = 'open_ticket_count', 'closed_ticket_count'
+    else:
+        src, dest = 'closed_ticket_count', 'open_ticket_count'
+
+    buckets = ProjectStatusCount.objects.filter(status=instance, count__gt=0)
+    for project_id, count in buckets.values_list('project', 'count'):
+        Project._base_manager.filter(pk=project_id).update(
+                **{src: F(src) - count, dest: F(dest) + count})
+
+@transaction.commit_on_success
+def rebuild_ticket_counts(project_ids=None):
+    """
+    Recomputes the ticket counters of the projects in `project_ids`, or of
+    every project, from the tickets themselves.  Returns the number of those
+    projects that have tickets.
+    """
+    closed = set(Status.objects.filter(is_closed=True).values_list('id', flat=True))
+    tickets = Ticket.objects.order_by()
+    buckets = ProjectStatusCount.objects.all()
+    projects = Project._base_manager.all()
+    if project_ids is not None:
+        project_ids = list(project_ids)
+        tickets = tickets.filter(project__in=project_ids)
+        buckets = buckets.filter(project__in=project_ids)
+        projects = projects.filter(pk__in=project_ids)
+    rows = tickets.values('project', 'status').annotate(count=Count('id'))
+
+    totals = {}
+    buckets.delete()
+    for row in rows:
+        ProjectStatusCount.objects.create(project_id=row['project'],
+                                          status_id=row['status'],
+                                          count=row['count'])
+        counts = totals.setdefault(row['project'], [0, 0])
+        counts[row['status'] in closed] += row['count']
+
+    projects.update(open_ticket_count=0, closed_ticket_count=0)
+    for project_id, (open_count, closed_count) in totals.items():
+        Project._base_manager.filter(pk=project_id).update(
+                open_ticket_count=open_count,
+                closed_ticket_count=closed_count)
+
+    return len(totals)
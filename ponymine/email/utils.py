@@ -1,18 +1,289 @@
+"""
+Turns the messages in a POP3 mailbox into tickets.
+
+Messages are listed with UIDL and only the ones whose unique IDs have not
+been recorded as `InboundMessage` rows are retrieved.  They are fetched in
+batches of at most `PONYMINE_MAIL_BATCH_BYTES` and parsed across a pool of
+worker processes.  A message whose
+subject mentions an existing ticket (such as "Re: [Project] Bug #12 - ...")
+becomes a reply on that ticket; any other message opens a new ticket in the
+mailbox's project.  Attachments are stored through `ponymine.ext.attachments`
+when it is installed.  Messages that were imported, or rejected because
+the sender has no access, are deleted from the mailbox; messages that could
+not be parsed or saved are left there to be tried again.
+
+Messages larger than `PONYMINE_MAIL_MAX_SIZE` bytes are only fetched in part
+(with TOP), and their attachments are dropped, so that a single huge message
+cannot exhaust the memory of the workers.
+"""
+from __future__ import absolute_import
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, transaction
+from django.utils.html import strip_tags
+from email.header import decode_header
+from email.utils import parseaddr
+from ponymine.models import Project, Ticket, InboundMessage
+from ponymine.utils import log_ticket_changes
+import email
+import multiprocessing
 import poplib
+import re
 
-def check_mail(user, passwd, server='localhost', ssl=False, port=110):
-    # connect to the server
-    mailbox = ssl and poplib.POP3_SSL(server, port) or poplib.POP3(server, port)
+MAX_SIZE = getattr(settings, 'PONYMINE_MAIL_MAX_SIZE', 10 * 1024 * 1024)
+
+# how many lines of the body to fetch for messages over MAX_SIZE
+TRUNCATED_LINES = 500
+
+# how many bytes of messages to fetch before handing them to the workers
+BATCH_BYTES = getattr(settings, 'PONYMINE_MAIL_BATCH_BYTES', 20 * 1024 * 1024)
+
+TICKET_ID_RE = re.compile(r'#(\d+)\b')
+
+def _decode_header(value):
+    parts = []
+    for text, charset in decode_header(value or ''):
+        try:
+            parts.append(text.decode(charset or 'ascii', 'replace'))
+        except LookupError:
+            parts.append(text.decode('ascii', 'replace'))
+    return u' '.join(parts)
+
+def _decode_part(part):
+    payload = part.get_payload(decode=True) or ''
+    charset = part.get_content_charset() or 'ascii'
+    try:
+        return payload.decode(charset, 'replace')
+    except LookupError:
+        return payload.decode('ascii', 'replace')
+
+def parse_message(raw, truncated=False):
+    """
+    Parses the raw text of a message into a dictionary with the `sender`,
+    `subject`, `body` and `attachments` (a list of `(filename, content type,
+    data)` tuples).  This doesn't touch the database, so it can run in a
+    worker process.
+    """
+    message = email.message_from_string(raw)
+
+    text, html, attachments = None, None, []
+    for part in message.walk():
+        if part.is_multipart():
+            continue
+
+        filename = part.get_filename()
+        content_type = part.get_content_type()
+        if filename or part.get('Content-Disposition', '').startswith('attachment'):
+            if not truncated:
+                attachments.append((_decode_header(filename) or 'attachment',
+                                    content_type,
+                                    part.get_payload(decode=True) or ''))
+        elif content_type == 'text/plain' and text is None:
+            text = _decode_part(part)
+        elif content_type == 'text/html' and html is None:
+            html = _decode_part(part)
+
+    body = text
+    if body is None:
+        body = html is not None and strip_tags(html) or u''
+
+    return {
+        'sender': parseaddr(message.get('From', ''))[1].lower(),
+        'subject': _decode_header(message.get('Subject', '')).strip(),
+        'body': body.strip(),
+        'attachments': attachments,
+        'truncated': truncated,
+    }
+
+def _parse(args):
+    """
+    Returns `(uid, message, error)`, where `error` describes why a message
+    could not be parsed.
+    """
+    uid, raw, truncated = args
+    try:
+        return uid, parse_message(raw, truncated), None
+    except Exception, err:
+        return uid, None, u'%s: %s' % (err.__class__.__name__, err)
+
+def _batches(messages):
+    """
+    Splits the `(number, uid, size)` triples in `messages` into lists whose
+    messages add up to no more than `BATCH_BYTES` as they will be fetched.
+    """
+    batch, batch_size = [], 0
+    for message in messages:
+        size = min(message[2], MAX_SIZE)
+        if batch and batch_size + size > BATCH_BYTES:
+            yield batch
+            batch, batch_size = [], 0
+        batch.append(message)
+        batch_size += size
+    if batch:
+        yield batch
+
+class MailIngester(object):
+    """
+    Processes the messages of a POP3 mailbox.  `mailbox` is a logged in
+    `poplib.POP3` object (or anything with the same methods) and `name`
+    identifies it in the `InboundMessage` table.  New tickets are opened in
+    `project`.  `failed` collects a `(uid, message)` pair for every message
+    that was left in the mailbox because it could not be imported.
+    """
+    def __init__(self, mailbox, name, project, processes=None):
+        self.mailbox = mailbox
+        self.name = name
+        self.project = project
+        self.processes = processes
+        self.created = self.replied = self.rejected = 0
+        self.failed = []
 
-    # login
+    def _messages(self):
+        """
+        Returns a list of `(number, uid, size)` for every message.
+        """
+        sizes = {}
+        for line in self.mailbox.list()[1]:
+            number, size = line.split()[:2]
+            sizes[int(number)] = int(size)
+
+        messages = []
+        for line in self.mailbox.uidl()[1]:
+            number, uid = line.split()[:2]
+            messages.append((int(number), uid, sizes.get(int(number), 0)))
+        return messages
+
+    def _fetch(self, number, size):
+        if size > MAX_SIZE:
+            return '\r\n'.join(self.mailbox.top(number, TRUNCATED_LINES)[1]), True
+        return '\r\n'.join(self.mailbox.retr(number)[1]), False
+
+    def run(self):
+        """
+        Processes every new message, deletes the processed ones and closes
+        the mailbox.
+        """
+        messages = self._messages()
+        numbers = dict((uid, number) for number, uid, size in messages)
+        seen = set(InboundMessage.objects.filter(mailbox=self.name,
+                        uid__in=numbers.keys()).values_list('uid', flat=True))
+
+        # messages that were processed before but not deleted
+        for uid in seen:
+            self.mailbox.dele(numbers[uid])
+
+        pool = None
+        if self.processes != 1:
+            pool = multiprocessing.Pool(self.processes)
+        try:
+            new = [(number, uid, size) for number, uid, size in messages
+                                       if uid not in seen]
+            for batch in _batches(new):
+                batch = [(uid,) + self._fetch(number, size)
+                         for number, uid, size in batch]
+                parsed = pool and pool.imap(_parse, batch) or map(_parse, batch)
+                for uid, message, error in parsed:
+                    if error is None:
+                        try:
+                            if self.process(uid, message):
+                                self.mailbox.dele(numbers[uid])
+                            continue
+                        except Exception, err:
+                            error = u'%s: %s' % (err.__class__.__name__, err)
+                    # leave the message in the mailbox for another try
+                    self.failed.append((uid, error))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        # deletions only take effect when the session ends properly
+        self.mailbox.quit()
+
+    @transaction.commit_on_success
+    def process(self, uid, message):
+        """
+        Turns one parsed message into a ticket or a reply.  Returns `True`
+        when the message may be deleted from the mailbox.
+        """
+        record = InboundMessage(mailbox=self.name, uid=uid)
+        ticket, user = None, None
+
+        if message['sender']:
+            users = User.objects.filter(email__iexact=message['sender'],
+                                        is_active=True)
+            user = (list(users[:1]) or [None])[0]
+        projects = Project.objects.for_user(user)
+
+        match = TICKET_ID_RE.search(message['subject'])
+        if match:
+            tickets = Ticket.objects.filter(pk=int(match.group(1)),
+                                            project__in=projects.values('pk'))
+            ticket = (list(tickets[:1]) or [None])[0]
+
+        # from somebody without access, or an empty reply
+        outcome = 'rejected'
+        if ticket is not None and message['body']:
+            record.log = log_ticket_changes([(ticket, ticket)], user,
+                                            message['body'])[0]
+            outcome = 'replied'
+        elif ticket is None and projects.filter(pk=self.project.id).count():
+            ticket = Ticket.objects.create(project=self.project,
+                                           reported_by=user,
+                                           subject=message['subject'][:100] or u'(no subject)',
+                                           description=message['body'])
+            outcome = 'created'
+
+        if ticket is not None:
+            record.ticket = ticket
+            self._attach(ticket, user, message['attachments'])
+
+        try:
+            record.save()
+        except IntegrityError:
+            # somebody else processed this message in the meantime
+            transaction.rollback()
+            return False
+
+        # only count what is about to be committed
+        setattr(self, outcome, getattr(self, outcome) + 1)
+        return True
+
+    def _attach(self, ticket, user, attachments):
+        if not attachments or 'ponymine.ext.attachments' not in settings.INSTALLED_APPS:
+            return
+
+        from ponymine.ext.attachments.storage import create_attachment
+        for filename, content_type, data in attachments:
+            create_attachment(ContentFile(data), filename, ticket=ticket,
+                              owner=user, file_type=content_type)
+
+def connect(user, passwd, server='localhost', ssl=False, port=110):
+    """
+    Returns a logged in POP3 connection.
+    """
+    mailbox = ssl and poplib.POP3_SSL(server, port) or poplib.POP3(server, port)
     mailbox.user(user)
     mailbox.pass_(passwd)
+    return mailbox
 
-    # get messages
-    message_count = len(mailbox.list()[1])
-    for i in range(message_count):
-        for m in mailbox.retr(i + 1)[1]:
-            print m
+def check_mail(user, passwd, server='localhost', ssl=False, port=110,
+               project=None, processes=None):
+    """
+    Turns the new messages in the mailbox of `user` into tickets in
+    `project` (a Project or a project path).  Returns the `MailIngester`,
+    which counts the tickets created, replies added and messages rejected,
+    and lists the messages that failed.
+    """
+    if not isinstance(project, Project):
+        project = Project.objects.with_path(project or settings.PONYMINE_MAIL_PROJECT)
+        if project is None:
+            raise ValueError('Unknown project for incoming mail')
 
-if __name__ == '__main__':
-    check_mail('wheaties_')
\ No newline at end of file
+    name = '%s@%s:%s' % (user, server, port)
+    ingester = MailIngester(connect(user, passwd, server, ssl, port), name,
+                            project, processes)
+    ingester.run()
+    return ingester
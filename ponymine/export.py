@@ -0,0 +1,164 @@
+"""
+Streams tickets (and optionally their history) out as CSV or JSON lines.
+
+Tickets are read in chunks ordered by ID, each chunk continuing after the
+last ID of the previous one, so memory use stays flat no matter how many
+tickets are exported.  Statuses, priorities and ticket types are resolved
+from the lookup cache instead of being joined.
+"""
+from django.utils import simplejson
+from ponymine.history import load_histories
+from ponymine.lookups import get_table
+from ponymine.models import Project, Ticket, TicketType, Status, Priority
+import csv
+import StringIO
+
+FORMATS = {
+    'csv': 'text/csv',
+    'json': 'application/x-json-stream',
+}
+
+COLUMNS = ('id', 'project', 'ticket_type', 'status', 'priority', 'component',
+           'reported_by', 'assigned_to', 'subject', 'description', 'keywords',
+           'date_created', 'date_updated')
+
+# how many tickets to read at once
+CHUNK_SIZE = 500
+
+def _text(value):
+    if value is None:
+        return u''
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return unicode(value)
+
+def _change_text(value):
+    # projects are written as paths, like the `project` column, because
+    # their names are only unique among their siblings
+    if isinstance(value, Project):
+        return value.slug_path
+    return _text(value)
+
+def visible_tickets(user=None, project=None):
+    """
+    Returns a QuerySet of the tickets that `user` may see, optionally limited
+    to a single project.
+    """
+    tickets = Ticket.objects.filter(project__in=Project.objects.for_user(user).values('pk'))
+    if project is not None:
+        tickets = tickets.filter(project=project)
+    return tickets
+
+def iter_tickets(tickets, chunk_size=CHUNK_SIZE, history=False):
+    """
+    Yields a `(ticket, logs)` pair for every ticket in the QuerySet
+    `tickets`, in order of ID.  `logs` is `None` unless `history` is set.
+    """
+    tickets = tickets.select_related('project', 'component', 'reported_by',
+                                     'assigned_to')
+    last_id = 0
+    while True:
+        chunk = list(tickets.filter(pk__gt=last_id).order_by('id')[:chunk_size].iterator())
+        if not chunk:
+            break
+
+        histories = history and load_histories(chunk) or {}
+        for ticket in chunk:
+            yield ticket, histories.get(ticket.id)
+        last_id = chunk[-1].id
+
+def ticket_record(ticket):
+    """
+    Returns a dictionary with the exported columns of `ticket`.
+    """
+    types, statuses, priorities = [get_table(m) for m in (TicketType, Status, Priority)]
+    return {
+        'id': ticket.id,
+        'project': ticket.project.slug_path,
+        'ticket_type': _text(types.get(ticket.ticket_type_id)),
+        'status': _text(statuses.get(ticket.status_id)),
+        'priority': _text(priorities.get(ticket.priority_id)),
+        'component': _text(ticket.component),
+        'reported_by': _text(ticket.reported_by),
+        'assigned_to': _text(ticket.assigned_to),
+        'subject': ticket.subject,
+        'description': ticket.description,
+        'keywords': ticket.keywords,
+        'date_created': _text(ticket.date_created),
+        'date_updated': _text(ticket.date_updated),
+    }
+
+def history_record(logs):
+    """
+    Returns a list of dictionaries describing `logs` as loaded by
+    `ponymine.history.load_histories`.
+    """
+    records = []
+    for log in logs:
+        changes = []
+        for change in log.change_list:
+            if change.content_type_id:
+                changes.append({
+                    'attribute': change.content_type.name,
+                    'old': change.old_value and _change_text(change.old_value),
+                    'new': change.new_value and _change_text(change.new_value),
+                })
+        records.append({
+            'created_by': log.created_by and _text(log.created_by),
+            'date_created': _text(log.date_created),
+            'notes': log.notes,
+            'changes': changes,
+        })
+    return records
+
+def _csv_lines(pairs, history):
+    buffer = StringIO.StringIO()
+    writer = csv.writer(buffer)
+
+    columns = list(COLUMNS)
+    if history:
+        # CSV cannot nest, so the history goes into one column as JSON
+        columns.append('history')
+    writer.writerow(columns)
+
+    for count, (ticket, logs) in enumerate(pairs):
+        record = ticket_record(ticket)
+        row = [_text(record[c]) for c in COLUMNS]
+        if history:
+            row.append(simplejson.dumps(history_record(logs)))
+        writer.writerow([value.encode('utf-8') for value in row])
+
+        if count % CHUNK_SIZE == CHUNK_SIZE - 1:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+def _json_lines(pairs, history):
+    lines = []
+    for ticket, logs in pairs:
+        record = ticket_record(ticket)
+        if history:
+            record['history'] = history_record(logs)
+        lines.append(simplejson.dumps(record) + '\n')
+
+        if len(lines) >= CHUNK_SIZE:
+            yield ''.join(lines)
+            lines = []
+
+    yield ''.join(lines)
+
+def export_tickets(tickets, format='csv', history=False, chunk_size=CHUNK_SIZE):
+    """
+    Returns an iterator of strings that make up the export of `tickets` in
+    `format` (one of `FORMATS`).  When `history` is set, the logs and changes
+    of each ticket are included.
+    """
+    if format not in FORMATS:
+        raise ValueError('Unknown export format: %s' % format)
+
+    pairs = iter_tickets(tickets, chunk_size, history)
+    if format == 'csv':
+        return _csv_lines(pairs, history)
+    return _json_lines(pairs, history)
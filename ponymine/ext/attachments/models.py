@@ -1,17 +1,62 @@
 from django.db import models
+from django.db.models import signals
 from django.conf import settings
 from django.contrib.auth.models import User
+from ponymine.models import Ticket
+from ponymine.fragments import touch_projects
+import datetime
 
 UPLOAD_DIR = getattr(settings, 'PONYMINE_ATTACH_DIR', 'attachments/')
 DEFAULT_TYPE = getattr(settings, 'PONYMINE_ATTACH_TYPE', 'text/plain')
 
+class Blob(models.Model):
+    """
+    The contents of one or more attachments, stored once under their SHA-256
+    digest.  See `ponymine.ext.attachments.storage`.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    size = models.BigIntegerField()
+    data = models.FileField(upload_to=UPLOAD_DIR, max_length=255)
+    date_created = models.DateTimeField(auto_now_add=True)
+
+    def __unicode__(self):
+        return self.sha256
+
 class Attachment(models.Model):
-    owner = models.ForeignKey(User)
+    owner = models.ForeignKey(User, blank=True, null=True)
+    ticket = models.ForeignKey(Ticket, related_name='attachments', blank=True, null=True)
     description = models.CharField(max_length=255, blank=True)
     file_type = models.CharField(max_length=50, default=DEFAULT_TYPE)
-    attachment = models.FileField(upload_to=UPLOAD_DIR)
+    filename = models.CharField(max_length=255, blank=True)
+    blob = models.ForeignKey(Blob, related_name='attachments', blank=True, null=True)
+    # files uploaded before content-addressed storage
+    attachment = models.FileField(upload_to=UPLOAD_DIR, blank=True)
     ip_address = models.IPAddressField(blank=True, null=True)
     date_created = models.DateTimeField(auto_now_add=True)
-    
-    class Meta:
-        unique_together = ('file_type', 'attachment')
\ No newline at end of file
+
+    def __unicode__(self):
+        return self.filename or self.attachment.name
+
+    def get_absolute_url(self):
+        return ('ponymine_download_attachment', [], {'attachment_id': self.id})
+    get_absolute_url = models.permalink(get_absolute_url)
+
+    def _get_file(self):
+        """
+        Returns the stored file, whichever way it was stored.
+        """
+        return self.blob_id and self.blob.data or self.attachment
+    file = property(_get_file)
+
+def attachment_changed(sender, instance, **kwargs):
+    """
+    Marks the ticket of an attachment as updated, so that cached pages of it
+    are refreshed.
+    """
+    if instance.ticket_id:
+        tickets = Ticket.objects.filter(pk=instance.ticket_id)
+        tickets.update(date_updated=datetime.datetime.now())
+        touch_projects(*tickets.values_list('project', flat=True))
+
+signals.post_save.connect(attachment_changed, sender=Attachment)
+signals.post_delete.connect(attachment_changed, sender=Attachment)
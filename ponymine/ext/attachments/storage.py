@@ -0,0 +1,95 @@
+"""
+Content-addressed storage for attachments.
+
+Uploads are copied to a temporary file in chunks while their SHA-256 digest
+is computed, then moved to a path derived from the digest.  Identical files
+are only stored once: every `Attachment` of the same content points at the
+same `Blob`.  Nothing here reads a whole file into memory.
+"""
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from ponymine.ext.attachments.models import Attachment, Blob, UPLOAD_DIR
+import hashlib
+import os
+import tempfile
+
+CHUNK_SIZE = 64 * 1024
+
+storage = FileSystemStorage()
+
+def blob_name(digest):
+    """
+    Returns the storage name of the blob with the hex SHA-256 `digest`.
+    """
+    return os.path.join(UPLOAD_DIR, 'blobs', digest[:2], digest[2:4], digest)
+
+def _chunks(fileobj):
+    if hasattr(fileobj, 'chunks'):
+        for chunk in fileobj.chunks(CHUNK_SIZE):
+            yield chunk
+    else:
+        while True:
+            chunk = fileobj.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+def store_blob(fileobj):
+    """
+    Stores the contents of `fileobj` (an UploadedFile, a File or anything
+    with `read`) and returns its `Blob`, which may already have existed.
+    """
+    directory = storage.path(os.path.join(UPLOAD_DIR, 'blobs'))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    digest, size = hashlib.sha256(), 0
+    handle, temp_path = tempfile.mkstemp(dir=directory, prefix='upload-')
+    try:
+        temp = os.fdopen(handle, 'wb')
+        try:
+            for chunk in _chunks(fileobj):
+                digest.update(chunk)
+                size += len(chunk)
+                temp.write(chunk)
+        finally:
+            temp.close()
+
+        digest = digest.hexdigest()
+        existing = list(Blob.objects.filter(sha256=digest)[:1])
+        if existing:
+            return existing[0]
+
+        name = blob_name(digest)
+        path = storage.path(name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        os.rename(temp_path, path)
+
+        sid = transaction.savepoint()
+        try:
+            blob = Blob.objects.create(sha256=digest, size=size, data=name)
+            transaction.savepoint_commit(sid)
+        except IntegrityError:
+            # somebody stored the same content at the same time; the file
+            # we moved into place is identical to theirs
+            transaction.savepoint_rollback(sid)
+            blob = Blob.objects.get(sha256=digest)
+        return blob
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def create_attachment(fileobj, filename, ticket=None, owner=None,
+                      file_type=None, description='', ip_address=None):
+    """
+    Stores `fileobj` and returns a new `Attachment` for it.
+    """
+    blob = store_blob(fileobj)
+    attachment = Attachment(blob=blob, filename=os.path.basename(filename)[:255],
+                            ticket=ticket, owner=owner, description=description,
+                            ip_address=ip_address)
+    if file_type:
+        attachment.file_type = file_type[:50]
+    attachment.save()
+    return attachment
@@ -0,0 +1,9 @@
+from django.conf.urls.defaults import *
+from ponymine.ext.attachments import views
+
+urlpatterns = patterns('',
+    url(r'^(?P<attachment_id>\d+)/$', views.download_attachment,
+        name='ponymine_download_attachment'),
+    url(r'^ticket/(?P<ticket_id>\d+)/$', views.upload_attachment,
+        name='ponymine_upload_attachment'),
+)
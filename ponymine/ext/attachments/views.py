@@ -0,0 +1,138 @@
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.http import Http404, HttpResponse, HttpResponseNotModified, \
+                        HttpResponseRedirect
+from django.shortcuts import get_object_or_404
+from django.utils.http import http_date
+from django.views.decorators.http import require_POST
+from ponymine.ext.attachments.models import Attachment
+from ponymine.ext.attachments.storage import CHUNK_SIZE, create_attachment
+from ponymine.models import Ticket
+from ponymine import utils
+import os
+import re
+
+# 'X-Sendfile' (Apache, lighttpd) or 'X-Accel-Redirect' (nginx) hands the
+# actual transfer of files over to the web server
+SENDFILE_HEADER = getattr(settings, 'PONYMINE_ATTACH_SENDFILE', None)
+
+# the internal nginx location that maps to MEDIA_ROOT
+ACCEL_PREFIX = getattr(settings, 'PONYMINE_ATTACH_ACCEL_PREFIX', '/protected/')
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+def _parse_range(header, size):
+    """
+    Returns the `(first, last)` byte positions requested by a single-range
+    `Range` header, `None` if the header should be ignored, or `False` if the
+    range cannot be satisfied.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+
+    first, last = match.groups()
+    if first == '':
+        # the last N bytes
+        first, last = max(size - int(last), 0), size - 1
+    else:
+        first = int(first)
+        last = last and min(int(last), size - 1) or size - 1
+
+    if first >= size or first > last:
+        return False
+    return first, last
+
+def _read(path, first, length):
+    handle = open(path, 'rb')
+    try:
+        handle.seek(first)
+        while length > 0:
+            chunk = handle.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        handle.close()
+
+def download_attachment(request, attachment_id):
+    """
+    Serves the contents of an attachment.  Files are streamed in chunks (or
+    handed to the web server when `PONYMINE_ATTACH_SENDFILE` is set) and
+    single byte ranges are supported.
+    """
+    attachment = get_object_or_404(Attachment.objects.select_related('blob'),
+                                   pk=attachment_id)
+    if attachment.ticket_id:
+        ticket = Ticket.objects.select_related('project').get(pk=attachment.ticket_id)
+        utils.check_membership(ticket.project, request.user)
+
+    stored = attachment.file
+    if not stored or not os.path.exists(stored.path):
+        raise Http404()
+    path = stored.path
+    size = os.path.getsize(path)
+
+    if attachment.blob_id:
+        etag = '"%s"' % attachment.blob.sha256
+    else:
+        etag = '"%x-%x"' % (os.path.getmtime(path), size)
+    if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+        return HttpResponseNotModified()
+
+    filename = (attachment.filename or os.path.basename(stored.name)).replace('"', '')
+    disposition = 'attachment; filename="%s"' % filename.encode('utf-8')
+
+    if SENDFILE_HEADER:
+        response = HttpResponse(mimetype=attachment.file_type)
+        if SENDFILE_HEADER == 'X-Accel-Redirect':
+            response[SENDFILE_HEADER] = ACCEL_PREFIX.rstrip('/') + '/' + stored.name
+        else:
+            response[SENDFILE_HEADER] = path
+        response['ETag'] = etag
+        response['Content-Disposition'] = disposition
+        return response
+
+    first, last = 0, size - 1
+    status = 200
+    requested = request.META.get('HTTP_RANGE')
+    if requested and request.META.get('HTTP_IF_RANGE', etag) == etag:
+        requested = _parse_range(requested, size)
+        if requested is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%i' % size
+            return response
+        if requested:
+            first, last = requested
+            status = 206
+
+    length = max(last - first + 1, 0)
+    response = HttpResponse(_read(path, first, length), status=status,
+                            mimetype=attachment.file_type)
+    response['Content-Length'] = str(length)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(os.path.getmtime(path))
+    response['Content-Disposition'] = disposition
+    if status == 206:
+        response['Content-Range'] = 'bytes %i-%i/%i' % (first, last, size)
+    return response
+
+@login_required
+@require_POST
+def upload_attachment(request, ticket_id):
+    """
+    Attaches the uploaded `file` to a ticket.
+    """
+    ticket = get_object_or_404(Ticket.objects.select_related('project'), pk=ticket_id)
+    utils.check_membership(ticket.project, request.user)
+
+    upload = request.FILES.get('file')
+    if upload is not None:
+        create_attachment(upload, upload.name, ticket=ticket, owner=request.user,
+                          file_type=upload.content_type,
+                          description=request.POST.get('description', '')[:255],
+                          ip_address=request.META.get('REMOTE_ADDR'))
+
+    return HttpResponseRedirect(ticket.get_absolute_url())
@@ -1,5 +1,7 @@
 from django.db import models
+from django.db.models import signals
 from ponymine.models import Project, Ticket
+from ponymine.signals import connect, tickets_updated
 
 class Milestone(models.Model):
     project = models.ForeignKey(Project)
@@ -11,6 +13,17 @@ class Milestone(models.Model):
     class Meta:
         ordering = ('-due_date', 'name')
 
+    def __unicode__(self):
+        return self.name
+
 if not getattr(Ticket, 'milestone', None):
     # Add a milestone column to our Ticket class if it hasn't been added yet
-    Ticket.add_to_class('milestone', models.ForeignKey(Milestone, blank=True, null=True))
\ No newline at end of file
+    Ticket.add_to_class('milestone', models.ForeignKey(Milestone, blank=True, null=True))
+
+# throw away cached roadmaps when tickets or milestones change
+connect(signals.post_save, 'ponymine.ext.milestones.roadmap.ticket_changed', Ticket)
+connect(signals.post_delete, 'ponymine.ext.milestones.roadmap.ticket_changed', Ticket)
+connect(tickets_updated, 'ponymine.ext.milestones.roadmap.tickets_updated')
+connect(signals.post_save, 'ponymine.ext.milestones.roadmap.milestone_changed', Milestone)
+connect(signals.post_delete, 'ponymine.ext.milestones.roadmap.milestone_changed', Milestone)
+connect(signals.post_save, 'ponymine.ext.milestones.roadmap.project_changed', Project)
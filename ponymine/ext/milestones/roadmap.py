@@ -0,0 +1,110 @@
+"""
+Progress figures for the milestones of a project and its subprojects.
+
+The tickets of every milestone in the visible part of the tree are counted
+per status with one grouped query and the result is cached per project and
+viewer.  Whether a status closes tickets is only decided when the figures
+are read, so changing the closed statuses never needs to invalidate the
+cache; ticket, milestone and project changes bump the cache version of the
+project and all of its ancestors.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from ponymine.cache import make_key, get_version, bump_version
+from ponymine.ext.milestones.models import Milestone
+from ponymine.models import Project, Ticket
+from ponymine.permissions import permission_version
+
+CACHE_TIMEOUT = getattr(settings, 'PONYMINE_ROADMAP_CACHE_TIMEOUT', 60 * 60)
+
+def count_milestone_tickets(project, user=None):
+    """
+    Returns the milestones in the tree of `project` that `user` may see as
+    dictionaries, each with a `{status id: count}` dictionary of its tickets
+    in `statuses`.
+    """
+    projects = Project.objects.subtree(project, user).values('pk')
+    milestones = Milestone.objects.filter(project__in=projects)
+    rows = list(milestones.values('id', 'project', 'name', 'due_date', 'is_complete'))
+    if not rows:
+        return rows
+
+    by_id = {}
+    for row in rows:
+        row['statuses'] = {}
+        by_id[row['id']] = row
+
+    tickets = Ticket.objects.filter(project__in=projects, milestone__isnull=False)
+    counts = tickets.order_by().values('milestone', 'status').annotate(count=Count('id'))
+    for count in counts:
+        if count['milestone'] in by_id:
+            by_id[count['milestone']]['statuses'][count['status']] = count['count']
+    return rows
+
+def get_roadmap(project, user=None):
+    """
+    Returns a list of dictionaries with the `open`, `closed`, `total` and
+    `percent` (complete) figures of every milestone in the tree of `project`
+    that `user` may see.
+    """
+    key = make_key('roadmap', project.id, get_version('roadmap', project.id),
+                   getattr(user, 'id', None), permission_version(user))
+    rows = cache.get(key)
+    if rows is None:
+        rows = count_milestone_tickets(project, user)
+        cache.set(key, rows, CACHE_TIMEOUT)
+
+    closed_ids = Ticket.objects.closed_statuses
+    roadmap = []
+    for row in rows:
+        total = sum(row['statuses'].values())
+        closed = sum([c for s, c in row['statuses'].items() if s in closed_ids])
+        milestone = dict(row)
+        del milestone['statuses']
+        milestone.update({
+            'open': total - closed,
+            'closed': closed,
+            'total': total,
+            'percent': total and closed * 100 // total or 0,
+        })
+        roadmap.append(milestone)
+    return roadmap
+
+def invalidate_projects(*project_ids):
+    """
+    Throws away the roadmaps of the projects with `project_ids` and their
+    ancestors.
+    """
+    project_ids = [pk for pk in project_ids if pk]
+    if not project_ids:
+        return
+
+    invalid = set()
+    for id_path in Project._base_manager.filter(pk__in=project_ids) \
+                                       .values_list('id_path', flat=True):
+        invalid.update([int(pk) for pk in id_path.split('/') if pk])
+    for pk in invalid.union(project_ids):
+        bump_version('roadmap', pk)
+
+def ticket_changed(sender, instance, **kwargs):
+    invalidate_projects(instance.project_id, instance._original_state[0])
+
+def tickets_updated(sender, tickets, **kwargs):
+    project_ids = set()
+    for ticket in tickets:
+        project_ids.update([ticket.project_id, ticket._original_state[0]])
+    invalidate_projects(*project_ids)
+
+def milestone_changed(sender, instance, **kwargs):
+    invalidate_projects(instance.project_id)
+
+def project_changed(sender, instance, **kwargs):
+    """
+    Throws away the roadmaps of the old and new ancestors of a project that
+    may have moved.
+    """
+    # the tree index is only rewritten after the project has been saved, so
+    # `id_path` still leads through the old ancestors here
+    old_ids = [int(pk) for pk in instance.id_path.split('/') if pk]
+    invalidate_projects(instance.id, instance.parent_id, *old_ids)
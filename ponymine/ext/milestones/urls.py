@@ -0,0 +1,8 @@
+from django.conf.urls.defaults import *
+from ponymine.ext.milestones import views
+
+urlpatterns = patterns('',
+    url(r'^(?P<path>.+)/roadmap\.json$', views.project_roadmap_json,
+        name='ponymine_project_roadmap_json'),
+    url(r'^(?P<path>.+)/roadmap/$', views.project_roadmap, name='ponymine_project_roadmap'),
+)
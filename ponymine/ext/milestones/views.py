@@ -0,0 +1,46 @@
+from django.http import Http404, HttpResponse
+from django.shortcuts import render_to_response as render
+from django.template import RequestContext
+from django.utils import simplejson
+from django.utils.translation import ugettext_lazy as _
+from ponymine.ext.milestones.roadmap import get_roadmap
+from ponymine.models import Project
+from ponymine import utils
+
+def _get_project(request, path):
+    project = Project.objects.with_path(path, request.user)
+    if not project:
+        raise Http404()
+    utils.check_membership(project, request.user)
+    return project
+
+def project_roadmap(request, path, template='ponymine/milestones/roadmap.html'):
+    """
+    Shows the progress of every milestone in a project and its subprojects
+    """
+    data = {}
+    project = _get_project(request, path)
+    roadmap = get_roadmap(project, request.user)
+
+    projects = Project.objects.in_bulk(set([m['project'] for m in roadmap]))
+    for milestone in roadmap:
+        milestone['project'] = projects.get(milestone['project'])
+
+    data['title'] = _('Roadmap')
+    data['project'] = project
+    data['milestone_list'] = roadmap
+
+    return render(template, data, context_instance=RequestContext(request))
+
+def project_roadmap_json(request, path):
+    """
+    Returns the progress of every milestone in a project and its
+    subprojects as JSON
+    """
+    project = _get_project(request, path)
+    roadmap = get_roadmap(project, request.user)
+    for milestone in roadmap:
+        if milestone['due_date']:
+            milestone['due_date'] = milestone['due_date'].isoformat()
+
+    return HttpResponse(simplejson.dumps(roadmap), mimetype='application/json')
@@ -0,0 +1,39 @@
+from django.core.management.base import NoArgsCommand
+from optparse import make_option
+from ponymine.ext.notifications import worker
+import time
+
+class Command(NoArgsCommand):
+    help = 'Mails digests of the queued ticket notifications.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--loop', dest='loop', action='store_true', default=False,
+                    help='Keep running and poll for new notifications.'),
+        make_option('--interval', dest='interval', type='int', default=30,
+                    help='Seconds to wait between polls when looping.'),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        while True:
+            expanded = 0
+            while True:
+                count = worker.expand_events()
+                if not count:
+                    break
+                expanded += count
+
+            sent = failed = 0
+            while True:
+                batch_sent, batch_failed = worker.send_digests()
+                if not batch_sent and not batch_failed:
+                    break
+                sent += batch_sent
+                failed += batch_failed
+
+            if verbosity > 0 and (expanded or sent or failed or not options.get('loop')):
+                print 'Expanded %i event(s); sent %i and deferred %i delivery(s).' % (
+                        expanded, sent, failed)
+
+            if not options.get('loop'):
+                break
+            time.sleep(options.get('interval', 30))
@@ -0,0 +1,66 @@
+"""
+A durable outbox of ticket notifications.
+
+Changing a ticket only records an `Event` (one INSERT, whatever the number of
+watchers).  The `send_notifications` worker later fans each event out to a
+`Delivery` per recipient and mails every recipient one digest of all their
+pending deliveries.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import models
+from django.db.models import signals
+from ponymine.models import Ticket, Log
+from ponymine import signals as ponymine_signals
+from ponymine.utils import bulk_insert
+
+MAX_ATTEMPTS = getattr(settings, 'PONYMINE_NOTIFICATION_MAX_ATTEMPTS', 6)
+
+class Watch(models.Model):
+    """
+    Subscribes a user to the changes of a ticket.  The reporter and assignee
+    of a ticket are notified without watching it.
+    """
+    ticket = models.ForeignKey(Ticket, related_name='watches')
+    user = models.ForeignKey(User, related_name='watches')
+
+    class Meta:
+        unique_together = ('ticket', 'user')
+
+class Event(models.Model):
+    """
+    Something happened to a ticket: it was created (no `log`) or changed.
+    """
+    ticket = models.ForeignKey(Ticket)
+    log = models.ForeignKey(Log, blank=True, null=True)
+    actor = models.ForeignKey(User, blank=True, null=True)
+    is_expanded = models.BooleanField(default=False, db_index=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+
+class Delivery(models.Model):
+    """
+    An event that still has to be (or has been) mailed to one recipient.
+    """
+    event = models.ForeignKey(Event, related_name='deliveries')
+    recipient = models.ForeignKey(User)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(db_index=True)
+    # identifies the worker run that last claimed the delivery
+    claim = models.CharField(max_length=32, blank=True, db_index=True)
+    last_error = models.TextField(blank=True)
+    date_sent = models.DateTimeField(blank=True, null=True, db_index=True)
+
+    class Meta:
+        verbose_name_plural = 'deliveries'
+
+def logs_created(sender, logs, **kwargs):
+    events = [Event(ticket_id=log.ticket_id, log_id=log.id,
+                    actor_id=log.created_by_id) for log in logs if log.id]
+    bulk_insert(events)
+
+def ticket_saved(sender, instance, created=False, **kwargs):
+    if created:
+        Event.objects.create(ticket=instance, actor_id=instance.reported_by_id)
+
+ponymine_signals.logs_created.connect(logs_created)
+signals.post_save.connect(ticket_saved, sender=Ticket)
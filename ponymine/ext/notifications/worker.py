@@ -0,0 +1,175 @@
+"""
+Turns queued events into mail.
+
+`expand_events` works out who should hear about each new event and writes a
+`Delivery` for every recipient.  `send_digests` then claims a batch of due
+deliveries, groups them by recipient and sends one digest per recipient over
+a single SMTP connection.  Deliveries that fail are retried with exponential
+backoff until `MAX_ATTEMPTS` is reached.
+"""
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.template.loader import render_to_string
+from ponymine.ext.notifications.models import Watch, Event, Delivery, MAX_ATTEMPTS
+from ponymine.history import attach_changes
+from ponymine.models import Membership
+from ponymine.utils import bulk_insert
+import datetime
+import uuid
+
+BATCH_SIZE = getattr(settings, 'PONYMINE_NOTIFICATION_BATCH_SIZE', 200)
+
+# seconds to wait before the first retry; doubled after every failure
+RETRY_DELAY = getattr(settings, 'PONYMINE_NOTIFICATION_RETRY_DELAY', 60)
+
+# seconds that a worker may hold on to the deliveries it has claimed
+CLAIM_TIMEOUT = 15 * 60
+
+def _recipients(events):
+    """
+    Returns a dictionary that maps the ID of each event to the set of IDs of
+    the users that should be told about it.
+    """
+    tickets = {}
+    for event in events:
+        tickets[event.ticket_id] = event.ticket
+
+    users = {}
+    for ticket in tickets.values():
+        users[ticket.id] = set([pk for pk in (ticket.reported_by_id,
+                                              ticket.assigned_to_id) if pk])
+    for ticket_id, user_id in Watch.objects.filter(ticket__in=tickets.keys()) \
+                                           .values_list('ticket', 'user'):
+        users[ticket_id].add(user_id)
+
+    # nobody outside of a private project may hear about its tickets
+    private = set([t.project_id for t in tickets.values() if not t.project.is_public])
+    members = set()
+    if private:
+        members = set(Membership.objects.filter(project__in=private)
+                                        .values_list('project', 'user'))
+
+    recipients = {}
+    for event in events:
+        ticket = tickets[event.ticket_id]
+        wanted = users[ticket.id] - set([event.actor_id])
+        if ticket.project_id in private:
+            wanted = set([pk for pk in wanted if (ticket.project_id, pk) in members])
+        recipients[event.id] = wanted
+    return recipients
+
+@transaction.commit_on_success
+def expand_events(batch_size=BATCH_SIZE):
+    """
+    Writes the deliveries for up to `batch_size` new events.  Returns the
+    number of events that were expanded.
+    """
+    events = list(Event.objects.filter(is_expanded=False)
+                               .select_related('ticket', 'ticket__project')
+                               .order_by('id')[:batch_size])
+    if not events:
+        return 0
+
+    now = datetime.datetime.now()
+    deliveries = []
+    for event_id, user_ids in _recipients(events).items():
+        deliveries.extend([Delivery(event_id=event_id, recipient_id=pk, next_attempt=now)
+                           for pk in user_ids])
+    bulk_insert(deliveries)
+
+    Event.objects.filter(pk__in=[e.id for e in events]).update(is_expanded=True)
+    return len(events)
+
+def _claim(batch_size):
+    """
+    Reserves up to `batch_size` due deliveries for this worker by pushing
+    their next attempt into the future, so that other workers skip them, and
+    marking them with a token of its own to find them by.
+    """
+    now = datetime.datetime.now()
+    due = Delivery.objects.filter(date_sent__isnull=True, attempts__lt=MAX_ATTEMPTS,
+                                  next_attempt__lte=now)
+    ids = list(due.order_by('recipient', 'id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return []
+
+    # whole seconds, like the locks of repositories, for databases that drop
+    # the microseconds
+    lease = (now + datetime.timedelta(seconds=CLAIM_TIMEOUT)).replace(microsecond=0)
+    token = uuid.uuid4().hex
+    due.filter(pk__in=ids).update(next_attempt=lease, claim=token)
+    transaction.commit_unless_managed()
+
+    claimed = Delivery.objects.filter(claim=token)
+    return list(claimed.select_related('recipient', 'event', 'event__ticket',
+                                       'event__ticket__project', 'event__log',
+                                       'event__actor').order_by('recipient', 'id'))
+
+def render_digest(recipient, deliveries):
+    """
+    Returns the EmailMessage that tells `recipient` about `deliveries`.
+    """
+    events = [d.event for d in deliveries]
+    attach_changes([e.log for e in events if e.log_id])
+
+    data = {'recipient': recipient, 'events': events, 'site': Site.objects.get_current()}
+    subject = render_to_string('ponymine/notifications/digest_subject.txt', data)
+    body = render_to_string('ponymine/notifications/digest.txt', data)
+    return EmailMessage(u' '.join(subject.split()), body, to=[recipient.email])
+
+def _retry(deliveries, error):
+    now = datetime.datetime.now()
+    for delivery in deliveries:
+        delay = RETRY_DELAY * 2 ** delivery.attempts
+        Delivery.objects.filter(pk=delivery.id).update(
+                attempts=delivery.attempts + 1,
+                last_error=error,
+                next_attempt=now + datetime.timedelta(seconds=delay))
+
+def send_digests(batch_size=BATCH_SIZE, connection=None):
+    """
+    Mails one digest to every recipient with deliveries in the next batch.
+    Returns a `(sent, failed)` tuple with the number of deliveries.
+    """
+    deliveries = _claim(batch_size)
+    if not deliveries:
+        return 0, 0
+
+    groups = []
+    for delivery in deliveries:
+        if groups and groups[-1][0].id == delivery.recipient_id:
+            groups[-1][1].append(delivery)
+        else:
+            groups.append((delivery.recipient, [delivery]))
+
+    sent, failed = [], []
+    connection = connection or get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception, err:
+        _retry(deliveries, unicode(err))
+        transaction.commit_unless_managed()
+        return 0, len(deliveries)
+
+    try:
+        for recipient, group in groups:
+            if not recipient.email:
+                # there is nobody to tell, so don't try again
+                sent.extend(group)
+                continue
+            try:
+                connection.send_messages([render_digest(recipient, group)])
+            except Exception, err:
+                _retry(group, unicode(err))
+                failed.extend(group)
+            else:
+                sent.extend(group)
+    finally:
+        connection.close()
+
+    Delivery.objects.filter(pk__in=[d.id for d in sent]) \
+                    .update(date_sent=datetime.datetime.now())
+    transaction.commit_unless_managed()
+    return len(sent), len(failed)
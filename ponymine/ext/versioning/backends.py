@@ -0,0 +1,186 @@
+"""
+The interface that every version control backend implements, and the
+registry that maps backend names to their classes.
+
+Backends are named by dotted path in `PONYMINE_VCS_BACKENDS`, so other
+systems can be plugged in without touching Ponymine.
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.importlib import import_module
+import datetime
+import subprocess
+
+BACKENDS = {
+    'git': 'ponymine.ext.versioning.git.backend.GitBackend',
+    'hg': 'ponymine.ext.versioning.hg.backend.MercurialBackend',
+}
+BACKENDS.update(getattr(settings, 'PONYMINE_VCS_BACKENDS', {}))
+
+# how much of a command's output to read at once when streaming it
+CHUNK_SIZE = 64 * 1024
+
+class BackendError(Exception):
+    pass
+
+class Backend(object):
+    """
+    A repository on the local disk.  Revisions are passed around as strings
+    in whatever form the backend uses for its changeset IDs.
+    """
+    # the revision that is shown when none is given
+    default_rev = None
+
+    def __init__(self, path):
+        self.path = path
+
+    def get_watermark(self):
+        """
+        Returns a string that describes the current state of the repository
+        (its branch heads, for example).
+        """
+        raise NotImplementedError
+
+    def changesets(self, since, until):
+        """
+        Yields a `(revision, author name, author email, date, message)`
+        tuple for every changeset that is part of the watermark `until` but
+        not of the watermark `since` (which may be empty), oldest first.
+        """
+        raise NotImplementedError
+
+    def resolve(self, rev):
+        """
+        Returns the changeset ID that `rev` (a branch, tag, ...) refers to.
+        """
+        raise NotImplementedError
+
+    def diff(self, rev):
+        """
+        Returns the changes made by changeset `rev` as a unified diff.
+        """
+        raise NotImplementedError
+
+    def tree(self, rev, path=''):
+        """
+        Returns a list of `(name, kind, size)` tuples for the directory `path`
+        in changeset `rev`.  `kind` is 'tree' for directories and 'blob' for
+        files; the size of a directory is `None`.
+        """
+        raise NotImplementedError
+
+    def blob_size(self, rev, path):
+        raise NotImplementedError
+
+    def blob(self, rev, path):
+        """
+        Returns the contents of the file `path` in changeset `rev`.
+        """
+        raise NotImplementedError
+
+    def stream_blob(self, rev, path):
+        """
+        Yields the contents of the file `path` in changeset `rev` in chunks,
+        so that large files need not be held in memory.  Backends that can't
+        do better return the whole file as one chunk.
+        """
+        yield self.blob(rev, path)
+
+class CommandBackend(Backend):
+    """
+    Base class for backends that drive a command line client.
+    """
+    command = None
+
+    # separate the fields of a changeset and the changesets themselves in
+    # the log output of subclasses
+    FIELD_SEP = '\x00'
+    RECORD_SEP = '\x1e'
+
+    def _popen(self, args, stdin=None):
+        try:
+            return subprocess.Popen([self.command] + list(args), cwd=self.path,
+                                    stdin=stdin, stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+        except OSError, err:
+            raise BackendError('Could not run %s: %s' % (self.command, err))
+
+    def run(self, *args, **kwargs):
+        """
+        Runs a command and returns its output.  `input` is written to its
+        standard input.
+        """
+        input = kwargs.get('input')
+        process = self._popen(args, input is not None and subprocess.PIPE or None)
+        output, errors = process.communicate(input)
+        if process.returncode:
+            raise BackendError(errors.strip() or '%s %s failed' % (self.command, args[0]))
+        return output
+
+    def stream(self, *args):
+        """
+        Runs a command and yields its output as it is read.  A failure is
+        only noticed once all of the output has been read.
+        """
+        process = self._popen(args)
+        while True:
+            data = process.stdout.read(CHUNK_SIZE)
+            if not data:
+                break
+            yield data
+
+        errors = process.stderr.read()
+        if process.wait():
+            raise BackendError(errors.strip() or '%s %s failed' % (self.command, args[0]))
+
+    def iter_log(self, args, input=None):
+        """
+        Runs a log command whose output has a `(revision, author name, author
+        email, unix time, message)` record per changeset and yields the
+        parsed records as they are read, so that long histories never have
+        to fit in memory.
+        """
+        process = self._popen(args, input is not None and subprocess.PIPE or None)
+        if input is not None:
+            process.stdin.write(input)
+            process.stdin.close()
+
+        pending = ''
+        while True:
+            data = process.stdout.read(CHUNK_SIZE)
+            pending += data
+            records = pending.split(self.RECORD_SEP)
+            pending = records.pop()
+            for record in records:
+                rev, name, email, timestamp, message = \
+                        record.lstrip('\n').split(self.FIELD_SEP, 4)
+                yield (rev, name.decode('utf-8', 'replace'),
+                       email.decode('utf-8', 'replace'),
+                       datetime.datetime.fromtimestamp(int(timestamp.split()[0].split('.')[0])),
+                       message.decode('utf-8', 'replace').strip())
+            if not data:
+                break
+
+        errors = process.stderr.read()
+        if process.wait():
+            raise BackendError(errors.strip() or '%s log failed' % self.command)
+
+_classes = {}
+
+def get_backend_class(name):
+    if name not in _classes:
+        try:
+            module, attr = BACKENDS[name].rsplit('.', 1)
+            _classes[name] = getattr(import_module(module), attr)
+        except (KeyError, ImportError, AttributeError), err:
+            raise ImproperlyConfigured('Unknown version control backend %r: %s' % (name, err))
+    return _classes[name]
+
+def get_backend(name, path):
+    """
+    Returns the backend called `name` for the repository at `path`.
+    """
+    return get_backend_class(name)(path)
+
+def backend_choices():
+    return sorted([(name, name) for name in BACKENDS])
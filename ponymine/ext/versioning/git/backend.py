@@ -0,0 +1,76 @@
+"""
+Git support, through the `git` command line.
+"""
+from django.utils import simplejson
+from ponymine.ext.versioning.backends import CommandBackend
+
+LOG_FORMAT = '%H%x00%an%x00%ae%x00%at%x00%B%x1e'
+
+class GitBackend(CommandBackend):
+    command = 'git'
+    default_rev = 'HEAD'
+
+    def heads(self):
+        """
+        Returns a dictionary of the commits that every branch points at.
+        """
+        heads = {}
+        output = self.run('for-each-ref', '--format=%(refname) %(objectname)', 'refs/heads')
+        for line in output.splitlines():
+            name, sha = line.rsplit(' ', 1)
+            heads[name] = sha
+        return heads
+
+    def get_watermark(self):
+        return simplejson.dumps(self.heads(), sort_keys=True)
+
+    def existing(self, shas):
+        """
+        Returns the subset of the commit IDs `shas` that are still in the
+        repository (history may have been rewritten since they were seen).
+        """
+        shas = list(shas)
+        if not shas:
+            return set()
+        output = self.run('cat-file', '--batch-check', input='\n'.join(shas) + '\n')
+        return set([line.split()[0] for line in output.splitlines()
+                    if not line.endswith('missing')])
+
+    def changesets(self, since, until):
+        include = set(simplejson.loads(until or '{}').values())
+        if not include:
+            return []
+        exclude = self.existing(set(simplejson.loads(since or '{}').values()))
+        revs = list(include) + ['^' + sha for sha in exclude]
+        return self.iter_log(['log', '--reverse', '--format=' + LOG_FORMAT, '--stdin'],
+                             '\n'.join(revs) + '\n')
+
+    def resolve(self, rev):
+        return self.run('rev-parse', '--verify', '--quiet', '%s^{commit}' % rev).strip()
+
+    def diff(self, rev):
+        return self.run('show', '--format=', '--patch', '--no-color', rev)
+
+    def tree(self, rev, path=''):
+        spec = path.strip('/') and '%s:%s' % (rev, path.strip('/')) or rev
+        entries = []
+        for entry in self.run('ls-tree', '-l', '-z', spec).split('\x00'):
+            if not entry:
+                continue
+            info, name = entry.split('\t', 1)
+            mode, kind, obj, size = info.split()
+            if kind != 'blob':
+                # submodules are listed as directories
+                kind, size = 'tree', None
+            entries.append((name.decode('utf-8', 'replace'), kind, size and int(size)))
+        entries.sort(key=lambda e: (e[1] != 'tree', e[0].lower()))
+        return entries
+
+    def blob_size(self, rev, path):
+        return int(self.run('cat-file', '-s', '%s:%s' % (rev, path.strip('/'))))
+
+    def blob(self, rev, path):
+        return self.run('cat-file', 'blob', '%s:%s' % (rev, path.strip('/')))
+
+    def stream_blob(self, rev, path):
+        return self.stream('cat-file', 'blob', '%s:%s' % (rev, path.strip('/')))
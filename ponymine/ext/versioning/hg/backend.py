@@ -0,0 +1,66 @@
+"""
+Mercurial support, through the `hg` command line.
+
+The watermark is the local revision number of the tip, so new changesets
+are simply the ones with higher numbers.
+"""
+from ponymine.ext.versioning.backends import BackendError, CommandBackend
+
+class MercurialBackend(CommandBackend):
+    command = 'hg'
+    default_rev = 'tip'
+
+    # NUL cannot be passed in a command line argument
+    FIELD_SEP = '\x1f'
+    LOG_TEMPLATE = '{node}\x1f{author|person}\x1f{author|email}\x1f{date|hgdate}\x1f{desc}\x1e'
+
+    def get_watermark(self):
+        return self.run('log', '-r', 'tip', '--template', '{rev}').strip()
+
+    def changesets(self, since, until):
+        first = int(since or -1) + 1
+        last = int(until or -1)
+        if last < first:
+            return []
+        return self.iter_log(['log', '-r', '%d:%d' % (first, last),
+                              '--template', self.LOG_TEMPLATE])
+
+    def resolve(self, rev):
+        return self.run('log', '-r', rev, '--template', '{node}').strip()
+
+    def diff(self, rev):
+        return self.run('diff', '--git', '-c', rev)
+
+    def tree(self, rev, path=''):
+        prefix = path.strip('/') and path.strip('/') + '/' or ''
+        directories, files = set(), []
+        output = self.run('files', '-r', rev, '--template', '{size}\t{path}\n')
+        for line in output.splitlines():
+            size, name = line.split('\t', 1)
+            if not name.startswith(prefix):
+                continue
+            name = name[len(prefix):].decode('utf-8', 'replace')
+            if '/' in name:
+                directories.add(name.split('/', 1)[0])
+            else:
+                files.append((name, 'blob', int(size)))
+
+        entries = [(name, 'tree', None) for name in directories] + files
+        entries.sort(key=lambda e: (e[1] != 'tree', e[0].lower()))
+        return entries
+
+    def blob_size(self, rev, path):
+        path = path.strip('/')
+        output = self.run('files', '-r', rev, '--template', '{size}\t{path}\n',
+                          'path:' + path)
+        for line in output.splitlines():
+            size, name = line.split('\t', 1)
+            if name == path:
+                return int(size)
+        raise BackendError('%s is not a file in %s' % (path, rev))
+
+    def blob(self, rev, path):
+        return self.run('cat', '-r', rev, path.strip('/'))
+
+    def stream_blob(self, rev, path):
+        return self.stream('cat', '-r', rev, path.strip('/'))
@@ -0,0 +1,175 @@
+"""
+Keeps the changeset index of repositories up to date.
+
+Each repository stores a watermark of how far it has been indexed, and the
+backend only reads the changesets between that watermark and the current one
+(for git, the commits reachable from the branch heads but not from the heads
+indexed last time), so an update costs time in proportion to the new
+changesets rather than the whole history.  Changesets are written in chunks
+with multi-row INSERTs.
+
+Messages that say "refs #12" or "fixes #12, #13" are linked to those tickets
+(if they belong to the repository's project or one below it).  Both kinds of
+reference add a log to the ticket, and "fixes" also closes it, through the
+normal change log.  This only happens for new changesets: the very first
+scan of a repository links them without touching the tickets.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from ponymine.ext.versioning.models import Repository, Changeset, TicketReference
+from ponymine.lookups import get_table
+from ponymine.models import Status, Ticket
+from ponymine.utils import bulk_insert, log_ticket_changes
+import copy
+import datetime
+import re
+
+CHUNK_SIZE = 1000
+
+# the slug of the status that "fixes" moves tickets to
+FIXED_STATUS = getattr(settings, 'PONYMINE_VCS_FIXED_STATUS', None)
+
+REFERENCE_RE = re.compile(r'\b(refs|references|re|see|addresses|fix|fixes|fixed|'
+                          r'close|closes|closed)\s+((?:#\d+(?:\s*(?:,|and)\s*)?)+)',
+                          re.IGNORECASE)
+TICKET_RE = re.compile(r'#(\d+)')
+
+def parse_references(message):
+    """
+    Returns a dictionary that maps the IDs of the tickets mentioned in
+    `message` to whether the commit fixes them.
+    """
+    references = {}
+    for verb, tickets in REFERENCE_RE.findall(message):
+        fixes = verb.lower().startswith(('fix', 'close'))
+        for ticket_id in TICKET_RE.findall(tickets):
+            references[int(ticket_id)] = references.get(int(ticket_id), False) or fixes
+    return references
+
+def fixed_status():
+    """
+    Returns the status that fixed tickets get: the one named by
+    `PONYMINE_VCS_FIXED_STATUS` or else the first closed status.
+    """
+    closed = [s for s in get_table(Status).rows if s.is_closed]
+    for status in closed:
+        if status.slug == FIXED_STATUS:
+            return status
+    return closed and closed[0] or None
+
+class Indexer(object):
+    """
+    Indexes the new changesets of `repository`, calling `progress` (if
+    given) after every chunk.
+    """
+    def __init__(self, repository, chunk_size=CHUNK_SIZE, progress=None):
+        self.repository = repository
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.backend = repository.get_backend()
+        self.project_ids = set(repository.project.get_descendants(include_self=True)
+                                                 .values_list('id', flat=True))
+        self.update_tickets = bool(repository.date_indexed)
+        self.indexed = 0
+
+    def run(self):
+        """
+        Indexes the new changesets.  Returns how many there were.
+        """
+        watermark = self.backend.get_watermark()
+
+        chunk = []
+        for changeset in self.backend.changesets(self.repository.watermark, watermark):
+            chunk.append(changeset)
+            if len(chunk) >= self.chunk_size:
+                self.index_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.index_chunk(chunk)
+
+        # don't save the whole repository, which is locked by somebody else
+        now = datetime.datetime.now()
+        Repository.objects.filter(pk=self.repository.id).update(
+                watermark=watermark, date_indexed=now)
+        transaction.commit_unless_managed()
+        self.repository.watermark, self.repository.date_indexed = watermark, now
+        return self.indexed
+
+    def index_chunk(self, chunk):
+        self.write_chunk(chunk)
+        if self.progress is not None:
+            self.progress()
+
+    @transaction.commit_on_success
+    def write_chunk(self, chunk):
+        repository = self.repository
+        # an earlier run may have stopped part of the way through
+        existing = set(Changeset.objects.filter(repository=repository,
+                                                revision__in=[c[0] for c in chunk])
+                                        .values_list('revision', flat=True))
+
+        changesets = [Changeset(repository=repository, revision=rev,
+                                author_name=name[:100], author_email=email[:100],
+                                date=date, message=message)
+                      for rev, name, email, date, message in chunk
+                      if rev not in existing]
+        bulk_insert(changesets)
+        self.indexed += len(changesets)
+
+        references = {}
+        for changeset in changesets:
+            found = parse_references(changeset.message)
+            if found:
+                references[changeset.revision] = found
+        if references:
+            self.link(changesets, references)
+
+    def link(self, changesets, references):
+        ticket_ids = set()
+        for found in references.values():
+            ticket_ids.update(found.keys())
+        tickets = Ticket.objects.filter(pk__in=ticket_ids, project__in=self.project_ids)
+        tickets = dict((t.id, t) for t in tickets)
+
+        ids = dict(Changeset.objects.filter(repository=self.repository,
+                                            revision__in=references.keys())
+                                    .values_list('revision', 'id'))
+
+        links = []
+        for changeset in changesets:
+            for ticket_id, fixes in references.get(changeset.revision, {}).items():
+                if ticket_id in tickets:
+                    links.append(TicketReference(changeset_id=ids[changeset.revision],
+                                                 ticket_id=ticket_id, fixes=fixes))
+                    if self.update_tickets:
+                        self.update_ticket(tickets[ticket_id], changeset, fixes)
+        bulk_insert(links)
+
+    def update_ticket(self, ticket, changeset, fixes):
+        """
+        Logs the changeset on `ticket` and closes the ticket if the changeset
+        fixes it.
+        """
+        user = None
+        if changeset.author_email:
+            users = User.objects.filter(email__iexact=changeset.author_email,
+                                        is_active=True)
+            user = (list(users[:1]) or [None])[0]
+        notes = u'%s %s:\n\n%s' % (fixes and 'Fixed in' or 'Referenced by',
+                                   changeset, changeset.message)
+
+        old = copy.copy(ticket)
+        status = fixes and fixed_status()
+        if status and not ticket.is_closed:
+            ticket.status = status
+            ticket.save()
+        log_ticket_changes([(old, ticket)], user, notes)
+
+def index_repository(repository, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Indexes the changesets that were added to `repository` since the last
+    time, calling `progress` after every chunk.  Returns the number of new
+    changesets.
+    """
+    return Indexer(repository, chunk_size, progress).run()
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from optparse import make_option
+from ponymine.ext.versioning.models import Repository
+from ponymine.ext.versioning.poll import poll_repositories
+import sys
+
+class Command(BaseCommand):
+    help = 'Indexes the new changesets of repositories, several at a time.'
+    args = '[repository name ...]'
+    option_list = BaseCommand.option_list + (
+        make_option('--processes', dest='processes', type='int', default=None,
+                    help='How many repositories to poll at once.  Defaults to the number of CPUs.'),
+    )
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+        repositories = Repository.objects.all()
+        if args:
+            repositories = repositories.filter(name__in=args)
+        names = dict(repositories.values_list('id', 'name'))
+
+        results = poll_repositories(names.keys(), options.get('processes'))
+        for repository_id, count, duration, error in results:
+            name = names[repository_id]
+            if error:
+                sys.stderr.write('%s: %s (%.2fs)\n' % (name, error.encode('utf-8'), duration))
+            elif count is None:
+                if verbosity > 1:
+                    print '%s: skipped, another poller holds the lock' % name
+            elif verbosity > 0:
+                print '%s: %i new changeset(s) in %.2fs' % (name, count, duration)
@@ -0,0 +1,70 @@
+from django.db import models
+from ponymine.ext.versioning.backends import backend_choices, get_backend
+from ponymine.models import Project, Ticket
+
+class Repository(models.Model):
+    """
+    A repository on the local disk (usually a mirror) whose changesets are
+    indexed for a project.
+    """
+    project = models.ForeignKey(Project, related_name='repositories')
+    name = models.CharField(max_length=75)
+    backend = models.CharField(max_length=20, choices=backend_choices())
+    path = models.CharField(max_length=255)
+    # how far the repository has been indexed, in a format of the backend
+    watermark = models.TextField(blank=True, editable=False)
+    date_indexed = models.DateTimeField(blank=True, null=True, editable=False)
+    # held by the process that is polling the repository
+    locked_until = models.DateTimeField(blank=True, null=True, editable=False)
+    date_polled = models.DateTimeField(blank=True, null=True, editable=False)
+    poll_duration = models.FloatField(blank=True, null=True, editable=False)
+    last_error = models.TextField(blank=True, editable=False)
+
+    class Meta:
+        ordering = ('name',)
+        verbose_name_plural = 'repositories'
+
+    def __unicode__(self):
+        return self.name
+
+    def get_absolute_url(self):
+        return ('ponymine_repository_tree', [], {'repository_id': self.id})
+    get_absolute_url = models.permalink(get_absolute_url)
+
+    def get_backend(self):
+        return get_backend(self.backend, self.path)
+
+class Changeset(models.Model):
+    repository = models.ForeignKey(Repository, related_name='changesets')
+    revision = models.CharField(max_length=64)
+    author_name = models.CharField(max_length=100, blank=True)
+    author_email = models.CharField(max_length=100, blank=True)
+    date = models.DateTimeField(db_index=True)
+    message = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ('-date',)
+        unique_together = ('repository', 'revision')
+
+    def __unicode__(self):
+        return self.revision[:10]
+
+    def get_absolute_url(self):
+        return ('ponymine_repository_changeset', [],
+                {'repository_id': self.repository_id, 'rev': self.revision})
+    get_absolute_url = models.permalink(get_absolute_url)
+
+    def _get_summary(self):
+        return self.message.split('\n', 1)[0]
+    summary = property(_get_summary)
+
+class TicketReference(models.Model):
+    """
+    Links a changeset to a ticket that its message mentions.
+    """
+    changeset = models.ForeignKey(Changeset, related_name='references')
+    ticket = models.ForeignKey(Ticket, related_name='changeset_references')
+    fixes = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = ('changeset', 'ticket')
@@ -0,0 +1,122 @@
+"""
+Polls many repositories at once.
+
+Every repository is indexed in a worker process of its own pool slot, so a
+slow or hanging repository only ties up one worker.  A repository is locked
+in the database while it is being polled (the lock expires after
+`LOCK_TIMEOUT` seconds in case a worker dies, and is renewed after every
+chunk of changesets while the worker is alive), so overlapping runs of the
+poller never index the same repository twice.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils.encoding import force_unicode
+from ponymine.ext.versioning.index import index_repository
+from ponymine.ext.versioning.models import Repository
+import datetime
+import multiprocessing
+import time
+
+LOCK_TIMEOUT = getattr(settings, 'PONYMINE_VCS_LOCK_TIMEOUT', 30 * 60)
+
+class LockLost(Exception):
+    pass
+
+def _lock_expiry():
+    # whole seconds, so that the expiry compares equal to what is stored by
+    # databases that drop the microseconds
+    expiry = datetime.datetime.now() + datetime.timedelta(seconds=LOCK_TIMEOUT)
+    return expiry.replace(microsecond=0)
+
+def acquire_lock(repository_id):
+    """
+    Locks a repository for polling.  Returns the time the lock expires, or
+    `None` if somebody else holds the lock.
+    """
+    now, expiry = datetime.datetime.now(), _lock_expiry()
+    repositories = Repository.objects.filter(pk=repository_id).filter(
+            Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+    locked = repositories.update(locked_until=expiry)
+    transaction.commit_unless_managed()
+    return locked and expiry or None
+
+def refresh_lock(repository_id, locked_until):
+    """
+    Extends the lock that expires at `locked_until` and returns its new
+    expiry.  Raises `LockLost` if the lock expired and somebody else took
+    it in the meantime.
+    """
+    expiry = _lock_expiry()
+    locked = Repository.objects.filter(pk=repository_id, locked_until=locked_until) \
+                               .update(locked_until=expiry)
+    transaction.commit_unless_managed()
+    if not locked:
+        raise LockLost('The lock expired while the repository was indexed')
+    return expiry
+
+def release_lock(repository_id, locked_until, duration, error=''):
+    # leave the lock alone if somebody else holds it by now
+    Repository.objects.filter(pk=repository_id, locked_until=locked_until).update(
+            locked_until=None,
+            date_polled=datetime.datetime.now(),
+            poll_duration=duration,
+            last_error=error)
+    transaction.commit_unless_managed()
+
+def poll_repository(repository_id):
+    """
+    Indexes one repository.  Returns a `(repository ID, number of new
+    changesets, seconds taken, error)` tuple; the number is `None` if the
+    repository was locked.
+    """
+    lock = {'until': acquire_lock(repository_id)}
+    if lock['until'] is None:
+        return repository_id, None, 0.0, ''
+
+    def refresh():
+        lock['until'] = refresh_lock(repository_id, lock['until'])
+
+    started = time.time()
+    count, error = 0, ''
+    try:
+        try:
+            repository = Repository.objects.select_related('project').get(pk=repository_id)
+            count = index_repository(repository, progress=refresh)
+        except Exception, err:
+            # one broken repository mustn't stop the others
+            error = force_unicode(err, errors='replace') or err.__class__.__name__
+    finally:
+        duration = time.time() - started
+        release_lock(repository_id, lock['until'], duration, error)
+    return repository_id, count, duration, error
+
+def _init_worker():
+    # each worker needs a database connection of its own
+    connection.close()
+
+def poll_repositories(repository_ids=None, processes=None):
+    """
+    Polls the repositories with `repository_ids` (or all of them) across a
+    pool of `processes` workers, yielding the result of `poll_repository`
+    for each one as soon as it is done.
+    """
+    if repository_ids is None:
+        repository_ids = list(Repository.objects.values_list('id', flat=True))
+    if not repository_ids:
+        return
+
+    if processes == 1:
+        for repository_id in repository_ids:
+            yield poll_repository(repository_id)
+        return
+
+    # don't share our connection with the forked workers
+    connection.close()
+    pool = multiprocessing.Pool(processes, _init_worker)
+    try:
+        for result in pool.imap_unordered(poll_repository, repository_ids):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,16 @@
+from django.conf.urls.defaults import *
+from ponymine.ext.versioning import views
+
+urlpatterns = patterns('',
+    url(r'^(?P<repository_id>\d+)/$', views.repository_tree, name='ponymine_repository_tree'),
+    url(r'^(?P<repository_id>\d+)/tree/(?P<rev>[^/]+)/(?P<tree_path>.*)$',
+        views.repository_tree, name='ponymine_repository_tree_path'),
+    url(r'^(?P<repository_id>\d+)/blob/(?P<rev>[^/]+)/(?P<tree_path>.+)$',
+        views.repository_blob, name='ponymine_repository_blob'),
+    url(r'^(?P<repository_id>\d+)/changesets/$', views.repository_changesets,
+        name='ponymine_repository_changesets'),
+    url(r'^(?P<repository_id>\d+)/changesets/(?P<cursor>[-\w]+)/$', views.repository_changesets,
+        name='ponymine_repository_changesets_page'),
+    url(r'^(?P<repository_id>\d+)/changeset/(?P<rev>[^/]+)/$', views.repository_changeset,
+        name='ponymine_repository_changeset'),
+)
@@ -0,0 +1,179 @@
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.http import Http404, HttpResponse
+from django.shortcuts import render_to_response as render, get_object_or_404
+from django.template import RequestContext
+from django.utils.translation import ugettext_lazy as _
+from ponymine.cache import make_key
+from ponymine.ext.versioning.backends import BackendError
+from ponymine.ext.versioning.models import Repository
+from ponymine.paginator import CursorPaginator
+from ponymine import utils
+
+# trees and blobs of a changeset never change, so they can be kept for long
+CACHE_TIMEOUT = 60 * 60 * 24
+
+# larger files and diffs are only offered for download, not shown or cached
+MAX_BLOB_SIZE = 512 * 1024
+
+def _get_repository(request, repository_id):
+    repository = get_object_or_404(Repository.objects.select_related('project'),
+                                   pk=repository_id)
+    utils.check_membership(repository.project, request.user)
+    return repository
+
+def _resolve(repository, backend, rev):
+    """
+    Returns the changeset ID for `rev`, or raises a 404.  Branch and tag
+    names are resolved through the backend; IDs of indexed changesets are
+    taken as they are.
+    """
+    if repository.changesets.filter(revision=rev).exists():
+        return rev
+    try:
+        return backend.resolve(rev)
+    except BackendError:
+        raise Http404()
+
+def _is_binary(content):
+    return '\x00' in content[:8000]
+
+def repository_tree(request, repository_id, rev=None, tree_path='',
+    template='ponymine/versioning/tree.html'):
+    """
+    Lists the files in a directory of a repository
+    """
+    data = {}
+    repository = _get_repository(request, repository_id)
+    backend = repository.get_backend()
+    rev = rev or backend.default_rev
+    revision = _resolve(repository, backend, rev)
+
+    key = make_key('vcs-tree', repository.id, revision, tree_path)
+    entries = cache.get(key)
+    if entries is None:
+        try:
+            entries = backend.tree(revision, tree_path)
+        except BackendError:
+            raise Http404()
+        cache.set(key, entries, CACHE_TIMEOUT)
+
+    tree_path = tree_path.strip('/')
+    listing = []
+    for name, kind, size in entries:
+        path = tree_path and '%s/%s' % (tree_path, name) or name
+        if kind == 'tree':
+            url = reverse('ponymine_repository_tree_path', args=[repository.id, rev, path + '/'])
+        else:
+            url = reverse('ponymine_repository_blob', args=[repository.id, rev, path])
+        listing.append({'name': name, 'kind': kind, 'size': size, 'url': url})
+
+    data['title'] = repository.name
+    data['project'] = repository.project
+    data['repository'] = repository
+    data['rev'] = rev
+    data['revision'] = revision
+    data['tree_path'] = tree_path
+    data['entries'] = listing
+
+    return render(template, data, context_instance=RequestContext(request))
+
+def repository_blob(request, repository_id, rev, tree_path,
+    template='ponymine/versioning/blob.html'):
+    """
+    Shows a file from a repository.  Add `raw=1` to download it instead.
+    """
+    data = {}
+    repository = _get_repository(request, repository_id)
+    backend = repository.get_backend()
+    revision = _resolve(repository, backend, rev)
+
+    try:
+        size = backend.blob_size(revision, tree_path)
+    except BackendError:
+        raise Http404()
+
+    if request.GET.get('raw'):
+        response = HttpResponse(backend.stream_blob(revision, tree_path),
+                                mimetype='application/octet-stream')
+        response['Content-Length'] = str(size)
+        response['Content-Disposition'] = 'attachment; filename="%s"' % \
+                tree_path.rsplit('/', 1)[-1].replace('"', '')
+        return response
+
+    content = None
+    if size <= MAX_BLOB_SIZE:
+        key = make_key('vcs-blob', repository.id, revision, tree_path)
+        content = cache.get(key)
+        if content is None:
+            content = backend.blob(revision, tree_path)
+            if _is_binary(content):
+                # binary files are not shown
+                content = False
+            else:
+                content = content.decode('utf-8', 'replace')
+            cache.set(key, content, CACHE_TIMEOUT)
+
+    data['title'] = repository.name
+    data['project'] = repository.project
+    data['repository'] = repository
+    data['rev'] = rev
+    data['revision'] = revision
+    data['tree_path'] = tree_path.strip('/')
+    data['size'] = size
+    data['content'] = content
+
+    return render(template, data, context_instance=RequestContext(request))
+
+def repository_changesets(request, repository_id, cursor=None,
+    template='ponymine/versioning/changesets.html'):
+    """
+    Lists the indexed changesets of a repository, newest first
+    """
+    data = {}
+    repository = _get_repository(request, repository_id)
+
+    changesets = repository.changesets.order_by('-date', '-id')
+    paginator = CursorPaginator(changesets, 50)
+    page_obj = paginator.page(cursor)
+
+    data['title'] = _('Changesets')
+    data['project'] = repository.project
+    data['repository'] = repository
+    data['page'] = page_obj
+    data['changeset_list'] = page_obj.object_list
+
+    return render(template, data, context_instance=RequestContext(request))
+
+def repository_changeset(request, repository_id, rev,
+    template='ponymine/versioning/changeset.html'):
+    """
+    Shows the message and diff of an indexed changeset
+    """
+    data = {}
+    repository = _get_repository(request, repository_id)
+    changeset = get_object_or_404(repository.changesets.all(), revision=rev)
+
+    key = make_key('vcs-diff', repository.id, rev)
+    diff = cache.get(key)
+    if diff is None:
+        try:
+            diff = repository.get_backend().diff(rev)
+        except BackendError:
+            # the changeset has been rewritten away since it was indexed
+            diff = ''
+        if len(diff) > MAX_BLOB_SIZE or _is_binary(diff):
+            diff = False
+        else:
+            diff = diff.decode('utf-8', 'replace')
+        cache.set(key, diff, CACHE_TIMEOUT)
+
+    data['title'] = changeset.summary
+    data['project'] = repository.project
+    data['repository'] = repository
+    data['changeset'] = changeset
+    data['references'] = changeset.references.select_related('ticket')
+    data['diff'] = diff
+    data['diff_hidden'] = diff is False
+
+    return render(template, data, context_instance=RequestContext(request))
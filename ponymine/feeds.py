@@ -0,0 +1,176 @@
+"""
+Atom feeds of tickets and their history.
+
+Feeds are built from a bounded number of the most recently updated rows and
+their serialized XML is cached under a version per feed, which the signal
+handlers at the bottom bump whenever something in the feed changes.  The
+version is also what the ETag is made of, so readers that poll an unchanged
+feed get a 304 without the feed being looked at at all.
+"""
+from django.conf import settings
+from django.contrib.syndication.views import Feed
+from django.core.urlresolvers import reverse
+from django.utils.feedgenerator import Atom1Feed
+from django.utils.translation import ugettext as _
+from ponymine.cache import bump_version
+from ponymine.history import attach_changes
+from ponymine.models import Keyword, Log, Project, Ticket, normalize_keywords
+
+CACHE_TIMEOUT = getattr(settings, 'PONYMINE_FEED_CACHE_TIMEOUT', 60 * 60)
+
+# how many entries each feed has
+FEED_SIZE = getattr(settings, 'PONYMINE_FEED_SIZE', 30)
+
+class TicketFeed(Feed):
+    """
+    Base class for the feeds whose entries are tickets, most recently updated
+    first.
+    """
+    feed_type = Atom1Feed
+    description_template = 'ponymine/feeds/ticket.html'
+
+    def get_tickets(self, tickets):
+        tickets = tickets.select_related('ticket_type', 'status', 'priority',
+                                         'reported_by', 'assigned_to')
+        return tickets.order_by('-date_updated', '-id')[:FEED_SIZE]
+
+    def item_pubdate(self, ticket):
+        return ticket.date_updated
+
+    def item_author_name(self, ticket):
+        return ticket.reported_by and ticket.reported_by.username or None
+
+    def item_categories(self, ticket):
+        return ticket.keyword_list()
+
+class ProjectTicketsFeed(TicketFeed):
+    def title(self, project):
+        return _('%s: Tickets') % project.name
+
+    def link(self, project):
+        return reverse('ponymine_view_project_tickets', args=[project.path])
+
+    def items(self, project):
+        return self.get_tickets(Ticket.objects.filter(project=project))
+
+class AssignedTicketsFeed(TicketFeed):
+    """
+    The tickets assigned to a user, limited to the projects that `viewer`
+    may see.
+    """
+    def __init__(self, viewer=None):
+        self.viewer = viewer
+
+    def title(self, user):
+        return _('Tickets assigned to %s') % user.username
+
+    def link(self, user):
+        return reverse('ponymine_user_activity', args=[user.username])
+
+    def items(self, user):
+        projects = Project.objects.for_user(self.viewer).values('pk')
+        return self.get_tickets(Ticket.objects.filter(assigned_to=user,
+                                                      project__in=projects))
+
+class KeywordFeed(TicketFeed):
+    """
+    The tickets with a keyword, limited to the projects that `viewer` may
+    see.
+    """
+    def __init__(self, viewer=None):
+        self.viewer = viewer
+
+    def title(self, keyword):
+        return _('Tickets with keyword %s') % keyword
+
+    def link(self, keyword):
+        return reverse('ponymine_tickets_with_keyword', args=[keyword])
+
+    def items(self, keyword):
+        projects = Project.objects.for_user(self.viewer).values('pk')
+        return self.get_tickets(Ticket.objects.filter(tags__name=keyword,
+                                                      project__in=projects))
+
+class TicketHistoryFeed(Feed):
+    """
+    The changes made to a ticket, most recent first.
+    """
+    feed_type = Atom1Feed
+    description_template = 'ponymine/feeds/log.html'
+
+    def title(self, ticket):
+        return ticket.__unicode__()
+
+    def link(self, ticket):
+        return ticket.get_absolute_url()
+
+    def items(self, ticket):
+        logs = Log.objects.filter(ticket=ticket).select_related('created_by')
+        logs = list(logs.order_by('-date_created', '-id')[:FEED_SIZE])
+        attach_changes(logs)
+        for log in logs:
+            log.ticket = ticket
+        return logs
+
+    def item_title(self, log):
+        labels = [unicode(c.label) for c in log.change_list if c.content_type_id]
+        if labels:
+            return _('Changed %s') % u', '.join(labels)
+        return _('Comment')
+
+    def item_link(self, log):
+        return '%s#log-%i' % (log.ticket.get_absolute_url(), log.id)
+
+    def item_pubdate(self, log):
+        return log.date_created
+
+    def item_author_name(self, log):
+        return log.created_by and log.created_by.username or None
+
+def invalidate_projects(*project_ids):
+    """
+    Invalidates the feeds of the projects with `project_ids` and the
+    assignee and keyword feeds of their tickets, for tickets that were
+    written without sending any signals (by an import, for example).
+    """
+    project_ids = [pk for pk in project_ids if pk]
+    if not project_ids:
+        return
+
+    for project_id in project_ids:
+        bump_version('feed', 'project', project_id)
+    tickets = Ticket.objects.filter(project__in=project_ids).order_by()
+    for user_id in tickets.filter(assigned_to__isnull=False) \
+                          .values_list('assigned_to', flat=True).distinct():
+        bump_version('feed', 'user', user_id)
+    keywords = Keyword.objects.filter(tickets__in=tickets.values('pk')).order_by()
+    for keyword in keywords.values_list('name', flat=True).distinct():
+        bump_version('feed', 'keyword', keyword)
+
+def ticket_changed(sender, instance, **kwargs):
+    """
+    Invalidates every feed that shows `instance`, including the ones it
+    just left.
+    """
+    original_project, original_status = instance._original_state
+    for project_id in set([instance.project_id, original_project]):
+        bump_version('feed', 'project', project_id)
+    bump_version('feed', 'ticket', instance.id)
+    for user_id in set([instance.assigned_to_id, instance._original_assignee]):
+        if user_id:
+            bump_version('feed', 'user', user_id)
+    keywords = set(normalize_keywords(instance.keywords))
+    keywords.update(normalize_keywords(instance._original_keywords))
+    for keyword in keywords:
+        bump_version('feed', 'keyword', keyword)
+
+def tickets_updated(sender, tickets, **kwargs):
+    for ticket in tickets:
+        ticket_changed(sender, ticket)
+
+def logs_created(sender, logs, **kwargs):
+    for ticket_id in set([log.ticket_id for log in logs]):
+        bump_version('feed', 'ticket', ticket_id)
+
+def project_changed(sender, instance, **kwargs):
+    bump_version('feed', 'project', instance.id)
@@ -0,0 +1,148 @@
+"""
+Caches rendered template fragments, such as the rows of the ticket and
+project tables.
+
+Fragments live in a process-local LRU cache of `PONYMINE_FRAGMENT_CACHE_SIZE`
+entries.  When `PONYMINE_FRAGMENT_CACHE_TIMEOUT` is set, they are also shared
+between processes through Django's cache framework.  Keys include the object's
+`date_updated` and the versions of the lookup tables, so changed objects (and
+renamed statuses, priorities and ticket types) simply stop matching their old
+fragments.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import translation
+from django.utils.hashcompat import md5_constructor
+from ponymine.cache import make_key
+from ponymine.lookups import tables_version
+from ponymine.models import Project, TicketType, Status, Priority
+import datetime
+import threading
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from django.utils.datastructures import SortedDict
+
+    class OrderedDict(SortedDict):
+        def popitem(self, last=True):
+            key = self.keyOrder[last and -1 or 0]
+            return key, self.pop(key)
+
+CACHE_SIZE = getattr(settings, 'PONYMINE_FRAGMENT_CACHE_SIZE', 5000)
+SHARED_TIMEOUT = getattr(settings, 'PONYMINE_FRAGMENT_CACHE_TIMEOUT', 0)
+
+# lookup tables whose names show up in fragments
+LOOKUP_MODELS = (TicketType, Status, Priority)
+
+class LRUCache(object):
+    """
+    A thread-safe dictionary that forgets its least recently used entries
+    once it holds more than `size` of them.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        self.lock.acquire()
+        try:
+            value = self.data.pop(key, None)
+            if value is not None:
+                self.data[key] = value
+            return value
+        finally:
+            self.lock.release()
+
+    def set(self, key, value):
+        self.lock.acquire()
+        try:
+            self.data.pop(key, None)
+            self.data[key] = value
+            while len(self.data) > self.size:
+                self.data.popitem(last=False)
+                self.evictions += 1
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.data.clear()
+        finally:
+            self.lock.release()
+
+    def __len__(self):
+        return len(self.data)
+
+_local = LRUCache(CACHE_SIZE)
+_stats = {'hits': 0, 'shared_hits': 0, 'misses': 0}
+
+def get_stats():
+    """
+    Returns the hit and miss counters of this process, along with the size
+    of the local cache, to help with sizing it.
+    """
+    stats = dict(_stats)
+    stats['size'] = len(_local)
+    stats['capacity'] = _local.size
+    stats['evictions'] = _local.evictions
+    lookups = stats['hits'] + stats['shared_hits'] + stats['misses']
+    stats['hit_ratio'] = lookups and float(lookups - stats['misses']) / lookups or 0.0
+    return stats
+
+def fragment_key(name, obj, *vary_on):
+    """
+    Builds the key for the fragment `name` of `obj`, which varies on the
+    object's ID and `date_updated`, the lookup tables, the active language
+    and `vary_on`.
+    """
+    bits = [obj._meta.app_label, obj._meta.object_name, obj.pk,
+            getattr(obj, 'date_updated', ''), tables_version(*LOOKUP_MODELS)] + list(vary_on)
+    digest = md5_constructor(u'|'.join([unicode(b) for b in bits]).encode('utf-8'))
+    return make_key('fragment', name, translation.get_language(), digest.hexdigest())
+
+def get_fragment(key):
+    content = _local.get(key)
+    if content is not None:
+        _stats['hits'] += 1
+        return content
+
+    if SHARED_TIMEOUT:
+        content = cache.get(key)
+        if content is not None:
+            _stats['shared_hits'] += 1
+            _local.set(key, content)
+            return content
+
+    _stats['misses'] += 1
+    return None
+
+def set_fragment(key, content):
+    _local.set(key, content)
+    if SHARED_TIMEOUT:
+        cache.set(key, content, SHARED_TIMEOUT)
+
+def touch_projects(*project_ids):
+    """
+    Bumps the `date_updated` of projects so that their cached fragments are
+    no longer used.
+    """
+    project_ids = [pk for pk in project_ids if pk]
+    if project_ids:
+        Project._base_manager.filter(pk__in=project_ids).update(
+                date_updated=datetime.datetime.now())
+
+def ticket_changed(sender, instance, **kwargs):
+    touch_projects(instance.project_id, instance._original_state[0])
+
+def tickets_updated(sender, tickets, **kwargs):
+    project_ids = set()
+    for ticket in tickets:
+        project_ids.update([ticket.project_id, ticket._original_state[0]])
+    touch_projects(*project_ids)
+
+def membership_changed(sender, instance, **kwargs):
+    touch_projects(instance.project_id, instance._original_state[0])
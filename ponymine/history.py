@@ -0,0 +1,105 @@
+"""
+Loads the history of tickets in a fixed number of queries.
+
+All logs of the requested tickets are fetched with one query and all of
+their changes with another.  The objects that the changes point at are then
+grouped by content type and resolved with one `in_bulk` per type (lookup
+tables such as statuses come straight from the lookup cache).
+"""
+from django.contrib.contenttypes.models import ContentType
+from ponymine.models import Log, ChangeLog
+from ponymine.managers import AttributeWithDefaultManager
+
+# how many tickets to load the history of at once when streaming
+CHUNK_SIZE = 200
+
+def _resolve_objects(changes):
+    """
+    Returns a dictionary of `{content_type_id: {id: object}}` for every
+    object referenced by `changes`.
+    """
+    wanted = {}
+    for change in changes:
+        if change.content_type_id:
+            ids = wanted.setdefault(change.content_type_id, set())
+            ids.update([pk for pk in (change.old_id, change.new_id) if pk])
+
+    objects = {}
+    for ct_id, ids in wanted.items():
+        model = ContentType.objects.get_for_id(ct_id).model_class()
+        if model is None:
+            objects[ct_id] = {}
+        elif isinstance(model._default_manager, AttributeWithDefaultManager):
+            by_id = dict((row.id, row) for row in model._default_manager.cached())
+            objects[ct_id] = dict((pk, by_id[pk]) for pk in ids if pk in by_id)
+        else:
+            objects[ct_id] = model._default_manager.in_bulk(list(ids))
+    return objects
+
+def load_histories(tickets):
+    """
+    Returns a dictionary that maps the ID of each ticket in `tickets` to its
+    list of logs, oldest first.  Each log has a `change_list` of ChangeLog
+    objects whose `old_value` and `new_value` attributes hold the resolved
+    objects (or `None`).
+    """
+    ticket_ids = [getattr(t, 'id', t) for t in tickets]
+    histories = dict((pk, []) for pk in ticket_ids)
+    if not ticket_ids:
+        return histories
+
+    logs = Log.objects.filter(ticket__in=ticket_ids).select_related('created_by')
+    logs = list(logs.order_by('date_created', 'id'))
+    for log in logs:
+        histories[log.ticket_id].append(log)
+    attach_changes(logs)
+
+    return histories
+
+def attach_changes(logs):
+    """
+    Loads the changes of every log in `logs` into its `change_list`, with
+    `old_value` and `new_value` resolved as described in `load_histories`.
+    """
+    by_id = {}
+    for log in logs:
+        log.change_list = []
+        by_id[log.id] = log
+
+    changes = []
+    if by_id:
+        changes = list(ChangeLog.objects.filter(log__in=by_id.keys()).order_by('id'))
+    objects = _resolve_objects(changes)
+
+    for change in changes:
+        if change.content_type_id:
+            change.content_type = ContentType.objects.get_for_id(change.content_type_id)
+        found = objects.get(change.content_type_id, {})
+        change.old_value = found.get(change.old_id)
+        change.new_value = found.get(change.new_id)
+        by_id[change.log_id].change_list.append(change)
+
+def load_history(ticket):
+    """
+    Returns the list of logs for a single ticket.  See `load_histories`.
+    """
+    return load_histories([ticket])[ticket.id]
+
+def iter_histories(tickets, chunk_size=CHUNK_SIZE):
+    """
+    Yields a `(ticket, logs)` pair for every ticket in the iterable
+    `tickets`, loading the histories `chunk_size` tickets at a time.
+    """
+    chunk = []
+    for ticket in tickets:
+        chunk.append(ticket)
+        if len(chunk) >= chunk_size:
+            histories = load_histories(chunk)
+            for t in chunk:
+                yield t, histories[t.id]
+            chunk = []
+
+    if chunk:
+        histories = load_histories(chunk)
+        for t in chunk:
+            yield t, histories[t.id]
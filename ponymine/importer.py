@@ -0,0 +1,344 @@
+"""
+Imports tickets, along with their logs and changes, in bulk.
+
+The input uses the same columns as `ponymine.export`, so an export can be
+imported again.  Project paths, ticket types, statuses, priorities,
+components and users are resolved through in-memory maps that are loaded
+once, rows are validated a chunk at a time, and every chunk is written with
+a few multi-row INSERTs inside its own transaction.
+
+New rows are given IDs up front (after the current highest ID) so that logs
+and changes can point at their tickets without reading them back.  Imports
+should therefore not run while tickets are being created through the site.
+Once all rows are in, the sequences are reset, the ticket counters,
+keywords, search index and activity of the imported tickets and their
+projects are rebuilt, and their cached feeds are thrown away.  Lines that
+cannot be parsed are rejected like any other invalid row.
+"""
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import simplejson
+from ponymine.cache import bump_version
+from ponymine.fragments import touch_projects
+from ponymine.lookups import get_table
+from ponymine.models import Project, Component, Ticket, TicketType, Status, \
+                            Priority, Log, ChangeLog
+from ponymine.utils import bulk_insert, get_attribute_content_type
+from ponymine import activity, counters, feeds, keywords, search
+import csv
+import datetime
+import time
+
+# how many rows to validate and write at once
+CHUNK_SIZE = 1000
+
+DATE_FORMATS = ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d')
+
+class InvalidRow(ValueError):
+    pass
+
+def _parse_date(value):
+    if not value:
+        return None
+    value, micro = (value.split('.', 1) + ['0'])[:2]
+    for format in DATE_FORMATS:
+        try:
+            date = datetime.datetime.strptime(value, format)
+        except ValueError:
+            continue
+        return date.replace(microsecond=int(micro[:6].ljust(6, '0')))
+    raise InvalidRow('Invalid date: %s' % value)
+
+def read_csv(stream):
+    """
+    Yields a dictionary for every row of the CSV file `stream`, or an
+    `InvalidRow` for rows that cannot be read.
+    """
+    reader = csv.DictReader(stream)
+    while True:
+        try:
+            row = reader.next()
+        except StopIteration:
+            break
+        except csv.Error, err:
+            yield InvalidRow('Invalid CSV: %s' % err)
+            continue
+
+        try:
+            row = dict((key, value.decode('utf-8')) for key, value in row.items()
+                       if key is not None and value is not None)
+        except UnicodeDecodeError:
+            row = InvalidRow('Invalid UTF-8')
+        yield row
+
+def read_json(stream):
+    """
+    Yields a dictionary for every line of the JSON-lines file `stream`, or an
+    `InvalidRow` for lines that cannot be read.
+    """
+    for line in stream:
+        if line.strip():
+            try:
+                row = simplejson.loads(line)
+            except ValueError, err:
+                # this includes lines that aren't UTF-8
+                row = InvalidRow('Invalid JSON: %s' % err)
+            yield row
+
+READERS = {
+    'csv': read_csv,
+    'json': read_json,
+}
+
+class _Map(object):
+    """
+    Maps lowercase names to IDs, with an optional default ID for blank names.
+    """
+    def __init__(self, label, pairs, default=None):
+        self.label = label
+        self.ids = dict((unicode(name).lower(), pk) for name, pk in pairs)
+        self.default = default
+
+    def __call__(self, name, required=True):
+        name = (name or u'').strip()
+        if not name:
+            if required and self.default is None:
+                raise InvalidRow('Missing %s' % self.label)
+            return self.default
+        try:
+            return self.ids[name.lower()]
+        except KeyError:
+            raise InvalidRow('Unknown %s: %s' % (self.label, name))
+
+def _lookup_map(label, model):
+    table = get_table(model)
+    return _Map(label, [(row.name, row.id) for row in table.rows],
+                table.default and table.default.id)
+
+class TicketImporter(object):
+    """
+    Imports ticket rows.  `rejected` collects a `(row number, message)` pair
+    for every row that could not be imported.
+    """
+    def __init__(self, chunk_size=CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.rejected = []
+        self.imported = 0
+        self.elapsed = 0.0
+        self.project_ids = set()
+
+        self.ticket_types = _lookup_map('ticket type', TicketType)
+        self.statuses = _lookup_map('status', Status)
+        self.priorities = _lookup_map('priority', Priority)
+
+        projects = Project._base_manager.values_list('slug_path', 'id_path', 'name', 'id')
+        self.projects = _Map('project', [(row[0], row[3]) for row in projects])
+        # older exports wrote changes to the project of a ticket as the names
+        # of the project and its parents, like `Project.hierarchy_str`
+        names = dict((row[3], row[2]) for row in projects)
+        self.project_names = _Map('project', [
+                (u': '.join([names.get(int(pk), u'') for pk in row[1].split('/') if pk]),
+                 row[3]) for row in projects if row[1]])
+        self.users = _Map('user', User.objects.values_list('username', 'id'))
+
+        self.components = {}
+        for project_id, name, pk in Component.objects.values_list('project', 'name', 'id'):
+            self.components[(project_id, name.lower())] = pk
+
+        self.change_types = {}
+        for attr in ('ticket_type', 'status', 'priority', 'component',
+                     'assigned_to', 'project'):
+            self.change_types[get_attribute_content_type(attr).name] = attr
+
+        self.next_ticket_id = (Ticket.objects.aggregate(m=Max('id'))['m'] or 0) + 1
+        self.first_ticket_id = self.next_ticket_id
+        self.next_log_id = (Log.objects.aggregate(m=Max('id'))['m'] or 0) + 1
+
+    def _component(self, project_id, name):
+        name = (name or u'').strip()
+        if not name:
+            return None
+        try:
+            return self.components[(project_id, name.lower())]
+        except KeyError:
+            raise InvalidRow('Unknown component: %s' % name)
+
+    def _resolve(self, attr, project_id, name):
+        """
+        Returns the ID of the object that a change to `attr` refers to by
+        `name`, or `None` if it no longer exists.
+        """
+        if not name:
+            return None
+        try:
+            if attr == 'component':
+                return self._component(project_id, name)
+            if attr == 'assigned_to':
+                return self.users(name, required=False)
+            if attr == 'project':
+                try:
+                    return self.projects(name, required=False)
+                except InvalidRow:
+                    return self.project_names(name, required=False)
+            return {'ticket_type': self.ticket_types,
+                    'status': self.statuses,
+                    'priority': self.priorities}[attr](name, required=False)
+        except InvalidRow:
+            return None
+
+    def build_ticket(self, row):
+        """
+        Returns an unsaved Ticket for `row`, or raises `InvalidRow`.
+        """
+        subject = (row.get('subject') or u'').strip()
+        if not subject:
+            raise InvalidRow('Missing subject')
+        if len(subject) > Ticket._meta.get_field('subject').max_length:
+            raise InvalidRow('Subject is too long')
+        keywords = row.get('keywords') or u''
+        if len(keywords) > Ticket._meta.get_field('keywords').max_length:
+            raise InvalidRow('Keywords are too long')
+
+        project_id = self.projects(row.get('project'))
+        ticket = Ticket(id=self.next_ticket_id,
+                        project_id=project_id,
+                        ticket_type_id=self.ticket_types(row.get('ticket_type')),
+                        status_id=self.statuses(row.get('status')),
+                        priority_id=self.priorities(row.get('priority')),
+                        component_id=self._component(project_id, row.get('component')),
+                        reported_by_id=self.users(row.get('reported_by'), required=False),
+                        assigned_to_id=self.users(row.get('assigned_to'), required=False),
+                        subject=subject,
+                        description=row.get('description') or u'',
+                        keywords=keywords,
+                        date_created=_parse_date(row.get('date_created')),
+                        date_updated=_parse_date(row.get('date_updated')))
+        self.next_ticket_id += 1
+        return ticket
+
+    def build_history(self, ticket, history):
+        """
+        Returns the unsaved logs and changes described by `history`.
+        """
+        if isinstance(history, basestring):
+            history = history.strip() and simplejson.loads(history) or []
+
+        logs, changes = [], []
+        for entry in history or []:
+            log = Log(id=self.next_log_id,
+                      ticket_id=ticket.id,
+                      notes=entry.get('notes') or u'',
+                      created_by_id=self.users(entry.get('created_by'), required=False),
+                      date_created=_parse_date(entry.get('date_created')),
+                      date_updated=_parse_date(entry.get('date_created')))
+            self.next_log_id += 1
+            logs.append(log)
+
+            for change in entry.get('changes', []):
+                attr = self.change_types.get(change.get('attribute'))
+                if attr is None:
+                    continue
+                changes.append(ChangeLog(
+                    log_id=log.id,
+                    content_type=get_attribute_content_type(attr),
+                    old_id=self._resolve(attr, ticket.project_id, change.get('old')),
+                    new_id=self._resolve(attr, ticket.project_id, change.get('new'))))
+        return logs, changes
+
+    def import_chunk(self, rows):
+        """
+        Validates and writes `rows`, a list of `(row number, row)` pairs.
+        """
+        tickets, logs, changes = [], [], []
+        for number, row in rows:
+            if isinstance(row, InvalidRow):
+                self.rejected.append((number, unicode(row)))
+                continue
+
+            next_ids = self.next_ticket_id, self.next_log_id
+            try:
+                ticket = self.build_ticket(row)
+                ticket_logs, ticket_changes = self.build_history(ticket, row.get('history'))
+            except (InvalidRow, ValueError, AttributeError), err:
+                # give the IDs back so that there are no gaps
+                self.next_ticket_id, self.next_log_id = next_ids
+                self.rejected.append((number, unicode(err)))
+                continue
+
+            tickets.append(ticket)
+            logs.extend(ticket_logs)
+            changes.extend(ticket_changes)
+
+        self._write(tickets, logs, changes)
+        self.imported += len(tickets)
+        self.project_ids.update([t.project_id for t in tickets])
+
+    @transaction.commit_on_success
+    def _write(self, tickets, logs, changes):
+        if tickets:
+            bulk_insert(tickets, with_pk=True)
+        if logs:
+            bulk_insert(logs, with_pk=True)
+        if changes:
+            bulk_insert(changes)
+
+    def run(self, rows):
+        """
+        Imports every row in the iterable `rows` and rebuilds the data derived
+        from tickets.  Returns the number of imported tickets.
+        """
+        started = time.time()
+        try:
+            chunk = []
+            for number, row in enumerate(rows):
+                chunk.append((number + 1, row))
+                if len(chunk) >= self.chunk_size:
+                    self.import_chunk(chunk)
+                    chunk = []
+            if chunk:
+                self.import_chunk(chunk)
+        finally:
+            # the chunks written so far are committed even if a later one
+            # fails, so they still need everything derived from them
+            if self.imported:
+                self.finish()
+        self.elapsed = time.time() - started
+        return self.imported
+
+    def finish(self):
+        """
+        Resets the ID sequences and rebuilds everything that is normally kept
+        up to date by the signals that bulk inserts skip, for the imported
+        tickets and their projects only.
+        """
+        cursor = connection.cursor()
+        for sql in connection.ops.sequence_reset_sql(no_style(), [Ticket, Log, ChangeLog]):
+            cursor.execute(sql)
+        transaction.commit_unless_managed()
+
+        # imported tickets were given consecutive IDs
+        tickets = Ticket.objects.filter(pk__gte=self.first_ticket_id,
+                                        pk__lt=self.next_ticket_id)
+        counters.rebuild_ticket_counts(self.project_ids)
+        keywords.rebuild_keywords(tickets)
+        search.rebuild_index(tickets)
+        activity.rebuild_activity(tickets)
+
+        for project_id in self.project_ids:
+            bump_version('summary', project_id)
+        touch_projects(*self.project_ids)
+        feeds.invalidate_projects(*self.project_ids)
+
+def import_tickets(stream, format='csv', chunk_size=CHUNK_SIZE):
+    """
+    Imports the tickets in the file `stream` and returns the importer, which
+    knows how many rows were imported and which were rejected.
+    """
+    if format not in READERS:
+        raise ValueError('Unknown import format: %s' % format)
+
+    importer = TicketImporter(chunk_size)
+    importer.run(READERS[format](stream))
+    return importer
@@ -0,0 +1,108 @@
+"""
+Keeps the normalized `Keyword` rows of tickets in sync with the free-form
+`keywords` field that people actually edit.
+"""
+from django.db import connection, transaction, IntegrityError
+from django.db.models import Count
+from ponymine.models import Keyword, Ticket, normalize_keywords
+
+# how many tickets to process at once when rebuilding the keywords
+CHUNK_SIZE = 1000
+
+def get_keywords(names):
+    """
+    Returns a dictionary of `{name: Keyword}` for each name in `names`,
+    creating any keywords that do not exist yet.
+    """
+    keywords = dict((k.name, k) for k in Keyword.objects.filter(name__in=names))
+    for name in names:
+        if name in keywords:
+            continue
+        sid = transaction.savepoint()
+        try:
+            keywords[name] = Keyword.objects.create(name=name)
+            transaction.savepoint_commit(sid)
+        except IntegrityError:
+            # somebody else created the keyword in the meantime
+            transaction.savepoint_rollback(sid)
+            keywords[name] = Keyword.objects.get(name=name)
+    return keywords
+
+def sync_ticket_keywords(ticket):
+    """
+    Makes the tags of `ticket` match its `keywords` field.
+    """
+    names = normalize_keywords(ticket.keywords)
+    current = dict(ticket.tags.values_list('name', 'id'))
+
+    added = [name for name in names if name not in current]
+    removed = [pk for name, pk in current.items() if name not in names]
+
+    if added:
+        ticket.tags.add(*get_keywords(added).values())
+    if removed:
+        ticket.tags.remove(*removed)
+
+def ticket_saved(sender, instance, created=False, **kwargs):
+    if created and not instance.keywords:
+        return
+    if created or instance.keywords != instance._original_keywords:
+        sync_ticket_keywords(instance)
+
+def tickets_updated(sender, tickets, fields, **kwargs):
+    if 'keywords' in fields:
+        changed = [t.id for t in tickets if t.keywords != t._original_keywords]
+        if changed:
+            rebuild_keywords(Ticket.objects.filter(pk__in=changed))
+
+def keyword_counts(tickets):
+    """
+    Returns the keywords used by the tickets in the `tickets` QuerySet, each
+    annotated with the number of those tickets using it as `count`, using one
+    grouped query.
+    """
+    return Keyword.objects.filter(tickets__in=tickets.order_by().values('pk')) \
+                          .annotate(count=Count('tickets')).order_by('name')
+
+@transaction.commit_on_success
+def rebuild_keywords(tickets=None):
+    """
+    Splits the `keywords` of the tickets in the `tickets` QuerySet, or of
+    every ticket, into `Keyword` rows from scratch.  This is also how
+    existing databases are migrated to the keyword table.  Returns the number
+    of tickets processed.
+    """
+    through = Ticket.tags.through
+    table = connection.ops.quote_name(through._meta.db_table)
+    if tickets is None:
+        tickets = Ticket.objects.all()
+        through.objects.all().delete()
+    else:
+        through.objects.filter(ticket__in=tickets.values('pk')).delete()
+
+    count, last_id = 0, 0
+    while True:
+        rows = tickets.filter(pk__gt=last_id).order_by('id')
+        rows = list(rows.values_list('id', 'keywords')[:CHUNK_SIZE])
+        if not rows:
+            break
+
+        names = {}
+        for pk, keywords in rows:
+            names[pk] = normalize_keywords(keywords)
+
+        all_names = set()
+        for ticket_names in names.values():
+            all_names.update(ticket_names)
+        keywords = get_keywords(list(all_names))
+
+        links = [(pk, keywords[name].id) for pk, ticket_names in names.items()
+                                         for name in ticket_names]
+        connection.cursor().executemany(
+                'INSERT INTO %s (ticket_id, keyword_id) VALUES (%%s, %%s)' % table,
+                links)
+
+        count += len(rows)
+        last_id = rows[-1][0]
+
+    return count
@@ -0,0 +1,86 @@
+"""
+Caches the small lookup tables that tickets and memberships point at:
+statuses, priorities, ticket types and roles.
+
+Each table is kept in a process-local cache for a few seconds and in the
+shared cache for much longer.  Saving or deleting a row invalidates both, so
+changes show up in every process within `PONYMINE_LOOKUP_LOCAL_TIMEOUT`
+seconds.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from ponymine.cache import make_key, get_version, bump_version
+import time
+
+LOCAL_TIMEOUT = getattr(settings, 'PONYMINE_LOOKUP_LOCAL_TIMEOUT', 5)
+CACHE_TIMEOUT = getattr(settings, 'PONYMINE_LOOKUP_CACHE_TIMEOUT', 60 * 60)
+
+# db_table => (expiration time, LookupTable)
+_local = {}
+
+class LookupTable(object):
+    """
+    All of the rows of one lookup table, as of `version`.
+    """
+    def __init__(self, rows, version=None):
+        self.rows = rows
+        self.version = version
+        self.by_id = dict((row.id, row) for row in rows)
+
+        self.default = None
+        for row in rows:
+            if getattr(row, 'is_default', False):
+                self.default = row
+                break
+
+    def get(self, pk):
+        return self.by_id.get(pk)
+
+def get_table(model):
+    """
+    Returns the `LookupTable` for `model`.
+    """
+    name = model._meta.db_table
+    now = time.time()
+
+    entry = _local.get(name)
+    if entry and entry[0] > now:
+        return entry[1]
+
+    version = get_version('lookup', name)
+    key = make_key('lookup', name, version)
+    rows = cache.get(key)
+    if rows is None:
+        rows = list(model._default_manager.all())
+        cache.set(key, rows, CACHE_TIMEOUT)
+
+    table = LookupTable(rows, version)
+    _local[name] = (now + LOCAL_TIMEOUT, table)
+    return table
+
+def get_closed_status_ids():
+    """
+    Returns a frozenset of the IDs of all statuses that close a ticket.
+    """
+    from ponymine.models import Status
+    table = get_table(Status)
+    if not hasattr(table, 'closed_ids'):
+        table.closed_ids = frozenset(s.id for s in table.rows if s.is_closed)
+    return table.closed_ids
+
+def tables_version(*models):
+    """
+    Returns a string that changes whenever any of the lookup tables of
+    `models` does, for the keys of cached entries built from their rows.
+    This is served from the same process-local cache as the rows, so it is
+    cheap enough to call for every row of a table.
+    """
+    return '-'.join([str(get_table(model).version) for model in models])
+
+def invalidate(model):
+    name = model._meta.db_table
+    _local.pop(name, None)
+    bump_version('lookup', name)
+
+def table_changed(sender, instance, **kwargs):
+    invalidate(sender)
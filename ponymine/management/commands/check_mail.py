@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.management.base import NoArgsCommand, CommandError
+from optparse import make_option
+from ponymine.email.utils import check_mail
+import sys
+
+class Command(NoArgsCommand):
+    help = 'Turns new messages in a POP3 mailbox into tickets and replies.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--server', dest='server',
+                    default=getattr(settings, 'PONYMINE_MAIL_SERVER', 'localhost')),
+        make_option('--port', dest='port', type='int',
+                    default=getattr(settings, 'PONYMINE_MAIL_PORT', None)),
+        make_option('--ssl', dest='ssl', action='store_true',
+                    default=getattr(settings, 'PONYMINE_MAIL_SSL', False)),
+        make_option('--user', dest='user',
+                    default=getattr(settings, 'PONYMINE_MAIL_USER', None)),
+        make_option('--password', dest='password',
+                    default=getattr(settings, 'PONYMINE_MAIL_PASSWORD', None)),
+        make_option('--project', dest='project',
+                    default=getattr(settings, 'PONYMINE_MAIL_PROJECT', None),
+                    help='The path of the project that new tickets go to.'),
+        make_option('--processes', dest='processes', type='int', default=None,
+                    help='How many processes parse messages.  Defaults to the number of CPUs.'),
+    )
+
+    def handle_noargs(self, **options):
+        if not options.get('user') or not options.get('project'):
+            raise CommandError('A mailbox user and a project are required.')
+
+        ssl = options.get('ssl', False)
+        port = options.get('port') or (ssl and 995 or 110)
+        try:
+            result = check_mail(options['user'], options.get('password'),
+                                options.get('server', 'localhost'), ssl, port,
+                                options['project'], options.get('processes'))
+        except ValueError, err:
+            raise CommandError(str(err))
+
+        for uid, message in result.failed:
+            sys.stderr.write('Message %s: %s\n' % (uid, message.encode('utf-8')))
+
+        if int(options.get('verbosity', 1)) > 0:
+            print 'Created %i ticket(s), added %i reply(s), rejected %i message(s) and left %i failed message(s) in the mailbox.' % (
+                    result.created, result.replied, result.rejected, len(result.failed))
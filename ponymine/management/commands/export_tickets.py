@@ -0,0 +1,56 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from ponymine import export
+from ponymine.models import Project, Ticket
+import sys
+
+class Command(BaseCommand):
+    help = 'Exports tickets as CSV or JSON lines.'
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default='csv',
+                    help='Either "csv" or "json".  Defaults to "csv".'),
+        make_option('--history', dest='history', action='store_true', default=False,
+                    help='Include the changes made to each ticket.'),
+        make_option('--user', dest='username',
+                    help='Only export the tickets that this user may see.'),
+        make_option('--project', dest='path',
+                    help='Only export the tickets of the project with this path.'),
+        make_option('--output', dest='output',
+                    help='Write to this file instead of standard output.'),
+    )
+
+    def handle(self, *args, **options):
+        format = options.get('format', 'csv')
+        if format not in export.FORMATS:
+            raise CommandError('Unknown format: %s' % format)
+
+        user = None
+        if options.get('username'):
+            try:
+                user = User.objects.get(username=options.get('username'))
+            except User.DoesNotExist:
+                raise CommandError('No such user: %s' % options.get('username'))
+
+        project = None
+        if options.get('path'):
+            project = Project.objects.with_path(options.get('path'), user)
+            if not project:
+                raise CommandError('No such project: %s' % options.get('path'))
+
+        if user is None:
+            tickets = Ticket.objects.all()
+            if project is not None:
+                tickets = tickets.filter(project=project)
+        else:
+            tickets = export.visible_tickets(user, project)
+
+        output = sys.stdout
+        if options.get('output'):
+            output = open(options.get('output'), 'wb')
+        try:
+            for data in export.export_tickets(tickets, format, options.get('history', False)):
+                output.write(data)
+        finally:
+            if output is not sys.stdout:
+                output.close()
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from ponymine import importer
+import sys
+
+class Command(BaseCommand):
+    help = 'Imports tickets from CSV or JSON lines in the format written by export_tickets.'
+    args = '[file]'
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default='csv',
+                    help='Either "csv" or "json".  Defaults to "csv".'),
+        make_option('--chunk-size', dest='chunk_size', type='int',
+                    default=importer.CHUNK_SIZE,
+                    help='How many rows to write in each transaction.'),
+    )
+
+    def handle(self, *args, **options):
+        format = options.get('format', 'csv')
+        if format not in importer.READERS:
+            raise CommandError('Unknown format: %s' % format)
+
+        stream = sys.stdin
+        if args:
+            stream = open(args[0], 'rb')
+        try:
+            result = importer.import_tickets(stream, format,
+                        options.get('chunk_size', importer.CHUNK_SIZE))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        for number, message in result.rejected:
+            sys.stderr.write('Row %i: %s\n' % (number, message.encode('utf-8')))
+
+        if int(options.get('verbosity', 1)) > 0:
+            rate = result.elapsed and result.imported / result.elapsed or 0
+            print 'Imported %i ticket(s) in %.1f seconds (%i per second); rejected %i row(s).' % (
+                    result.imported, result.elapsed, rate, len(result.rejected))
@@ -0,0 +1,10 @@
+from django.core.management.base import NoArgsCommand
+from ponymine.activity import rebuild_activity
+
+class Command(NoArgsCommand):
+    help = 'Writes the activity of every ticket and its changes from scratch.'
+
+    def handle_noargs(self, **options):
+        count = rebuild_activity()
+        if int(options.get('verbosity', 1)) > 0:
+            print 'Wrote %i activity row(s).' % count
@@ -0,0 +1,10 @@
+from django.core.management.base import NoArgsCommand
+from ponymine.keywords import rebuild_keywords
+
+class Command(NoArgsCommand):
+    help = 'Splits the keywords of every ticket into the normalized keyword table.'
+
+    def handle_noargs(self, **options):
+        count = rebuild_keywords()
+        if int(options.get('verbosity', 1)) > 0:
+            print 'Processed the keywords of %i ticket(s).' % count
@@ -0,0 +1,10 @@
+from django.core.management.base import NoArgsCommand
+from ponymine.models import Project
+
+class Command(NoArgsCommand):
+    help = 'Rebuilds the materialized path index of the project tree.'
+
+    def handle_noargs(self, **options):
+        changed = Project.objects.rebuild_tree()
+        if int(options.get('verbosity', 1)) > 0:
+            print 'Updated the tree index of %i project(s).' % changed
@@ -0,0 +1,10 @@
+from django.core.management.base import NoArgsCommand
+from ponymine.search import rebuild_index
+
+class Command(NoArgsCommand):
+    help = 'Rebuilds the full-text search index of tickets.'
+
+    def handle_noargs(self, **options):
+        count = rebuild_index()
+        if int(options.get('verbosity', 1)) > 0:
+            print 'Indexed %i ticket(s).' % count
@@ -0,0 +1,10 @@
+from django.core.management.base import NoArgsCommand
+from ponymine.counters import rebuild_ticket_counts
+
+class Command(NoArgsCommand):
+    help = 'Recomputes the denormalized ticket counters of every project.'
+
+    def handle_noargs(self, **options):
+        count = rebuild_ticket_counts()
+        if int(options.get('verbosity', 1)) > 0:
+            print 'Rebuilt the ticket counters of %i project(s).' % count
@@ -1,10 +1,31 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
+from ponymine import lookups
+from ponymine.permissions import get_project_ids
+
+class ProjectQuerySet(models.query.QuerySet):
+    def listing(self):
+        """
+        Loads everything that the project tables display about each project
+        along with the projects themselves.
+        """
+        return self.select_related('parent').annotate(
+                    member_count=models.Count('members'))
+
+class TicketQuerySet(models.query.QuerySet):
+    def listing(self):
+        """
+        Loads everything that the ticket tables display about each ticket
+        along with the tickets themselves.
+        """
+        return self.select_related('ticket_type', 'status', 'priority',
+                                   'project', 'assigned_to')
 
 class ProjectManager(models.Manager):
     def get_query_set(self):
-        return super(ProjectManager, self).get_query_set().filter(site__exact=Site.objects.get_current())
+        qs = ProjectQuerySet(self.model, using=self._db)
+        return qs.filter(site__exact=Site.objects.get_current())
 
     def active(self, user=None):
         qs = self.filter(is_active=True)
@@ -13,8 +34,7 @@ class ProjectManager(models.Manager):
         if isinstance(user, User):
             # superusers have access to everything
             if not user.is_superuser:
-                user_project_ids = [m.project.id for m in user.membership_set.all()]
-                qs = qs.filter(pk__in=user_project_ids)
+                qs = qs.filter(pk__in=get_project_ids(user))
 
         return qs.distinct()
 
@@ -37,6 +57,19 @@ class ProjectManager(models.Manager):
     def private(self, user=None):
         return self.active(user).filter(is_public=False)
 
+    def subtree(self, project, user=None):
+        """
+        Returns a QuerySet of `project` and all projects below it that are
+        visible to `user`.  The tree index turns this into a prefix match on
+        `id_path`, so the whole subtree is found by the database however deep
+        or wide it is.
+        """
+        qs = self.for_user(user)
+        if not project.id_path:
+            # the tree index hasn't been built for this project yet
+            return qs.filter(pk=project.id)
+        return qs.filter(id_path__startswith=project.id_path)
+
     def with_path(self, path, user=None):
         """
         Retrieves a project based on its "path," which is a list or tuple of
@@ -45,29 +78,89 @@ class ProjectManager(models.Manager):
         as they are children of different projects.
         """
 
-        project = None
-
-        # split the string version of the path if necessary
-        if not isinstance(path, list):
-            path = path.split('/')
+        # join the list version of the path if necessary
+        if isinstance(path, (list, tuple)):
+            path = '/'.join(path)
 
         try:
-            # iterate over all slugs
-            for slug in path:
-                if not project:
-                    # the top-most project for this path
-                    project = self.active(user).get(slug=slug)
-                else:
-                    # find the subproject of the current project with this slug
-                    project = project.subprojects.active(user).get(slug=slug)
+            return self.active(user).get(slug_path=path.strip('/'))
         except models.ObjectDoesNotExist:
-            pass
+            return None
+
+    def prime_hierarchies(self, projects):
+        """
+        Fills in the `hierarchy` of each project in `projects`, and of their
+        parents, using a single query for all of the ancestors involved.
+        Returns `projects` as a list.
+        """
+        projects = list(projects)
+        targets = []
+        for project in projects:
+            targets.append(project)
+            if project.parent_id:
+                # use `listing` or `select_related` to avoid a query here
+                targets.append(project.parent)
+
+        # projects without a tree index work out their hierarchy on their own
+        targets = [p for p in targets if p.id_path]
+
+        ids = set()
+        for project in targets:
+            ids.update(project.ancestor_ids)
+        ancestors = ids and self.in_bulk(list(ids)) or {}
 
-        return project
+        for project in targets:
+            project._hierarchy_cache = tuple(ancestors[pk]
+                        for pk in project.ancestor_ids if pk in ancestors) + (project,)
+
+        return projects
+
+    def rebuild_tree(self):
+        """
+        Recomputes the materialized `id_path` and `slug_path` of every project
+        from the `parent` relationships.  Returns the number of projects whose
+        paths were changed.
+        """
+        rows = self.model._base_manager.values_list('id', 'parent', 'slug',
+                                                    'id_path', 'slug_path')
+        projects = dict((row[0], row) for row in rows)
+        paths = {}
+
+        def build(pk):
+            if pk not in paths:
+                parent_id, slug = projects[pk][1:3]
+                if parent_id in projects:
+                    id_path, slug_path = build(parent_id)
+                    paths[pk] = ('%s%i/' % (id_path, pk),
+                                 '%s/%s' % (slug_path, slug))
+                else:
+                    paths[pk] = ('%i/' % pk, slug)
+            return paths[pk]
+
+        changed = 0
+        for pk, row in projects.items():
+            id_path, slug_path = build(pk)
+            if (id_path, slug_path) != row[3:]:
+                self.model._base_manager.filter(pk=pk).update(id_path=id_path,
+                                                              slug_path=slug_path)
+                changed += 1
+
+        return changed
 
 class AttributeWithDefaultManager(models.Manager):
+    def cached(self):
+        """
+        Returns a list of all objects, served from the lookup table cache.
+        """
+        return lookups.get_table(self.model).rows
+
     def default(self):
-        try:
-            return self.get(is_default=True)
-        except models.ObjectDoesNotExist:
-            return None
+        return lookups.get_table(self.model).default
+
+    def default_id(self):
+        """
+        Returns the ID of the default object (or `None`) without querying the
+        database.  This is meant to be used as the default of ForeignKeys.
+        """
+        default = lookups.get_table(self.model).default
+        return default and default.id
@@ -1,14 +1,33 @@
-from django.db import models
+from django.db import connection, models, transaction
 from django.contrib.auth.models import User, Permission
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
 from django.contrib.sites.models import Site
+from django.db.models import signals
 from django.utils.translation import ugettext_lazy as _
-from managers import ProjectManager, AttributeWithDefaultManager
+from managers import ProjectManager, AttributeWithDefaultManager, TicketQuerySet
+from ponymine import lookups, permissions
+from ponymine import signals as ponymine_signals
 
 # we use this a lot...
 BLNL = dict(blank=True, null=True)
 
+# the longest keyword name that fits in the `Keyword` table
+KEYWORD_LENGTH = 50
+
+def normalize_keywords(keywords):
+    """
+    Turns a comma-separated list of keywords into a list of unique, lower case
+    keywords without any surrounding whitespace.  Keywords longer than
+    `KEYWORD_LENGTH` are cut short.
+    """
+    names = []
+    for name in keywords.split(','):
+        name = name.strip().lower()[:KEYWORD_LENGTH].rstrip()
+        if name and name not in names:
+            names.append(name)
+    return names
+
 class Project(models.Model):
     """
     Offers a way to group tickets according to particular projects.
@@ -25,6 +44,15 @@ class Project(models.Model):
     date_created = models.DateTimeField(auto_now_add=True)
     date_updated = models.DateTimeField(auto_now=True)
 
+    # materialized tree index, kept in sync by `save`.  `id_path` looks like
+    # "1/5/9/" and `slug_path` like "parent/child/grandchild".
+    id_path = models.CharField(max_length=255, blank=True, db_index=True, editable=False)
+    slug_path = models.CharField(max_length=255, blank=True, db_index=True, editable=False)
+
+    # denormalized ticket counters, maintained by `ponymine.counters`
+    open_ticket_count = models.PositiveIntegerField(default=0, editable=False)
+    closed_ticket_count = models.PositiveIntegerField(default=0, editable=False)
+
     objects = ProjectManager()
 
     def __unicode__(self):
@@ -34,24 +62,55 @@ class Project(models.Model):
         return ('ponymine_view_project_summary', [], {'path': self.path})
     get_absolute_url = models.permalink(get_absolute_url)
 
+    def _get_ticket_count(self):
+        return self.open_ticket_count + self.closed_ticket_count
+    ticket_count = property(_get_ticket_count)
+
     def is_member(self, user):
-        return bool(user.is_superuser or user in self.members.all())
+        return bool(user.is_superuser or
+                    self.id in permissions.get_project_ids(user))
 
     def get_path_list(self):
         """
         Returns a list of project slugs that act as the "path" to this project
         """
-        return tuple(p.slug for p in self.hierarchy)
+        return tuple(self.path.split('/'))
 
     def _get_path(self):
-        return '/'.join(self.get_path_list())
+        if not self.slug_path:
+            return '/'.join(p.slug for p in self.hierarchy)
+        return self.slug_path
     path = property(_get_path)
 
+    def _get_ancestor_ids(self):
+        """
+        Returns the IDs of all ancestors of this project, top-most first.
+        """
+        ids = [int(pk) for pk in self.id_path.split('/') if pk]
+        return ids[:-1]
+    ancestor_ids = property(_get_ancestor_ids)
+
     def _get_hierarchy(self):
-        me = (self,)
-        if self.parent:
-            return self.parent.hierarchy + me
-        return me
+        """
+        Returns a tuple of all ancestors of this project, top-most first,
+        followed by the project itself.  The ancestors are retrieved with a
+        single query and remembered on the instance.
+        """
+        hierarchy = getattr(self, '_hierarchy_cache', None)
+        if hierarchy is None:
+            me = (self,)
+            ancestor_ids = self.ancestor_ids
+            if ancestor_ids:
+                ancestors = Project.objects.in_bulk(ancestor_ids)
+                hierarchy = tuple(ancestors[pk] for pk in ancestor_ids
+                                  if pk in ancestors) + me
+            elif self.parent_id and not self.id_path:
+                # the tree index hasn't been built for this project yet
+                hierarchy = self.parent.hierarchy + me
+            else:
+                hierarchy = me
+            self._hierarchy_cache = hierarchy
+        return hierarchy
     hierarchy = property(_get_hierarchy)
 
     def _get_hierarchy_str(self):
@@ -59,18 +118,91 @@ class Project(models.Model):
         return u': '.join(names)
     hierarchy_str = property(_get_hierarchy_str)
 
+    def get_descendants(self, include_self=False):
+        """
+        Returns a QuerySet of all projects below this one in the tree.
+        """
+        if not self.id_path:
+            # the tree index hasn't been built for this project yet, and an
+            # empty prefix would match every project
+            qs = Project.objects.filter(pk=self.id)
+        else:
+            qs = Project.objects.filter(id_path__startswith=self.id_path)
+        if not include_self:
+            qs = qs.exclude(pk=self.id)
+        return qs
+
+    def _build_tree_paths(self):
+        """
+        Returns the `(id_path, slug_path)` pair that this project should have
+        based on its parent.
+        """
+        if self.parent_id:
+            parent = self.parent
+            id_path, slug_path = parent.id_path, parent.slug_path
+            if not id_path:
+                id_path, slug_path = parent._build_tree_paths()
+            return ('%s%i/' % (id_path, self.id),
+                    '%s/%s' % (slug_path, self.slug))
+        return ('%i/' % self.id, self.slug)
+
+    def _update_tree_index(self):
+        """
+        Stores the materialized paths for this project and rewrites the paths
+        of any descendants when this project has moved or changed its slug.
+        """
+        old_id_path, old_slug_path = self.id_path, self.slug_path
+        id_path, slug_path = self._build_tree_paths()
+        if (id_path, slug_path) == (old_id_path, old_slug_path):
+            return
+
+        Project.objects.filter(pk=self.id).update(id_path=id_path,
+                                                  slug_path=slug_path)
+
+        if old_id_path:
+            # swap the old prefix of every descendant for the new one with a
+            # single UPDATE, however big the subtree is
+            if 'mysql' in connection.settings_dict['ENGINE']:
+                concat = 'CONCAT(%s, SUBSTR(%s, %s))'
+            else:
+                concat = '%s || SUBSTR(%s, %s)'
+            qn = connection.ops.quote_name
+            id_col, slug_col = qn('id_path'), qn('slug_path')
+            cursor = connection.cursor()
+            cursor.execute('UPDATE %s SET %s = %s, %s = %s WHERE %s LIKE %%s AND %s <> %%s' % (
+                    qn(Project._meta.db_table),
+                    id_col, concat % ('%s', id_col, '%s'),
+                    slug_col, concat % ('%s', slug_col, '%s'),
+                    id_col, qn('id')),
+                [id_path, len(old_id_path) + 1, slug_path, len(old_slug_path) + 1,
+                 old_id_path + '%', self.id])
+            transaction.commit_unless_managed()
+
+        self.id_path, self.slug_path = id_path, slug_path
+        self._hierarchy_cache = None
+
     def save(self, *args, **kwargs):
         """
         Ensures that a project which is a descendant of a private project is
-        always marked private as well.
+        always marked private as well, and keeps the tree index up to date.
         """
-        if self.is_public:
-            for project in self.hierarchy:
+        self._hierarchy_cache = None
+
+        if self.is_public and self.parent_id:
+            for project in self.parent.hierarchy:
                 if not project.is_public:
                     self.is_public = False
                     break
 
-        super(Project, self).__init__(*args, **kwargs)
+        if self.id:
+            # never overwrite the ticket counters with stale values
+            counts = Project._base_manager.filter(pk=self.id).values_list(
+                        'open_ticket_count', 'closed_ticket_count')
+            if counts:
+                self.open_ticket_count, self.closed_ticket_count = counts[0]
+
+        super(Project, self).save(*args, **kwargs)
+        self._update_tree_index()
 
     class Meta:
         ordering = ('name',)
@@ -102,11 +234,20 @@ class AttributeWithDefault(Attribute):
 
     def save(self, *args, **kwargs):
         """
-        Ensures that there is only one default object
+        Ensures that there is only one default object.  A partial unique index
+        (see `ponymine/sql`) enforces this in the database as well, so the
+        previous default has to be cleared first.
         """
         if self.is_default:
-            # mark all other objects as not being the default
-            self.__class__.objects.exclude(pk=self.id).update(is_default=False)
+            manager = self.__class__._default_manager
+            previous = manager.default()
+            if previous is None or previous.id != self.id:
+                # the cached default may be stale, in which case there is at
+                # most one other row to look for
+                if previous is None or not manager.filter(pk=previous.id,
+                        is_default=True).update(is_default=False):
+                    manager.filter(is_default=True).exclude(pk=self.id) \
+                           .update(is_default=False)
 
         super(AttributeWithDefault, self).save(*args, **kwargs)
 
@@ -128,7 +269,24 @@ class Membership(models.Model):
     """
     project = models.ForeignKey(Project)
     user = models.ForeignKey(User)
-    role = models.ForeignKey(Role, default=Role.objects.default)
+    role = models.ForeignKey(Role, default=Role.objects.default_id)
+
+    def __init__(self, *args, **kwargs):
+        super(Membership, self).__init__(*args, **kwargs)
+        self._remember_state()
+
+    def save(self, *args, **kwargs):
+        super(Membership, self).save(*args, **kwargs)
+        # the post_save handlers have seen the changes by now
+        self._remember_state()
+
+    def _remember_state(self):
+        """
+        Remembers the project and user of the membership, so that the cached
+        data of both the old and the new ones can be thrown away when it is
+        changed.
+        """
+        self._original_state = (self.project_id, self.user_id)
 
 class TicketType(AttributeWithDefault):
     """
@@ -167,71 +325,127 @@ class Component(Attribute):
         ordering = ('name',)
         unique_together = ('name', 'project')
 
+class Keyword(models.Model):
+    """
+    A normalized ticket keyword.  Names are always stored in lower case, so
+    the unique index on them is case-insensitive.
+    """
+    name = models.CharField(max_length=KEYWORD_LENGTH, unique=True)
+
+    def __unicode__(self):
+        return self.name
+
+    def get_absolute_url(self):
+        return ('ponymine_tickets_with_keyword', [], {'keyword': self.name})
+    get_absolute_url = models.permalink(get_absolute_url)
+
+    def save(self, *args, **kwargs):
+        self.name = self.name.strip().lower()
+        super(Keyword, self).save(*args, **kwargs)
+
+    class Meta:
+        ordering = ('name',)
+
 class TicketManager(models.Manager):
     """
     This manager is here so we avoid cyclic imports (with Status)
     """
-    def __init__(self, *args, **kwargs):
-        super(TicketManager, self).__init__(*args, **kwargs)
-        self._closed = None
+    def get_query_set(self):
+        return TicketQuerySet(self.model, using=self._db)
 
     def closed_statuses(self):
-        if self._closed == None:
-            self._closed = [st.id for st in Status.objects.filter(is_closed=True)]
-        return self._closed
+        return lookups.get_closed_status_ids()
     closed_statuses = property(closed_statuses)
 
     def closed(self, user=None):
-        qs = self.filter(status__id__in=self.closed_statuses)
+        qs = self.filter(status__id__in=list(self.closed_statuses))
         return self._filter_for_user(qs, user)
 
     def open(self, user=None):
-        qs = self.exclude(status__id__in=self.closed_statuses)
+        qs = self.exclude(status__id__in=list(self.closed_statuses))
         return self._filter_for_user(qs, user)
 
+    def in_subtree(self, project, user=None):
+        """
+        Returns the tickets of `project` and of every project below it that
+        `user` may see.
+        """
+        projects = Project.objects.subtree(project, user)
+        return self.filter(project__in=projects.values('pk'))
+
     def _filter_for_user(self, qs, user=None):
         """
         Finds tickets that this user has based on the projects that the user
         is a member of in some way.
         """
         if isinstance(user, User):
-            user_project_ids = [m.project.id for m in user.membership_set.all()]
-            qs = qs.filter(project__id__in=user_project_ids)
+            qs = qs.filter(project__id__in=permissions.get_project_ids(user))
         return qs.distinct()
 
 class Ticket(models.Model):
     project = models.ForeignKey(Project, related_name='tickets')
-    ticket_type = models.ForeignKey(TicketType, default=TicketType.objects.default)
+    ticket_type = models.ForeignKey(TicketType, default=TicketType.objects.default_id)
     component = models.ForeignKey(Component, **BLNL)
     reported_by = models.ForeignKey(User, related_name='reported_tickets', **BLNL)
     assigned_to = models.ForeignKey(User, related_name='assigned_tickets', **BLNL)
-    status = models.ForeignKey(Status, default=Status.objects.default)
-    priority = models.ForeignKey(Priority, default=Priority.objects.default)
+    status = models.ForeignKey(Status, default=Status.objects.default_id)
+    priority = models.ForeignKey(Priority, default=Priority.objects.default_id)
     subject = models.CharField(max_length=100)
     description = models.TextField()
     keywords = models.CharField(max_length=200, blank=True)
+    tags = models.ManyToManyField(Keyword, related_name='tickets', blank=True, editable=False)
     date_created = models.DateTimeField(auto_now_add=True)
     date_updated = models.DateTimeField(auto_now=True)
 
     objects = TicketManager()
 
+    def __init__(self, *args, **kwargs):
+        super(Ticket, self).__init__(*args, **kwargs)
+        self._remember_state()
+
     def __unicode__(self):
         return u'%s #%i - %s' % (self.ticket_type, self.id, self.subject)
 
+    def save(self, *args, **kwargs):
+        super(Ticket, self).save(*args, **kwargs)
+        # the post_save handlers have seen the changes by now
+        self._remember_state()
+
+    def _remember_state(self):
+        """
+        Remembers the attributes that derived data (such as the ticket
+        counters) is bucketed by, so that changes to them can be detected
+        when the ticket is saved.
+        """
+        self._original_state = (self.project_id, self.status_id)
+        self._original_keywords = self.keywords
+        self._original_assignee = self.assigned_to_id
+
     def get_absolute_url(self):
         return ('ponymine_view_ticket', [], {'ticket_id': self.id})
     get_absolute_url = models.permalink(get_absolute_url)
 
     def _is_closed(self):
-        return self.status.is_closed
+        return self.status_id in Ticket.objects.closed_statuses
     is_closed = property(_is_closed)
 
     def keyword_list(self):
-        return self.keywords.split(',')
+        return normalize_keywords(self.keywords)
 
     class Meta:
         ordering = ('-priority__order', '-date_created',)
 
+class ProjectStatusCount(models.Model):
+    """
+    The number of tickets in a project that have a particular status.
+    """
+    project = models.ForeignKey(Project, related_name='status_counts')
+    status = models.ForeignKey(Status)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('project', 'status')
+
 class Log(models.Model):
     """
     Maintains a history of changes to a ticket.
@@ -276,3 +490,108 @@ class ChangeLog(models.Model):
                                        self.content_type,
                                        self.old_object,
                                        self.new_object)
+
+class InboundMessage(models.Model):
+    """
+    Remembers which messages of a mailbox have been processed (see
+    `ponymine.email.utils`), by their POP3 unique ID, so that none of them is
+    turned into a ticket twice.
+    """
+    mailbox = models.CharField(max_length=150)
+    uid = models.CharField(max_length=70)
+    ticket = models.ForeignKey(Ticket, **BLNL)
+    log = models.ForeignKey(Log, **BLNL)
+    date_processed = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('mailbox', 'uid')
+
+class Activity(models.Model):
+    """
+    An append-only record of something that happened in a project.  Rows
+    are written as things happen (see `ponymine.activity`) so that activity
+    feeds are a range scan over one table instead of a merge of tickets,
+    logs and changes.
+    """
+    KINDS = (
+        ('ticket_created', _('Ticket created')),
+        ('ticket_changed', _('Ticket changed')),
+        ('member_added', _('Member added')),
+        ('project_created', _('Project created')),
+        ('project_changed', _('Project changed')),
+    )
+
+    project = models.ForeignKey(Project, related_name='activity')
+    # who did it or, for memberships, who it happened to
+    user = models.ForeignKey(User, related_name='activity', **BLNL)
+    ticket = models.ForeignKey(Ticket, **BLNL)
+    log = models.ForeignKey(Log, **BLNL)
+    kind = models.CharField(max_length=20, choices=KINDS)
+    # copied so that feeds never have to look at the objects themselves
+    title = models.CharField(max_length=255)
+    summary = models.CharField(max_length=255, blank=True)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ('-created', '-id')
+        verbose_name_plural = 'activity'
+
+    def __unicode__(self):
+        return u'%s: %s' % (self.get_kind_display(), self.title)
+
+# keep the cached project memberships of each user honest
+signals.post_save.connect(permissions.membership_changed, sender=Membership)
+signals.post_delete.connect(permissions.membership_changed, sender=Membership)
+signals.post_save.connect(permissions.project_changed, sender=Project)
+signals.post_delete.connect(permissions.project_changed, sender=Project)
+
+# throw away cached project statistics when the underlying data changes
+for model in (Ticket, Component, Membership):
+    ponymine_signals.connect(signals.post_save, 'ponymine.stats.project_data_changed', model)
+    ponymine_signals.connect(signals.post_delete, 'ponymine.stats.project_data_changed', model)
+ponymine_signals.connect(ponymine_signals.tickets_updated, 'ponymine.stats.tickets_updated')
+ponymine_signals.connect(signals.post_save, 'ponymine.stats.component_changed', Component)
+ponymine_signals.connect(signals.post_delete, 'ponymine.stats.component_changed', Component)
+
+# maintain the denormalized ticket counters
+ponymine_signals.connect(signals.post_save, 'ponymine.counters.ticket_saved', Ticket)
+ponymine_signals.connect(signals.post_delete, 'ponymine.counters.ticket_deleted', Ticket)
+ponymine_signals.connect(ponymine_signals.tickets_updated, 'ponymine.counters.tickets_updated')
+ponymine_signals.connect(signals.pre_save, 'ponymine.counters.status_saving', Status)
+ponymine_signals.connect(signals.post_save, 'ponymine.counters.status_saved', Status)
+
+# keep the full-text index of tickets up to date
+ponymine_signals.connect(signals.post_save, 'ponymine.search.ticket_saved', Ticket)
+ponymine_signals.connect(signals.post_delete, 'ponymine.search.ticket_deleted', Ticket)
+ponymine_signals.connect(signals.post_save, 'ponymine.search.log_saved', Log)
+ponymine_signals.connect(ponymine_signals.logs_created, 'ponymine.search.logs_created')
+ponymine_signals.connect(ponymine_signals.tickets_updated, 'ponymine.search.tickets_updated')
+
+# keep the normalized keywords of tickets in sync
+ponymine_signals.connect(signals.post_save, 'ponymine.keywords.ticket_saved', Ticket)
+ponymine_signals.connect(ponymine_signals.tickets_updated, 'ponymine.keywords.tickets_updated')
+
+# throw away cached lookup tables when they change
+for model in (Role, TicketType, Status, Priority):
+    signals.post_save.connect(lookups.table_changed, sender=model)
+    signals.post_delete.connect(lookups.table_changed, sender=model)
+
+# stop using cached table rows of projects whose tickets or members change
+ponymine_signals.connect(signals.post_save, 'ponymine.fragments.ticket_changed', Ticket)
+ponymine_signals.connect(signals.post_delete, 'ponymine.fragments.ticket_changed', Ticket)
+ponymine_signals.connect(ponymine_signals.tickets_updated, 'ponymine.fragments.tickets_updated')
+ponymine_signals.connect(signals.post_save, 'ponymine.fragments.membership_changed', Membership)
+ponymine_signals.connect(signals.post_delete, 'ponymine.fragments.membership_changed', Membership)
+
+# record what happens in projects for the activity feeds
+ponymine_signals.connect(signals.post_save, 'ponymine.activity.ticket_saved', Ticket)
+ponymine_signals.connect(ponymine_signals.logs_created, 'ponymine.activity.logs_created')
+ponymine_signals.connect(signals.post_save, 'ponymine.activity.membership_saved', Membership)
+ponymine_signals.connect(signals.post_save, 'ponymine.activity.project_saved', Project)
+
+# throw away the cached Atom feeds that show changed tickets and projects
+ponymine_signals.connect(signals.post_save, 'ponymine.feeds.ticket_changed', Ticket)
+ponymine_signals.connect(signals.post_delete, 'ponymine.feeds.ticket_changed', Ticket)
+ponymine_signals.connect(ponymine_signals.tickets_updated, 'ponymine.feeds.tickets_updated')
+ponymine_signals.connect(ponymine_signals.logs_created, 'ponymine.feeds.logs_created')
+ponymine_signals.connect(signals.post_save, 'ponymine.feeds.project_changed', Project)
@@ -0,0 +1,173 @@
+"""
+Keyset ("cursor") pagination.
+
+Instead of counting the rows of a QuerySet and skipping over them with an
+OFFSET, each page remembers the ordering values of its first and last rows in
+an opaque token.  The next page is then a range query that continues from
+those values, so it costs the same no matter how deep into the list it is.
+"""
+from django.core.paginator import InvalidPage
+from django.db import connection
+from django.db.models import Q
+from django.utils import simplejson
+import base64
+import datetime
+import re
+
+class InvalidCursor(InvalidPage):
+    pass
+
+def _value_for(obj, field):
+    for attr in field.split('__'):
+        obj = getattr(obj, attr)
+        if obj is None:
+            break
+    return obj
+
+def _encode(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return str(value)
+    return value
+
+def estimate_count(queryset):
+    """
+    Returns the number of rows in `queryset` as estimated by the query
+    planner.  Databases that cannot estimate get an exact count instead.
+    """
+    if 'postgresql' in connection.settings_dict['ENGINE']:
+        sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+        cursor = connection.cursor()
+        cursor.execute('EXPLAIN ' + sql, params)
+        match = re.search(r'rows=(\d+)', cursor.fetchone()[0])
+        if match:
+            return int(match.group(1))
+    return queryset.count()
+
+class CursorPaginator(object):
+    """
+    Splits `queryset` into pages of `per_page` objects.  The ordering of the
+    QuerySet (or the default ordering of its model) is used as the key, with
+    the primary key added as a tiebreaker.  None of the ordering fields may
+    be NULL.
+    """
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        if not [f for f in ordering if f.lstrip('-') in ('id', 'pk')]:
+            # break ties in the same direction as the last field
+            ordering.append(ordering and ordering[-1].startswith('-') and '-id' or 'id')
+        self.ordering = ordering
+
+    def _get_count(self):
+        """
+        Returns an estimate of the total number of objects.
+        """
+        if not hasattr(self, '_count'):
+            self._count = estimate_count(self.queryset.order_by())
+        return self._count
+    count = property(_get_count)
+
+    def encode_cursor(self, obj, forward=True):
+        values = [_encode(_value_for(obj, f.lstrip('-'))) for f in self.ordering]
+        token = simplejson.dumps(values)
+        return (forward and 'n' or 'p') + base64.urlsafe_b64encode(token).rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """
+        Returns a `(forward, values)` tuple for `cursor`.
+        """
+        try:
+            forward = {'n': True, 'p': False}[cursor[0]]
+            token = str(cursor[1:])
+            values = simplejson.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        except (KeyError, IndexError, TypeError, ValueError, UnicodeError):
+            raise InvalidCursor('That cursor is not valid')
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise InvalidCursor('That cursor is not valid')
+        return forward, values
+
+    def _seek(self, values, forward):
+        """
+        Builds a filter that only matches the rows after (or before) the row
+        with the ordering `values`.
+        """
+        seek = Q()
+        for i, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            descending = field.startswith('-')
+            op = (descending == forward) and 'lt' or 'gt'
+
+            condition = Q(**{'%s__%s' % (name, op): values[i]})
+            for prev, value in zip(self.ordering[:i], values[:i]):
+                condition &= Q(**{prev.lstrip('-'): value})
+            seek |= condition
+        return seek
+
+    def page(self, cursor=None, strict=False):
+        """
+        Returns the page that starts after (or ends before) the row described
+        by `cursor`, or the first page when there is no cursor.  Invalid
+        cursors give the first page unless `strict` is set.
+        """
+        forward, values = True, None
+        if cursor:
+            try:
+                forward, values = self.decode_cursor(cursor)
+            except InvalidCursor:
+                if strict:
+                    raise
+
+        qs = self.queryset
+        if values is not None:
+            qs = qs.filter(self._seek(values, forward))
+
+        if forward:
+            qs = qs.order_by(*self.ordering)
+        else:
+            qs = qs.order_by(*[f.startswith('-') and f[1:] or '-' + f
+                               for f in self.ordering])
+
+        objects = list(qs[:self.per_page + 1])
+        has_more = len(objects) > self.per_page
+        objects = objects[:self.per_page]
+
+        if not forward:
+            if not has_more:
+                # we've reached the beginning, so show a full first page
+                return self.page()
+            objects.reverse()
+            return CursorPage(objects, self, has_next=True, has_previous=has_more)
+        return CursorPage(objects, self, has_next=has_more,
+                          has_previous=values is not None)
+
+class CursorPage(object):
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next and bool(object_list)
+        self._has_previous = has_previous and bool(object_list)
+
+    def __repr__(self):
+        return '<Page of %i objects>' % len(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    def next_cursor(self):
+        if self.has_next():
+            return self.paginator.encode_cursor(self.object_list[-1], True)
+
+    def previous_cursor(self):
+        if self.has_previous():
+            return self.paginator.encode_cursor(self.object_list[0], False)
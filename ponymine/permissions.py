@@ -0,0 +1,63 @@
+"""
+Keeps track of which projects a user is a member of.
+
+The project IDs are computed once per request and remembered on the user
+object.  When `PONYMINE_PERMISSION_CACHE_TIMEOUT` is set, they are also shared
+between requests through the cache; the shared entries are invalidated when
+`Membership` or `Project` rows change.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from ponymine.cache import make_key, get_version, bump_version
+
+CACHE_TIMEOUT = getattr(settings, 'PONYMINE_PERMISSION_CACHE_TIMEOUT', 0)
+
+def permission_version(user=None):
+    """
+    Returns a string that changes whenever the memberships of `user` or the
+    visibility of any project changes.
+    """
+    version = str(get_version('projects'))
+    if isinstance(user, User):
+        version += '.%s' % get_version('memberships', user.id)
+    return version
+
+def get_project_ids(user):
+    """
+    Returns a frozenset with the IDs of all projects that `user` is a member
+    of.
+    """
+    if not isinstance(user, User):
+        return frozenset()
+
+    ids = getattr(user, '_ponymine_project_ids', None)
+    if ids is None:
+        key = None
+        if CACHE_TIMEOUT:
+            version = get_version('memberships', user.id)
+            key = make_key('project_ids', user.id, version)
+            ids = cache.get(key)
+
+        if ids is None:
+            ids = frozenset(user.membership_set.values_list('project', flat=True))
+            if key:
+                cache.set(key, ids, CACHE_TIMEOUT)
+
+        user._ponymine_project_ids = ids
+    return ids
+
+def membership_changed(sender, instance, **kwargs):
+    """
+    Invalidates the cached project IDs of the user in a membership, and of
+    the user it belonged to before if that changed.
+    """
+    for user_id in set([instance.user_id, instance._original_state[1]]):
+        if user_id:
+            bump_version('memberships', user_id)
+
+def project_changed(sender, instance, **kwargs):
+    """
+    Invalidates anything that depends on the visibility of projects.
+    """
+    bump_version('projects')
@@ -0,0 +1,262 @@
+"""
+Full-text search for tickets.
+
+The subject, description, keywords and log notes of every ticket are kept in
+a full-text index that is updated as tickets and logs are saved.  SQLite uses
+an FTS5 table and PostgreSQL a table of tsvectors (both are created by the
+files in `ponymine/sql`).  Other databases fall back to case-insensitive
+substring matching.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from ponymine.models import Project, Ticket, Log, normalize_keywords
+
+SEARCH_CONFIG = getattr(settings, 'PONYMINE_SEARCH_CONFIG', 'english')
+
+# how many tickets to index at once when rebuilding the index
+CHUNK_SIZE = 500
+
+# the ticket fields that end up in the index, besides the notes of its logs
+INDEXED_FIELDS = set(['subject', 'description', 'keywords'])
+
+def _subquery(projects):
+    """
+    Returns the SQL and parameters of a query for the IDs of the projects in
+    the `projects` QuerySet.
+    """
+    query = projects.order_by().values('pk').query
+    return query.get_compiler(connection=connection).as_sql()
+
+def _document(ticket, notes):
+    return (ticket.subject, ticket.description,
+            u' '.join(normalize_keywords(ticket.keywords)), u'\n'.join(notes))
+
+class SearchBackend(object):
+    """
+    Falls back to substring matching for databases without full-text search.
+    """
+    def index(self, cursor, documents):
+        pass
+
+    def remove(self, cursor, ticket_ids):
+        pass
+
+    def _queryset(self, query, projects, keywords_only):
+        if keywords_only:
+            lookup = Q(keywords__icontains=query)
+        else:
+            lookup = Q(subject__icontains=query) | \
+                     Q(description__icontains=query) | \
+                     Q(keywords__icontains=query)
+        projects = projects.order_by().values('pk')
+        return Ticket.objects.filter(lookup, project__in=projects)
+
+    def match(self, query, projects, keywords_only, limit, offset):
+        qs = self._queryset(query, projects, keywords_only)
+        qs = qs.values_list('id', flat=True)[offset:]
+        if limit is not None:
+            qs = qs[:limit]
+        return list(qs)
+
+    def count(self, query, projects, keywords_only):
+        return self._queryset(query, projects, keywords_only).count()
+
+class SQLiteSearchBackend(SearchBackend):
+    """
+    Uses an FTS5 virtual table whose rowids are ticket IDs.
+    """
+    def index(self, cursor, documents):
+        self.remove(cursor, [pk for pk, doc in documents])
+        cursor.executemany('INSERT INTO ponymine_ticket_fts '
+                           '(rowid, subject, description, keywords, notes) '
+                           'VALUES (%s, %s, %s, %s, %s)',
+                           [(pk,) + doc for pk, doc in documents])
+
+    def remove(self, cursor, ticket_ids):
+        cursor.executemany('DELETE FROM ponymine_ticket_fts WHERE rowid = %s',
+                           [(pk,) for pk in ticket_ids])
+
+    def _where(self, query, projects, keywords_only):
+        # quote every term so that user input is never parsed as FTS syntax
+        terms = ['"%s"' % t.replace('"', '""') for t in query.split()]
+        expression = u' '.join(terms)
+        if keywords_only:
+            expression = u'keywords : (%s)' % expression
+        subquery, params = _subquery(projects)
+        sql = ('FROM ponymine_ticket_fts f '
+               'INNER JOIN ponymine_ticket t ON t.id = f.rowid '
+               'WHERE ponymine_ticket_fts MATCH %%s AND t.project_id IN (%s)' % subquery)
+        return sql, [expression] + list(params)
+
+    def match(self, query, projects, keywords_only, limit, offset):
+        where, params = self._where(query, projects, keywords_only)
+        cursor = connection.cursor()
+        cursor.execute('SELECT f.rowid ' + where + ' ORDER BY f.rank LIMIT %s OFFSET %s',
+                       params + [limit is None and -1 or limit, offset])
+        return [row[0] for row in cursor.fetchall()]
+
+    def count(self, query, projects, keywords_only):
+        where, params = self._where(query, projects, keywords_only)
+        cursor = connection.cursor()
+        cursor.execute('SELECT COUNT(*) ' + where, params)
+        return cursor.fetchone()[0]
+
+class PostgreSQLSearchBackend(SearchBackend):
+    """
+    Stores a weighted tsvector for each ticket in a separate table.
+    """
+    def index(self, cursor, documents):
+        self.remove(cursor, [pk for pk, doc in documents])
+        cursor.executemany('INSERT INTO ponymine_ticket_search '
+                           '(ticket_id, document, keywords) VALUES (%s, '
+                           'setweight(to_tsvector(%s, %s), \'A\') || '
+                           'setweight(to_tsvector(%s, %s), \'B\') || '
+                           'setweight(to_tsvector(\'simple\', %s), \'A\') || '
+                           'setweight(to_tsvector(%s, %s), \'C\'), '
+                           'to_tsvector(\'simple\', %s))',
+                           [(pk, SEARCH_CONFIG, subject, SEARCH_CONFIG,
+                             description, keywords, SEARCH_CONFIG, notes,
+                             keywords)
+                            for pk, (subject, description, keywords, notes)
+                            in documents])
+
+    def remove(self, cursor, ticket_ids):
+        cursor.execute('DELETE FROM ponymine_ticket_search '
+                       'WHERE ticket_id = ANY(%s)', [list(ticket_ids)])
+
+    def _where(self, query, projects, keywords_only):
+        if keywords_only:
+            condition = 's.keywords @@ plainto_tsquery(\'simple\', %s)'
+            params = [query.lower()]
+        else:
+            condition = 's.document @@ plainto_tsquery(%s, %s)'
+            params = [SEARCH_CONFIG, query]
+        subquery, subquery_params = _subquery(projects)
+        sql = ('FROM ponymine_ticket_search s '
+               'INNER JOIN ponymine_ticket t ON t.id = s.ticket_id '
+               'WHERE %s AND t.project_id IN (%s)' % (condition, subquery))
+        return sql, params + list(subquery_params)
+
+    def match(self, query, projects, keywords_only, limit, offset):
+        where, params = self._where(query, projects, keywords_only)
+        cursor = connection.cursor()
+        cursor.execute('SELECT s.ticket_id ' + where +
+                       ' ORDER BY ts_rank(s.document, plainto_tsquery(%s, %s)) DESC,'
+                       ' t.id DESC LIMIT %s OFFSET %s',
+                       params + [SEARCH_CONFIG, query, limit, offset])
+        return [row[0] for row in cursor.fetchall()]
+
+    def count(self, query, projects, keywords_only):
+        where, params = self._where(query, projects, keywords_only)
+        cursor = connection.cursor()
+        cursor.execute('SELECT COUNT(*) ' + where, params)
+        return cursor.fetchone()[0]
+
+def get_backend():
+    engine = connection.settings_dict['ENGINE']
+    if engine.endswith('sqlite3'):
+        return SQLiteSearchBackend()
+    if 'postgresql' in engine:
+        return PostgreSQLSearchBackend()
+    return SearchBackend()
+
+class SearchResults(object):
+    """
+    A lazily evaluated list of the tickets in the `projects` QuerySet that
+    match, ordered by relevance.  It supports `count` and slicing so it can
+    be handed to a `Paginator`.
+    """
+    def __init__(self, query, projects, keywords_only=False):
+        self.query = query
+        self.projects = projects
+        self.keywords_only = keywords_only
+        self.backend = get_backend()
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            if not self.query.strip():
+                self._count = 0
+            else:
+                self._count = self.backend.count(self.query, self.projects,
+                                                 self.keywords_only)
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        if not self.query.strip():
+            return []
+
+        offset = index.start or 0
+        limit = index.stop is not None and index.stop - offset or None
+        ids = self.backend.match(self.query, self.projects,
+                                 self.keywords_only, limit, offset)
+        tickets = dict((t.id, t) for t in Ticket.objects.filter(pk__in=ids).listing())
+        return [tickets[pk] for pk in ids if pk in tickets]
+
+def search_tickets(query, user=None, keywords_only=False):
+    """
+    Searches the tickets in all projects that `user` may see for `query`.
+    When `keywords_only` is set, only the keywords of tickets are searched.
+    The projects are matched with a subquery, which for superusers is no
+    more than a check that the project is active.
+    """
+    return SearchResults(query, Project.objects.for_user(user), keywords_only)
+
+def index_tickets(tickets):
+    """
+    Adds `tickets` to the search index, replacing any previous entries.
+    """
+    tickets = list(tickets)
+    if not tickets:
+        return
+
+    notes = {}
+    logs = Log.objects.filter(ticket__in=[t.id for t in tickets]).exclude(notes='')
+    for ticket_id, note in logs.order_by('id').values_list('ticket', 'notes'):
+        notes.setdefault(ticket_id, []).append(note)
+
+    documents = [(t.id, _document(t, notes.get(t.id, []))) for t in tickets]
+    get_backend().index(connection.cursor(), documents)
+    transaction.commit_unless_managed()
+
+def rebuild_index(tickets=None):
+    """
+    Reindexes the tickets in the `tickets` QuerySet, or every ticket.
+    Returns the number of tickets indexed.
+    """
+    if tickets is None:
+        tickets = Ticket.objects.all()
+    count, last_id = 0, 0
+    while True:
+        chunk = list(tickets.filter(pk__gt=last_id).order_by('id')[:CHUNK_SIZE])
+        if not chunk:
+            break
+        index_tickets(chunk)
+        count += len(chunk)
+        last_id = chunk[-1].id
+    return count
+
+def ticket_saved(sender, instance, **kwargs):
+    index_tickets([instance])
+
+def tickets_updated(sender, tickets, fields, **kwargs):
+    if INDEXED_FIELDS.intersection(fields):
+        index_tickets(tickets)
+
+def ticket_deleted(sender, instance, **kwargs):
+    get_backend().remove(connection.cursor(), [instance.id])
+    transaction.commit_unless_managed()
+
+def log_saved(sender, instance, **kwargs):
+    index_tickets(Ticket.objects.filter(pk=instance.ticket_id))
+
+def logs_created(sender, logs, **kwargs):
+    ticket_ids = [log.ticket_id for log in logs if log.notes]
+    if ticket_ids:
+        index_tickets(Ticket.objects.filter(pk__in=ticket_ids))
@@ -0,0 +1,26 @@
+from django.dispatch import Signal
+from django.utils.importlib import import_module
+
+# sent once the logs of one or more ticket changes have been written, with
+# the ChangeLog rows of each log available as its `change_list` attribute
+logs_created = Signal(providing_args=['logs'])
+
+# sent once `tickets` have had the ticket fields named in `fields` changed
+# with an UPDATE, which sends no post_save; the `_original_*` attributes of
+# each ticket still hold the state it had before the change
+tickets_updated = Signal(providing_args=['tickets', 'fields'])
+
+def connect(signal, handler, sender=None):
+    """
+    Connects the function named by the dotted path `handler` to `signal`.
+    Its module is only imported when the signal is first sent, so modules
+    that handle model signals may import the models themselves without
+    creating an import cycle.
+    """
+    module, name = handler.rsplit('.', 1)
+
+    def receiver(sender, **kwargs):
+        return getattr(import_module(module), name)(sender, **kwargs)
+
+    # nothing else refers to the receiver, so it mustn't be a weak reference
+    signal.connect(receiver, sender=sender, weak=False, dispatch_uid=handler)
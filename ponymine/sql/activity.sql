@@ -0,0 +1,3 @@
+-- the activity feeds of a project and of a user, see ponymine.activity
+CREATE INDEX ponymine_activity_project_created ON ponymine_activity (project_id, created);
+CREATE INDEX ponymine_activity_user_created ON ponymine_activity (user_id, created);
@@ -0,0 +1,2 @@
+-- at most one default priority, see AttributeWithDefault.save
+CREATE UNIQUE INDEX ponymine_priority_one_default ON ponymine_priority (is_default) WHERE is_default;
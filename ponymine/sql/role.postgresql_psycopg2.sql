@@ -0,0 +1,2 @@
+-- at most one default role, see AttributeWithDefault.save
+CREATE UNIQUE INDEX ponymine_role_one_default ON ponymine_role (is_default) WHERE is_default;
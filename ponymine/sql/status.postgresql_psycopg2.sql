@@ -0,0 +1,2 @@
+-- at most one default status, see AttributeWithDefault.save
+CREATE UNIQUE INDEX ponymine_status_one_default ON ponymine_status (is_default) WHERE is_default;
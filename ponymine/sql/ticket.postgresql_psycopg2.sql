@@ -0,0 +1,8 @@
+-- full-text index of tickets, maintained by ponymine.search
+CREATE TABLE ponymine_ticket_search (
+    ticket_id integer NOT NULL PRIMARY KEY REFERENCES ponymine_ticket (id) ON DELETE CASCADE,
+    document tsvector NOT NULL,
+    keywords tsvector NOT NULL
+);
+CREATE INDEX ponymine_ticket_search_document ON ponymine_ticket_search USING gin (document);
+CREATE INDEX ponymine_ticket_search_keywords ON ponymine_ticket_search USING gin (keywords);
@@ -0,0 +1,2 @@
+-- full-text index of tickets, maintained by ponymine.search
+CREATE VIRTUAL TABLE ponymine_ticket_fts USING fts5(subject, description, keywords, notes, tokenize = 'porter unicode61');
@@ -0,0 +1,2 @@
+-- at most one default tickettype, see AttributeWithDefault.save
+CREATE UNIQUE INDEX ponymine_tickettype_one_default ON ponymine_tickettype (is_default) WHERE is_default;
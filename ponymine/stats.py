@@ -0,0 +1,137 @@
+"""
+Aggregated ticket and membership statistics for projects.  Summaries are
+cached and thrown away whenever the tickets, components or memberships of a
+project change, or any of the lookup tables they show the names of.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+from ponymine.cache import make_key, get_version, bump_version
+from ponymine.fragments import touch_projects
+from ponymine.keywords import keyword_counts
+from ponymine.lookups import tables_version
+from ponymine.models import Project, Ticket, TicketType, Status, Priority, Component, \
+    Role, Membership
+from ponymine.permissions import permission_version
+
+CACHE_TIMEOUT = getattr(settings, 'PONYMINE_STATS_CACHE_TIMEOUT', 60 * 60)
+
+# ticket attributes that tickets are counted by
+DIMENSIONS = ('ticket_type', 'status', 'priority', 'component')
+
+# lookup tables whose names and closed statuses end up in a summary
+LOOKUP_MODELS = (TicketType, Status, Priority, Role)
+
+def count_tickets(tickets):
+    """
+    Counts the open and total tickets in the `tickets` QuerySet for each
+    ticket type, status, priority and component using one grouped query.
+    Returns a dictionary mapping each attribute in `DIMENSIONS` to another
+    dictionary of `{id: [open, total]}`.
+    """
+    closed = set(Ticket.objects.closed_statuses)
+    counts = dict((attr, {}) for attr in DIMENSIONS)
+
+    rows = tickets.order_by().values(*DIMENSIONS).annotate(count=Count('id'))
+    for row in rows:
+        is_open = row['status'] not in closed
+        for attr in DIMENSIONS:
+            if row[attr] is None:
+                continue
+            bucket = counts[attr].setdefault(row[attr], [0, 0])
+            if is_open:
+                bucket[0] += row['count']
+            bucket[1] += row['count']
+
+    return counts
+
+def _label_counts(objects, counts):
+    """
+    Pairs the name of each object with its `(open, total)` counts.
+    """
+    return [(obj.name, tuple(counts.get(obj.id, (0, 0)))) for obj in objects]
+
+def build_project_summary(project, projects=None):
+    """
+    Computes the statistics shown on the summary page of `project`.  The
+    tickets and components are counted across the `projects` QuerySet if it
+    is given (to roll up subprojects, for example) and only for `project`
+    otherwise.
+    """
+    if projects is None:
+        tickets = Ticket.objects.filter(project=project)
+        components = Component.objects.filter(project=project)
+    else:
+        tickets = Ticket.objects.filter(project__in=projects.values('pk'))
+        components = Component.objects.filter(project__in=projects.values('pk'))
+    counts = count_tickets(tickets)
+
+    members = {}
+    mems = Membership.objects.filter(project=project).select_related('user')
+    for m in mems.order_by('user__username'):
+        members.setdefault(m.role_id, []).append(m.user)
+
+    return {
+        'ticket_types': _label_counts(TicketType.objects.cached(), counts['ticket_type']),
+        'statuses': _label_counts(Status.objects.cached(), counts['status']),
+        'priorities': _label_counts(Priority.objects.cached(), counts['priority']),
+        'components': _label_counts(components, counts['component']),
+        'roles': [(r.name, members.get(r.id, [])) for r in Role.objects.cached()],
+        'keywords': list(keyword_counts(tickets)),
+    }
+
+def get_project_summary(project):
+    """
+    Returns the (possibly cached) statistics for `project`.
+    """
+    key = make_key('summary', project.id, get_version('summary', project.id),
+                   tables_version(*LOOKUP_MODELS))
+    summary = cache.get(key)
+    if summary is None:
+        summary = build_project_summary(project)
+        cache.set(key, summary, CACHE_TIMEOUT)
+    return summary
+
+def get_subtree_summary(project, user=None):
+    """
+    Returns the (possibly cached) statistics for `project` and every project
+    below it that `user` may see.  Ticket, component and membership changes
+    touch the `date_updated` of their project, so the latest one in the
+    subtree tells whether a cached summary is still good.
+    """
+    projects = Project.objects.subtree(project, user)
+    latest = projects.aggregate(latest=Max('date_updated'))['latest']
+    key = make_key('summary', project.id, 'subtree', getattr(user, 'id', None),
+                   permission_version(user), get_version('summary', project.id),
+                   tables_version(*LOOKUP_MODELS), latest)
+    summary = cache.get(key)
+    if summary is None:
+        summary = build_project_summary(project, projects)
+        cache.set(key, summary, CACHE_TIMEOUT)
+    return summary
+
+def project_data_changed(sender, instance, **kwargs):
+    """
+    Invalidates the summary of the project that a ticket, component or
+    membership belongs to, and of the project it was moved from.
+    """
+    project_ids = set([instance.project_id])
+    original_state = getattr(instance, '_original_state', None)
+    if original_state:
+        project_ids.add(original_state[0])
+    for project_id in project_ids:
+        bump_version('summary', project_id)
+
+def tickets_updated(sender, tickets, **kwargs):
+    project_ids = set()
+    for ticket in tickets:
+        project_ids.update([ticket.project_id, ticket._original_state[0]])
+    for project_id in project_ids:
+        bump_version('summary', project_id)
+
+def component_changed(sender, instance, **kwargs):
+    """
+    Touches the project of a component, which the summaries of subtrees and
+    the ETags of project pages go by.
+    """
+    touch_projects(instance.project_id)
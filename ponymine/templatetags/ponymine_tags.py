@@ -0,0 +1,41 @@
+from django import template
+from ponymine import fragments
+
+register = template.Library()
+
+class RowCacheNode(template.Node):
+    def __init__(self, nodelist, obj, vary_on):
+        self.nodelist = nodelist
+        self.obj = obj
+        self.vary_on = vary_on
+
+    def render(self, context):
+        obj = self.obj.resolve(context)
+        vary_on = [v.resolve(context) for v in self.vary_on]
+        key = fragments.fragment_key('row', obj, *vary_on)
+
+        content = fragments.get_fragment(key)
+        if content is None:
+            content = self.nodelist.render(context)
+            fragments.set_fragment(key, content)
+        return content
+
+def rowcache(parser, token):
+    """
+    Caches the enclosed part of a template for a model instance until that
+    instance's `date_updated` or one of the lookup tables changes.
+    Additional arguments are also part of the cache key::
+
+        {% rowcache ticket ticket.project.name ticket.assigned_to %}
+            ...
+        {% endrowcache %}
+    """
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(u"'%s' takes at least one argument" % bits[0])
+
+    nodelist = parser.parse(('endrowcache',))
+    parser.delete_first_token()
+    return RowCacheNode(nodelist, parser.compile_filter(bits[1]),
+                        [parser.compile_filter(b) for b in bits[2:]])
+rowcache = register.tag(rowcache)
@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase
+from ponymine.models import Project, Membership, Role, Ticket
+from ponymine import fragments
+
+class ListQueryCountTest(TestCase):
+    """
+    The ticket and project lists should run the same number of queries no
+    matter how many rows they show.
+    """
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.login(username='admin', password='secret')
+        self.role = Role.objects.all()[0]
+        self.project = Project.objects.create(name='Root', slug='root', is_public=True)
+        self.rows = 0
+
+    def add_rows(self, count):
+        """
+        Adds `count` subprojects with a member each, and as many tickets.
+        """
+        for i in range(self.rows, self.rows + count):
+            project = Project.objects.create(name='Project %i' % i, slug='project-%i' % i,
+                                             parent=self.project, is_public=True)
+            Membership.objects.create(project=project, user=self.user, role=self.role)
+            Ticket.objects.create(project=self.project, subject='Ticket %i' % i,
+                                  description='', keywords='ui, docs',
+                                  reported_by=self.user, assigned_to=self.user)
+        self.rows += count
+
+    def count_queries(self, url):
+        # warm the lookup and permission caches, but render every row again
+        self.client.get(url)
+        fragments._local.clear()
+
+        debug = settings.DEBUG
+        settings.DEBUG = True
+        connection.queries = []
+        try:
+            response = self.client.get(url)
+        finally:
+            settings.DEBUG = debug
+
+        self.assertEqual(response.status_code, 200)
+        return len(connection.queries)
+
+    def assertConstantQueries(self, url):
+        self.add_rows(2)
+        few = self.count_queries(url)
+        self.add_rows(30)
+        many = self.count_queries(url)
+        self.assertEqual(few, many)
+
+    def test_project_list(self):
+        self.assertConstantQueries(reverse('ponymine_project_list'))
+
+    def test_project_tickets(self):
+        self.assertConstantQueries(reverse('ponymine_view_project_tickets',
+                                           args=[self.project.path]))
+
+    def test_tickets_with_keyword(self):
+        self.assertConstantQueries(reverse('ponymine_tickets_with_keyword',
+                                           args=['ui']))
@@ -1,5 +1,6 @@
+from django.conf import settings
 from django.conf.urls.defaults import *
-from views import projects, tickets, main
+from views import projects, tickets, main, feeds
 from forms import UpdateTicketForm
 
 urlpatterns = patterns('',
@@ -9,12 +10,16 @@ urlpatterns = patterns('',
     url(r'^project/(?P<path>.+)/edit/$', projects.edit_project, name='ponymine_edit_project'),
     url(r'^project/(?P<path>.+)/tickets/$', projects.view_project_tickets,
         name='ponymine_view_project_tickets'),
-    url(r'^project/(?P<path>.+)/tickets/page/(?P<page>\d+)/$', projects.view_project_tickets,
+    url(r'^project/(?P<path>.+)/tickets/page/(?P<cursor>[-\w]+)/$', projects.view_project_tickets,
         name='ponymine_view_project_ticket_page'),
+    url(r'^project/(?P<path>.+)/activity/$', projects.project_activity,
+        name='ponymine_project_activity'),
+    url(r'^project/(?P<path>.+)/activity/page/(?P<cursor>[-\w]+)/$', projects.project_activity,
+        name='ponymine_project_activity_page'),
     url(r'^project/(?P<path>.+)/$', projects.project_summary,
         name='ponymine_view_project_summary'),
 
-    url(r'^projects/(?P<page>\d+)/$', projects.project_list, name='ponymine_project_list_page'),
+    url(r'^projects/(?P<cursor>[-\w]+)/$', projects.project_list, name='ponymine_project_list_page'),
     url(r'^projects/$', projects.project_list, name='ponymine_project_list'),
 
     url(r'^ticket/(?P<path>.+)/new/$', tickets.create_ticket, name='ponymine_create_ticket'),
@@ -25,9 +30,34 @@ urlpatterns = patterns('',
         name='ponymine_update_ticket'),
     url(r'^ticket/(?P<ticket_id>\d+)/$', tickets.view_ticket, name='ponymine_view_ticket'),
 
-    url(r'^keyword/(?P<keyword>.*)/page/(?P<page>\d+)/$', tickets.tickets_with_keyword,
+    url(r'^keyword/(?P<keyword>.*)/page/(?P<cursor>[-\w]+)/$', tickets.tickets_with_keyword,
         name='ponymine_tickets_with_keyword_page'),
     url(r'^keyword/(?P<keyword>.*)/$', tickets.tickets_with_keyword, name='ponymine_tickets_with_keyword'),
+    url(r'^activity/(?P<username>[^/]+)/$', main.user_activity, name='ponymine_user_activity'),
+    url(r'^activity/(?P<username>[^/]+)/page/(?P<cursor>[-\w]+)/$', main.user_activity,
+        name='ponymine_user_activity_page'),
+    url(r'^search/$', tickets.search_tickets, name='ponymine_search_tickets'),
+    url(r'^export/(?P<format>csv|json)/$', tickets.export_tickets, name='ponymine_export_tickets'),
+
+    url(r'^feeds/project/(?P<path>.+)/$', feeds.project_feed, name='ponymine_project_feed'),
+    url(r'^feeds/ticket/(?P<ticket_id>\d+)/$', feeds.ticket_feed, name='ponymine_ticket_feed'),
+    url(r'^feeds/assigned/(?P<username>[^/]+)/$', feeds.assigned_feed, name='ponymine_assigned_feed'),
+    url(r'^feeds/keyword/(?P<keyword>.+)/$', feeds.keyword_feed, name='ponymine_keyword_feed'),
 
     url(r'^$', main.overview, name='ponymine_overview'),
 )
+
+if 'ponymine.ext.milestones' in settings.INSTALLED_APPS:
+    urlpatterns += patterns('',
+        url(r'^milestones/', include('ponymine.ext.milestones.urls')),
+    )
+
+if 'ponymine.ext.attachments' in settings.INSTALLED_APPS:
+    urlpatterns += patterns('',
+        url(r'^attachments/', include('ponymine.ext.attachments.urls')),
+    )
+
+if 'ponymine.ext.versioning' in settings.INSTALLED_APPS:
+    urlpatterns += patterns('',
+        url(r'^repositories/', include('ponymine.ext.versioning.urls')),
+    )
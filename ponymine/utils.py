@@ -1,6 +1,13 @@
+from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
+from django.db import connection, models, transaction
 from django.http import Http404
-from ponymine.models import Log, ChangeLog, Project
+from django.utils import translation
+from django.utils.hashcompat import md5_constructor
+from ponymine.models import Log, ChangeLog, Project, Ticket
+from ponymine import permissions, signals
+import copy
+import datetime
 
 def get_project_or_new(path, user=None):
     """
@@ -17,6 +24,17 @@ def get_project_or_new(path, user=None):
 
     return project
 
+def make_etag(request, *bits):
+    """
+    Builds an ETag for a page out of `bits`, which should describe the state
+    of everything shown on the page.  The user and the version of their
+    permissions are always part of it.
+    """
+    user = request.user
+    bits = (getattr(user, 'id', None), permissions.permission_version(user),
+            translation.get_language()) + bits
+    return md5_constructor(u'|'.join([unicode(b) for b in bits]).encode('utf-8')).hexdigest()
+
 def check_membership(project, user):
     """
     Raises an HTTP 404 error if `user` is not a member of `project` and the
@@ -25,37 +43,164 @@ def check_membership(project, user):
     if not project.is_public and not project.is_member(user):
         raise Http404
 
-def create_change_logs(request, old_ticket, new_ticket, notes=''):
+def bulk_insert(objects, with_pk=False):
     """
-    Looks for differences between two Ticket objects and creates a log of each
-    important difference that is detected.
+    Inserts `objects`, which must all be instances of the same model, using a
+    single INSERT statement.  Primary keys are not filled in (unless
+    `with_pk` is set, in which case every object must already have one) and
+    no signals are sent.  Fields with `auto_now` or `auto_now_add` that have
+    no value all share the same timestamp, which is returned.
     """
-    if old_ticket.id and old_ticket.id == new_ticket.id:
-        log = Log.objects.create(
-                    ticket=new_ticket,
-                    notes=notes,
-                    created_by=request.user
-                )
+    now = datetime.datetime.now()
+    if not objects:
+        return now
+
+    opts = objects[0]._meta
+    fields = [f for f in opts.local_fields
+              if with_pk or not isinstance(f, models.AutoField)]
+    rows = []
+    for obj in objects:
+        row = []
+        for f in fields:
+            value = getattr(obj, f.attname)
+            if value is None and (getattr(f, 'auto_now', False) or
+                                  getattr(f, 'auto_now_add', False)):
+                value = now
+                setattr(obj, f.attname, value)
+            row.append(f.get_db_prep_save(value, connection=connection))
+        rows.append(row)
+
+    qn = connection.ops.quote_name
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+            qn(opts.db_table),
+            ', '.join([qn(f.column) for f in fields]),
+            ', '.join(['%s'] * len(fields)))
+    connection.cursor().executemany(sql, rows)
+    transaction.commit_unless_managed()
+    return now
 
-        # ticket attributes to pay attention to
-        to_check = ('project', 'ticket_type', 'component',
-                    'assigned_to', 'status', 'priority')
+def insert_object(obj):
+    """
+    Inserts `obj` and fills in its primary key from the INSERT itself, the
+    way `save` does but without sending any signals.
+    """
+    fields = [f for f in obj._meta.local_fields if not isinstance(f, models.AutoField)]
+    values = [(f, f.get_db_prep_save(f.pre_save(obj, True), connection=connection))
+              for f in fields]
+    obj.pk = obj.__class__._base_manager._insert(values, return_id=True,
+                                                 using=connection.alias)
+    transaction.commit_unless_managed()
+    return obj
+
+# how many tickets to change with one UPDATE
+CHUNK_SIZE = 500
+
+# ticket attributes to pay attention to
+LOGGED_ATTRIBUTES = ('project', 'ticket_type', 'component',
+                     'assigned_to', 'status', 'priority')
+
+_content_types = {}
+
+def get_attribute_content_type(attr):
+    """
+    Returns the ContentType of the model that the ticket attribute `attr`
+    points at.  The map is warmed on first use and kept for the life of the
+    process.
+    """
+    if not _content_types:
+        for name in LOGGED_ATTRIBUTES:
+            model = Ticket._meta.get_field(name).rel.to
+            _content_types[name] = ContentType.objects.get_for_model(model)
+    return _content_types[attr]
+
+def log_ticket_changes(pairs, user=None, notes=''):
+    """
+    Writes a Log for each `(old_ticket, new_ticket)` pair in `pairs`, along
+    with a ChangeLog for every attribute that differs between the two.  The
+    logs are inserted one at a time so that each gets its ID back, and all
+    of their changes are written with one INSERT.  Returns the list of new
+    logs.
+    """
+    pairs = [(old, new) for old, new in pairs if old.id and old.id == new.id]
+    if not pairs:
+        return []
 
-        for attr in to_check:
-            old_val = getattr(old_ticket, attr, None)
-            new_val = getattr(new_ticket, attr, None)
+    if not isinstance(user, User):
+        user = None
+    logs = [insert_object(Log(ticket=new, notes=notes, created_by=user))
+            for old, new in pairs]
+
+    changes = []
+    for log, (old_ticket, new_ticket) in zip(logs, pairs):
+        log.change_list = []
+
+        for attr in LOGGED_ATTRIBUTES:
+            attname = Ticket._meta.get_field(attr).attname
+            old_id = getattr(old_ticket, attname, None)
+            new_id = getattr(new_ticket, attname, None)
 
             # don't log things that haven't changed
-            if old_val == new_val:
+            if old_id == new_id:
                 continue
 
-            model = old_val or new_val
-            if model:
-                change = ChangeLog(log=log)
-                ctype = ContentType.objects.get_for_model(model)
-                change.content_type = ctype
-                change.old_id = getattr(old_val, 'id', None)
-                change.new_id = getattr(new_val, 'id', None)
-                change.old_object = old_val
-                change.new_object = new_val
-                change.save()
+            change = ChangeLog(log=log,
+                               content_type=get_attribute_content_type(attr),
+                               old_id=old_id,
+                               new_id=new_id)
+            log.change_list.append(change)
+            changes.append(change)
+
+    bulk_insert(changes)
+    signals.logs_created.send(sender=Log, logs=logs)
+    return logs
+
+@transaction.commit_on_success
+def save_ticket(user, old_ticket, new_ticket, notes=''):
+    """
+    Saves `new_ticket` and logs how it differs from `old_ticket` as a single
+    transaction.
+    """
+    new_ticket.save()
+    log_ticket_changes([(old_ticket, new_ticket)], user, notes)
+    return new_ticket
+
+@transaction.commit_on_success
+def bulk_update_tickets(tickets, user=None, notes='', **changes):
+    """
+    Sets the attributes in `changes` (for example `status` or `assigned_to`)
+    on every ticket in `tickets` and logs the changes in bulk, all in one
+    transaction.  The tickets are written with an UPDATE per chunk rather
+    than saved one by one, so derived data is refreshed once for all of them
+    by the `tickets_updated` handlers.  Returns the list of new logs.
+    """
+    tickets = list(tickets)
+    if not tickets:
+        return []
+
+    now = datetime.datetime.now()
+    pairs = []
+    for ticket in tickets:
+        old_ticket = copy.copy(ticket)
+        for attr, value in changes.items():
+            setattr(ticket, attr, value)
+        ticket.date_updated = now
+        pairs.append((old_ticket, ticket))
+
+    for start in range(0, len(tickets), CHUNK_SIZE):
+        chunk = tickets[start:start + CHUNK_SIZE]
+        Ticket.objects.filter(pk__in=[t.id for t in chunk]) \
+                      .update(date_updated=now, **changes)
+        signals.tickets_updated.send(sender=Ticket, tickets=chunk,
+                                     fields=changes.keys())
+        for ticket in chunk:
+            ticket._remember_state()
+
+    return log_ticket_changes(pairs, user, notes)
+
+def create_change_logs(request, old_ticket, new_ticket, notes=''):
+    """
+    Looks for differences between two Ticket objects and creates a log of each
+    important difference that is detected.
+    """
+    logs = log_ticket_changes([(old_ticket, new_ticket)], request.user, notes)
+    return logs and logs[0] or None
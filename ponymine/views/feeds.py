@@ -0,0 +1,113 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.utils.hashcompat import md5_constructor
+from ponymine.cache import make_key, get_version
+from ponymine.feeds import CACHE_TIMEOUT, ProjectTicketsFeed, AssignedTicketsFeed, \
+    KeywordFeed, TicketHistoryFeed
+from ponymine.models import Project, Ticket
+from ponymine.permissions import get_project_ids, permission_version
+
+def _is_visible(user, project_id, is_public):
+    """
+    Tells whether `user` may see a project, the same way as
+    `Project.objects.for_user`.
+    """
+    if isinstance(user, User):
+        return user.is_superuser or project_id in get_project_ids(user)
+    return is_public
+
+def _cached_info(key, lookup):
+    info = cache.get(key)
+    if info is None:
+        info = lookup() or ()
+        cache.set(key, info, CACHE_TIMEOUT)
+    return info
+
+def _viewer_bits(user):
+    # feeds that span projects differ by who is looking at them
+    return (getattr(user, 'id', None), permission_version(user))
+
+def _serve(request, key, build):
+    """
+    Returns the feed cached under `key`, calling `build` for its generator
+    if it isn't cached.  The key already changes with the feed, so it makes
+    a good ETag too.
+    """
+    etag = '"%s"' % md5_constructor(key).hexdigest()
+    if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+        return HttpResponseNotModified()
+
+    xml = cache.get(key)
+    if xml is None:
+        xml = build().writeString('utf-8')
+        cache.set(key, xml, CACHE_TIMEOUT)
+
+    response = HttpResponse(xml, mimetype='application/atom+xml; charset=utf-8')
+    response['ETag'] = etag
+    return response
+
+def project_feed(request, path):
+    """
+    The most recently updated tickets of a project
+    """
+    def lookup():
+        project = Project.objects.with_path(path)
+        return project and (project.id, project.is_public)
+
+    info = _cached_info(make_key('feed-project', path.strip('/'), get_version('projects')),
+                        lookup)
+    if not info or not _is_visible(request.user, *info):
+        raise Http404()
+
+    project_id = info[0]
+    key = make_key('feed', 'project', project_id, get_version('feed', 'project', project_id))
+    return _serve(request, key, lambda: ProjectTicketsFeed().get_feed(
+            Project.objects.get(pk=project_id), request))
+
+def ticket_feed(request, ticket_id):
+    """
+    The latest changes made to a ticket
+    """
+    ticket_id = int(ticket_id)
+    version = get_version('feed', 'ticket', ticket_id)
+
+    def lookup():
+        tickets = Ticket.objects.filter(pk=ticket_id, project__is_active=True)
+        return tuple(tickets.values_list('project', 'project__is_public')[:1])
+
+    info = _cached_info(make_key('feed-ticket', ticket_id, version, get_version('projects')),
+                        lookup)
+    if not info or not _is_visible(request.user, *info[0]):
+        raise Http404()
+
+    key = make_key('feed', 'ticket', ticket_id, version)
+    return _serve(request, key, lambda: TicketHistoryFeed().get_feed(
+            Ticket.objects.select_related('ticket_type').get(pk=ticket_id), request))
+
+def assigned_feed(request, username):
+    """
+    The most recently updated tickets assigned to a user
+    """
+    def lookup():
+        return tuple(User.objects.filter(username=username).values_list('id', flat=True)[:1])
+
+    info = _cached_info(make_key('feed-user', username), lookup)
+    if not info:
+        raise Http404()
+
+    user_id = info[0]
+    key = make_key('feed', 'user', user_id, get_version('feed', 'user', user_id),
+                   *_viewer_bits(request.user))
+    return _serve(request, key, lambda: AssignedTicketsFeed(request.user).get_feed(
+            User.objects.get(pk=user_id), request))
+
+def keyword_feed(request, keyword):
+    """
+    The most recently updated tickets with a keyword
+    """
+    keyword = keyword.strip().lower()
+    key = make_key('feed', 'keyword', keyword, get_version('feed', 'keyword', keyword),
+                   *_viewer_bits(request.user))
+    return _serve(request, key, lambda: KeywordFeed(request.user).get_feed(
+            keyword, request))
@@ -1,8 +1,21 @@
-from django.core.paginator import Paginator
-from django.shortcuts import render_to_response as render
+from django.contrib.auth.models import User
+from django.db.models import Max
+from django.shortcuts import render_to_response as render, get_object_or_404
 from django.template import RequestContext
-from ponymine.models import Project, Ticket
+from django.views.decorators.http import condition
+from ponymine.models import Activity, Project, Ticket
+from ponymine.paginator import CursorPaginator
+from ponymine import activity, utils
 
+def _overview_etag(request, *args, **kwargs):
+    # every ticket change touches its project, so the most recently updated
+    # project tells us whether anything on the page could have changed
+    latest = Project.objects.aggregate(latest=Max('date_updated'))['latest']
+    # ...except for the activity feed, which also shows notes
+    last_event = Activity.objects.aggregate(last=Max('id'))['last']
+    return utils.make_etag(request, latest, last_event)
+
+@condition(etag_func=_overview_etag)
 def overview(request, template='ponymine/overview.html'):
     """
     Offers a quick overview of the goings on in Ponymine to the user.
@@ -12,14 +25,20 @@ def overview(request, template='ponymine/overview.html'):
     # TODO: make this get all projects to which a user has access
     # (think membership of private projects)
     # get 5 projects
-    pqs = Project.objects.for_user(request.user)
-    proj_paginator = Paginator(pqs, 5, orphans=3)
-    proj_page = proj_paginator.page(1)
+    pqs = Project.objects.for_user(request.user).listing()
+    proj_paginator = CursorPaginator(pqs, 5)
+    proj_page = proj_paginator.page()
+    proj_page.object_list = Project.objects.prime_hierarchies(proj_page.object_list)
 
     # get 5 latest tickets
-    tqs = Ticket.objects.open(request.user)
-    tick_paginator = Paginator(tqs, 5)
-    tick_page = tick_paginator.page(1)
+    tqs = Ticket.objects.open(request.user).listing()
+    tick_paginator = CursorPaginator(tqs, 5)
+    tick_page = tick_paginator.page()
+
+    # the latest things that happened in the projects the user can see
+    events = activity.visible_activity(request.user).select_related('project', 'user')
+    activity_paginator = CursorPaginator(events, 10)
+    activity_page = activity_paginator.page()
 
     data['projects'] = {
             'paginator': proj_paginator,
@@ -29,13 +48,17 @@ def overview(request, template='ponymine/overview.html'):
             'paginator': tick_paginator,
             'page': tick_page
         }
+    data['activity'] = {
+            'paginator': activity_paginator,
+            'page': activity_page
+        }
 
     # get a list of recent ticket if the user is authenticated
     if request.user.is_authenticated():
-        qs = Ticket.objects.open()
+        qs = Ticket.objects.open().listing()
         qs = qs.filter(assigned_to=request.user).order_by('-date_created')
-        my_paginator = Paginator(qs, 5)
-        my_page = my_paginator.page(1)
+        my_paginator = CursorPaginator(qs, 5)
+        my_page = my_paginator.page()
 
         data['my_tickets'] = {
             'paginator': my_paginator,
@@ -43,3 +66,23 @@ def overview(request, template='ponymine/overview.html'):
         }
 
     return render(template, data, context_instance=RequestContext(request))
+
+def user_activity(request, username, cursor=None,
+    template='ponymine/user_activity.html'):
+    """
+    Lists what a user has been doing in the projects that the current user
+    can see, most recent first
+    """
+    data = {}
+    person = get_object_or_404(User, username=username)
+
+    events = activity.user_activity(person, request.user).select_related('project', 'user')
+    paginator = CursorPaginator(events, 50)
+    page_obj = paginator.page(cursor)
+
+    data['title'] = person.username
+    data['person'] = person
+    data['page'] = page_obj
+    data['activity_list'] = page_obj.object_list
+
+    return render(template, data, context_instance=RequestContext(request))
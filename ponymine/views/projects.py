@@ -1,17 +1,20 @@
 from django.contrib.auth.decorators import permission_required
 from django.contrib.auth.models import User
-from django.core.paginator import Paginator
+from django.db.models import Max
 from django.forms.formsets import formset_factory
 from django.http import Http404, HttpResponseRedirect
 from django.shortcuts import render_to_response as render
 from django.template import RequestContext
 from django.utils.translation import ugettext_lazy as _
+from django.views.decorators.http import condition
+from ponymine.cache import get_version
 from ponymine.forms import ProjectForm, MembershipForm
-from ponymine.models import Project, Membership, Ticket, TicketType, Role, \
-    Membership
-from ponymine import utils
+from ponymine.lookups import tables_version
+from ponymine.models import Project, Membership, Ticket
+from ponymine.paginator import CursorPaginator
+from ponymine import activity, stats, utils
 
-def project_list(request, page=1, template='ponymine/project_list.html'):
+def project_list(request, cursor=None, template='ponymine/project_list.html'):
     """
     Displays a list of projects
     """
@@ -19,20 +22,35 @@ def project_list(request, page=1, template='ponymine/project_list.html'):
 
     # TODO: make this retrieve all projects that a user has access to
     # (think membership in private projects)
-    projects = Project.objects.for_user(request.user)
-    paginator = Paginator(projects, 50, orphans=5)
-    page_obj = paginator.page(page)
+    projects = Project.objects.for_user(request.user).listing()
+    paginator = CursorPaginator(projects, 50)
+    page_obj = paginator.page(cursor)
 
     data['title'] = _('Project List')
     data['page'] = page_obj
     data['paginator'] = paginator
-    data['project_list'] = page_obj.object_list
+    data['project_list'] = Project.objects.prime_hierarchies(page_obj.object_list)
 
     return render(template, data, context_instance=RequestContext(request))
 
+def _include_subprojects(request):
+    return request.GET.get('subprojects') == '1'
+
+def _project_etag(request, path, cursor=None, *args, **kwargs):
+    project = Project.objects.with_path(path, request.user)
+    if project:
+        latest = project.get_descendants(include_self=True) \
+                        .aggregate(latest=Max('date_updated'))['latest']
+        return utils.make_etag(request, project.id, latest, cursor,
+                               _include_subprojects(request),
+                               get_version('summary', project.id),
+                               tables_version(*stats.LOOKUP_MODELS))
+
+@condition(etag_func=_project_etag)
 def project_summary(request, path, template='ponymine/project_summary.html'):
     """
-    Offers the user a brief overview of the project described by `path`
+    Offers the user a brief overview of the project described by `path`.
+    Add `subprojects=1` to count the tickets of all projects below it too.
     """
     data = {}
 
@@ -46,15 +64,23 @@ def project_summary(request, path, template='ponymine/project_summary.html'):
 
     data['title'] = _('Summary')
     data['project'] = project
-    data['ticket_types'] = ((tt.name, (project.tickets.open().filter(ticket_type=tt).count(), project.tickets.filter(ticket_type=tt).count())) for tt in TicketType.objects.all())
-    data['roles'] = ((r.name, (m.user for m in Membership.objects.filter(project=project, role=r))) for r in Role.objects.all())
+    data['subprojects_included'] = _include_subprojects(request)
+    if data['subprojects_included']:
+        data.update(stats.get_subtree_summary(project, request.user))
+    else:
+        data.update(stats.get_project_summary(project))
+
+    subprojects = project.subprojects.active(request.user).listing()
+    data['subprojects'] = Project.objects.prime_hierarchies(subprojects)
 
     return render(template, data, context_instance=RequestContext(request))
 
-def view_project_tickets(request, path, page=1,
+@condition(etag_func=_project_etag)
+def view_project_tickets(request, path, cursor=None,
     template='ponymine/project_detail.html'):
     """
-    Displays information about the project indicated by `path`
+    Displays information about the project indicated by `path`.  Add
+    `subprojects=1` to list the tickets of all projects below it too.
     """
     data = {}
 
@@ -65,15 +91,48 @@ def view_project_tickets(request, path, page=1,
         raise Http404()
 
     # get a list of tickets for this project
-    tickets = Ticket.objects.filter(project=project)
-    paginator = Paginator(tickets, 50, orphans=5)
-    page_obj = paginator.page(page)
+    subprojects_included = _include_subprojects(request)
+    if subprojects_included:
+        tickets = Ticket.objects.in_subtree(project, request.user)
+    else:
+        tickets = Ticket.objects.filter(project=project)
+    tickets = tickets.listing()
+    paginator = CursorPaginator(tickets, 50)
+    page_obj = paginator.page(cursor)
 
     data['title'] = _('Tickets')
     data['project'] = project
     data['page'] = page_obj
     data['paginator'] = paginator
     data['ticket_list'] = page_obj.object_list
+    data['subprojects_included'] = subprojects_included
+
+    return render(template, data, context_instance=RequestContext(request))
+
+def project_activity(request, path, cursor=None,
+    template='ponymine/project_activity.html'):
+    """
+    Lists what has been happening in the project described by `path`, most
+    recent first
+    """
+    data = {}
+
+    project = Project.objects.with_path(path, request.user)
+
+    # raise a 404 if no project matches the path
+    if not project:
+        raise Http404()
+
+    utils.check_membership(project, request.user)
+
+    events = activity.project_activity(project).select_related('project', 'user')
+    paginator = CursorPaginator(events, 50)
+    page_obj = paginator.page(cursor)
+
+    data['title'] = _('Activity')
+    data['project'] = project
+    data['page'] = page_obj
+    data['activity_list'] = page_obj.object_list
 
     return render(template, data, context_instance=RequestContext(request))
 
@@ -107,17 +166,25 @@ def edit_project(request, path=None, template='ponymine/edit_project.html',
         if form.is_valid() and memberships.is_valid():
             new_proj = form.save()
 
-            # clear the previous memberships
-            Membership.objects.filter(project=new_proj).delete()
-
-            # set the memberships for this project
+            # find the memberships this project should have
+            roles = {}
             for info in memberships.cleaned_data:
                 # make sure we're not supposed to be removing this membership
                 if len(info) and not info.get('remove', False):
-                    membership = Membership.objects.create(
-                                    project=new_proj,
-                                    user=info.get('user'),
-                                    role=info.get('role'))
+                    roles[info.get('user')] = info.get('role')
+
+            # only touch the memberships that changed, so that members who
+            # stay don't show up as added in the activity feed again
+            for membership in Membership.objects.filter(project=new_proj).select_related('user'):
+                role = roles.pop(membership.user, None)
+                if role is None:
+                    membership.delete()
+                elif role.id != membership.role_id:
+                    membership.role = role
+                    membership.save()
+
+            for user, role in roles.items():
+                Membership.objects.create(project=new_proj, user=user, role=role)
 
             # redirect the user to the proper page
             if not redirect_url:
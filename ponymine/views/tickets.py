@@ -1,28 +1,47 @@
+from django.conf import settings
 from django.contrib.auth.decorators import permission_required
 from django.contrib.auth.models import User
-from django.core.paginator import Paginator
-from django.http import Http404, HttpResponseRedirect
+from django.core.paginator import Paginator, EmptyPage, InvalidPage
+from django.db.models import Max
+from django.http import Http404, HttpResponse, HttpResponseRedirect
 from django.shortcuts import render_to_response as render, get_object_or_404
 from django.template import RequestContext
 from django.utils.translation import ugettext_lazy as _
+from django.views.decorators.http import condition
 from ponymine.forms import TicketForm, UpdateTicketForm, ChangeStatusForm
 from ponymine.models import Project, Ticket, Status
-from ponymine import utils
+from ponymine.paginator import CursorPaginator
+from ponymine import export, history, search, utils
 import copy
 
+def _ticket_etag(request, ticket_id, *args, **kwargs):
+    # logs may be written without saving the ticket (mail replies, commits
+    # that refer to it), so the latest one is part of the ETag as well
+    rows = Ticket.objects.filter(pk=ticket_id).annotate(last_log=Max('log__id')) \
+                         .values_list('date_updated', 'project__date_updated', 'last_log')
+    if rows:
+        return utils.make_etag(request, ticket_id, *rows[0])
+
+@condition(etag_func=_ticket_etag)
 def view_ticket(request, ticket_id, template='ponymine/ticket_detail.html'):
     """
     Displays a ticket
     """
     data = {}
-    ticket = get_object_or_404(Ticket, pk=ticket_id)
+    ticket = get_object_or_404(Ticket.objects.select_related('project',
+                'ticket_type', 'status', 'priority', 'component',
+                'assigned_to', 'reported_by'), pk=ticket_id)
 
     utils.check_membership(ticket.project, request.user)
 
     data['title'] = ticket.__unicode__()
     data['ticket'] = ticket
+    data['history'] = history.load_history(ticket)
     data['project'] = ticket.project
     data['change_status_form'] = ChangeStatusForm()
+    if 'ponymine.ext.attachments' in settings.INSTALLED_APPS:
+        data['attachments_enabled'] = True
+        data['attachments'] = ticket.attachments.select_related('blob')
 
     return render(template, data, context_instance=RequestContext(request))
 
@@ -64,23 +83,23 @@ def edit_ticket(request, ticket_id=None, project=None,
     utils.check_membership(project, request.user)
 
     if request.method == "POST":
+        # copy the existing ticket so we can make the change log (validating
+        # the form updates the instance)
+        old_ticket = copy.copy(ticket)
+
         form = form_class(request.POST, instance=ticket)
         if form.is_valid():
-            # copy the existing ticket so we can make the change log
-            old_ticket = copy.copy(ticket)
-
             # create or update the ticket
             new_ticket = form.save(commit=False)
             if not new_ticket.id:
                 new_ticket.reported_by = request.user
                 new_ticket.project = project
-            new_ticket.save()
 
-            # log any differences between the tickets
-            utils.create_change_logs(request,
-                                     old_ticket,
-                                     new_ticket,
-                                     form.cleaned_data.get('notes', ''))
+            # save the ticket and log any differences in one transaction
+            utils.save_ticket(request.user,
+                              old_ticket,
+                              new_ticket,
+                              form.cleaned_data.get('notes', ''))
 
             # determine where the user should go after saving the ticket
             if not redirect_url:
@@ -105,20 +124,67 @@ def edit_ticket(request, ticket_id=None, project=None,
 
     return render(template, data, context_instance=RequestContext(request))
 
-def tickets_with_keyword(request, keyword, page=1,
+def tickets_with_keyword(request, keyword, cursor=None,
     template='ponymine/tickets_with_keyword.html'):
     """
     Searches for tickets with a particular keyword.
     """
     data = {}
 
-    tickets = Ticket.objects.filter(keywords__icontains=keyword)
+    projects = Project.objects.for_user(request.user).values('pk')
+    tickets = Ticket.objects.filter(tags__name=keyword.strip().lower(),
+                                    project__in=projects).listing()
+    paginator = CursorPaginator(tickets, 50)
+    page_obj = paginator.page(cursor)
+
+    data['title'] = _('Search Results')
+    data['keyword'] = keyword
+    data['page'] = page_obj
+    data['paginator'] = paginator
+    data['object_list'] = page_obj.object_list
+
+    return render(template, data, context_instance=RequestContext(request))
+
+def search_tickets(request, template='ponymine/search_results.html'):
+    """
+    Searches the subject, description, keywords and notes of all tickets that
+    the user has access to.
+    """
+    data = {}
+
+    query = request.GET.get('q', '')
+    tickets = search.search_tickets(query, request.user)
     paginator = Paginator(tickets, 50, orphans=5)
-    page_obj = paginator.page(page)
+    try:
+        page_obj = paginator.page(request.GET.get('page', 1))
+    except (EmptyPage, InvalidPage):
+        page_obj = paginator.page(paginator.num_pages)
 
     data['title'] = _('Search Results')
+    data['query'] = query
     data['page'] = page_obj
     data['paginator'] = paginator
     data['object_list'] = page_obj.object_list
 
     return render(template, data, context_instance=RequestContext(request))
+
+def export_tickets(request, format='csv'):
+    """
+    Streams all tickets that the user has access to as CSV or JSON lines.
+    Pass `project` to limit the export to one project and `history=1` to
+    include the changes made to each ticket.
+    """
+    project = None
+    path = request.GET.get('project')
+    if path:
+        project = Project.objects.with_path(path, request.user)
+        if not project:
+            raise Http404()
+
+    include_history = request.GET.get('history') == '1'
+    tickets = export.visible_tickets(request.user, project)
+
+    response = HttpResponse(export.export_tickets(tickets, format, include_history),
+                            mimetype=export.FORMATS[format])
+    response['Content-Disposition'] = 'attachment; filename=tickets.%s' % format
+    return response